@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Replay terminal output streams and measure how fast wxterm keeps up.
+
+Each stream is fed, in chunks of what a pty read would return, to a
+headless :class:`wxterm.TerminalSession` (parse throughput), then to a
+:class:`wxterm.TerminalWindow` in an off-screen frame, one frame per
+chunk (render throughput). Rendering needs wxPython and an X display;
+on a server run it under a virtual one::
+
+    xvfb-run python benchmarks/replay.py --out results.json
+
+The built-in streams are generated, always the same, to look like
+``cat`` of a large file, ``ls -lR``, 256 colour ``htop`` redraws, vim
+scrolling and ``yes``. Recorded pty output can be added with
+``--stream name=path``. Each measure is the median of ``--repeat`` runs.
+Results are printed and, with ``--out``, saved as JSON; ``--compare``
+prints the change from a previous results file, and exits with status 1
+if a measure got worse by more than ``--threshold`` percent: rates
+(``*_s``, per second) are better higher, times (``*_ms``) lower.
+"""
+
+import argparse
+import codecs
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from wxterm import TerminalSession
+
+
+COLUMNS = 80
+LINES = 24
+
+# Bytes fed at a time, one frame each when rendering
+CHUNK_SIZE = 16 * 1024
+
+# Default number of runs of each measure, the median is kept
+REPEAT = 5
+
+# Default change of a measure, in percent for the worse, taken for a
+# regression by --compare
+THRESHOLD = 5.0
+
+# Whether a measure is better higher (1) or lower (-1), by suffix
+DIRECTIONS = (('_ms', -1), ('_s', 1))
+
+WORDS = ('the', 'terminal', 'screen', 'line', 'return', 'self', 'def',
+         'import', 'value', 'for', 'in', 'if', 'else', 'None', 'data')
+
+
+def _text_line(rnd, width):
+    words = []
+    size = 0
+    limit = rnd.randint(0, width)
+    while size < limit:
+        word = rnd.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return ' '.join(words)[:width]
+
+
+def cat_stream(rnd, size):
+    """Plain text lines, like ``cat`` of a source file."""
+    out = []
+    total = 0
+    while total < size:
+        line = (u' ' * 4 * rnd.randint(0, 3) + _text_line(rnd, 76) +
+                u'\r\n')
+        out.append(line)
+        total += len(line)
+    return u''.join(out)
+
+
+def ls_stream(rnd, size):
+    """Directory listings with coloured names, like ``ls -lR --color``."""
+    out = []
+    total = 0
+    n = 0
+    while total < size:
+        n += 1
+        lines = [u'\r\n./dir%d:\r\n' % n,
+                 u'total %d\r\n' % rnd.randint(0, 999)]
+        for _ in range(rnd.randint(1, 30)):
+            directory = rnd.random() < 0.2
+            name = u'%s%d' % (rnd.choice(WORDS), rnd.randint(0, 9999))
+            if directory:
+                name = u'\x1b[01;34m%s\x1b[0m' % name
+            lines.append(u'%s %2d user group %8d Jan %2d 12:%02d %s\r\n' % (
+                u'drwxr-xr-x' if directory else u'-rw-r--r--',
+                rnd.randint(1, 9), rnd.randint(0, 10 ** 7),
+                rnd.randint(1, 31), rnd.randint(0, 59), name))
+        chunk = u''.join(lines)
+        out.append(chunk)
+        total += len(chunk)
+    return u''.join(out)
+
+
+def htop_stream(rnd, size):
+    """Whole screen redraws with 256 colour bars, like ``htop``."""
+    out = []
+    total = 0
+    while total < size:
+        frame = [u'\x1b[H']
+        for row in range(1, LINES + 1):
+            frame.append(u'\x1b[%d;1H' % row)
+            if row <= 4:
+                used = rnd.randint(0, 60)
+                frame.append(u'%3d[' % row)
+                for i in range(used):
+                    frame.append(u'\x1b[38;5;%dm|' % (34 + i * 3 % 160))
+                frame.append(u'\x1b[0m%s%5.1f%%]' % (u' ' * (60 - used),
+                                                     used / 0.6))
+            else:
+                frame.append(u'\x1b[38;5;%dm%6d \x1b[38;5;250m%-8s %5.1f '
+                             u'%s' % (rnd.randint(16, 231),
+                                      rnd.randint(1, 99999), u'user',
+                                      rnd.random() * 100,
+                                      _text_line(rnd, 50)))
+            frame.append(u'\x1b[K')
+        chunk = u''.join(frame)
+        out.append(chunk)
+        total += len(chunk)
+    return u''.join(out)
+
+
+def vim_stream(rnd, size):
+    """Scrolling a file up and down in a scroll region, like vim."""
+    out = [u'\x1b[1;%dr' % (LINES - 1)]
+    total = 0
+    line = 0
+    while total < size:
+        line += 1
+        down = (line // 200) % 2 == 0
+        text = u'\x1b[33m%4d \x1b[36m%s\x1b[0m' % (line,
+                                                   _text_line(rnd, 70))
+        if down:
+            step = u'\x1b[%d;1H\n%s' % (LINES - 1, text)
+        else:
+            step = u'\x1b[1;1H\x1bM%s' % text
+        step += u'\x1b[%d;1H\x1b[7m"file.py" line %d\x1b[0m\x1b[K' % (
+            LINES, line)
+        out.append(step)
+        total += len(step)
+    return u''.join(out)
+
+
+def yes_stream(rnd, size):
+    """``yes``: the same short line over and over."""
+    return u'y\r\n' * (size // 3)
+
+
+STREAMS = [
+    ('cat', cat_stream),
+    ('ls-lR', ls_stream),
+    ('htop-256', htop_stream),
+    ('vim-scroll', vim_stream),
+    ('yes', yes_stream),
+]
+
+
+def _chunks(data, chunk_size):
+    # Decoded like the pty reader does, a chunk at a time
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    for i in range(0, len(data), chunk_size):
+        yield decoder.decode(data[i:i + chunk_size])
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[int(round(p * (len(values) - 1)))]
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def _repeat(bench, times):
+    # The median of each result of several runs of bench()
+    runs = [bench() for _ in range(times)]
+    return dict((key, _median([run[key] for run in runs]))
+                for key in runs[0])
+
+
+def _direction(key):
+    for suffix, direction in DIRECTIONS:
+        if key.endswith(suffix):
+            return direction
+    return 0
+
+
+def bench_parse(data, chunk_size):
+    session = TerminalSession(COLUMNS, LINES)
+    chunks = list(_chunks(data, chunk_size))
+    start = time.time()
+    for chunk in chunks:
+        session.feed(chunk)
+    elapsed = time.time() - start
+    return {'parse_mb_s': len(data) / elapsed / 1e6,
+            'parse_seconds': elapsed}
+
+
+class _Renderer(object):
+    # A TerminalWindow in a frame that is never shown on the screen
+    # (the window draws to its off-screen bitmap and the frame)
+
+    def __init__(self, renderer):
+        import wx
+        import wxterm
+        self.wx = wx
+        self.app = wx.App(False)
+        self.frame = wx.Frame(None, size=(800, 480))
+        self.term = wxterm.TerminalWindow(self.frame, renderer=renderer)
+        self.frame.Show()
+        self.pump()
+
+    def pump(self):
+        # Run what the window left to do with wx.CallAfter
+        for _ in range(10):
+            self.wx.SafeYield()
+
+    def run(self, data, chunk_size):
+        term = self.term
+        times = []
+        start = time.time()
+        for chunk in _chunks(data, chunk_size):
+            frame_start = time.time()
+            term.Feed(chunk)
+            times.append(time.time() - frame_start)
+        elapsed = time.time() - start
+        term.Feed(u'\x1b[2J\x1b[H')
+        self.pump()
+        return {'frames': len(times),
+                'frames_per_s': len(times) / elapsed,
+                'frame_p50_ms': _percentile(times, 0.5) * 1000,
+                'frame_p99_ms': _percentile(times, 0.99) * 1000}
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(results, previous, threshold):
+    """Print the change of each measure from the ``previous`` results.
+    Return those worse by more than ``threshold`` percent, as
+    ``(stream, measure)``."""
+    regressions = []
+    for name, metrics in sorted(results.items()):
+        old = previous.get(name)
+        if not old:
+            continue
+        changes = []
+        for key in sorted(metrics):
+            direction = _direction(key)
+            if not direction or not old.get(key):
+                continue
+            change = (metrics[key] - old[key]) * 100.0 / old[key]
+            worse = -change * direction > threshold
+            if worse:
+                regressions.append((name, key))
+            changes.append('%s %+.1f%%%s' % (key, change,
+                                             ' WORSE' if worse else ''))
+        print('%-12s %s' % (name, ', '.join(changes)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=float, default=1.0,
+                        help='MB of each generated stream (default 1)')
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE,
+                        help='bytes fed at a time (default %d)' % CHUNK_SIZE)
+    parser.add_argument('--only', action='append', metavar='NAME',
+                        help='run only this stream, may be repeated')
+    parser.add_argument('--stream', action='append', default=[],
+                        metavar='NAME=PATH', help='replay a recorded stream')
+    parser.add_argument('--no-render', action='store_true',
+                        help='only measure parsing')
+    parser.add_argument('--renderer', default='text',
+                        choices=('text', 'atlas'))
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help='runs of each measure, the median is kept '
+                        '(default %d)' % REPEAT)
+    parser.add_argument('--out', help='save the results as JSON')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='print the change from previous results')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        metavar='PERCENT',
+                        help='change for the worse failing --compare '
+                        '(default %g)' % THRESHOLD)
+    args = parser.parse_args()
+
+    size = int(args.size * 1024 * 1024)
+    streams = []
+    for name, generate in STREAMS:
+        if not args.only or name in args.only:
+            data = generate(random.Random(name), size).encode('utf-8')
+            streams.append((name, data))
+    for spec in args.stream:
+        name, path = spec.split('=', 1)
+        with open(path, 'rb') as f:
+            streams.append((name, f.read()))
+
+    renderer = None if args.no_render else _Renderer(args.renderer)
+
+    results = {}
+    for name, data in streams:
+        result = {'bytes': len(data)}
+        result.update(_repeat(lambda: bench_parse(data, args.chunk),
+                              args.repeat))
+        if renderer is not None:
+            result.update(_repeat(lambda: renderer.run(data, args.chunk),
+                                  args.repeat))
+        results[name] = result
+        print('%-12s %7.2f MB/s parsed' % (name, result['parse_mb_s']) + (
+            ', %7.1f frames/s, p50 %.2f ms, p99 %.2f ms' % (
+                result['frames_per_s'], result['frame_p50_ms'],
+                result['frame_p99_ms']) if renderer is not None else ''))
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = _compare(results, json.load(f)['results'],
+                                   args.threshold)
+
+    if args.out:
+        report = {
+            'commit': _commit(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'chunk': args.chunk,
+            'repeat': args.repeat,
+            'renderer': None if renderer is None else args.renderer,
+            'results': results,
+        }
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if regressions:
+        print('worse by more than %g%%: %s' % (
+            args.threshold, ', '.join('%s %s' % r for r in regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -64,6 +64,7 @@ class Terminal(wx.Panel):
             data = dlg.GetColourData()
             btn.pallete[btn.name] = data.GetColour()
             btn.SetBackgroundColour(data.GetColour())
+            self.term.RefreshColours()
         dlg.Destroy()
 
 if __name__ == '__main__':
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import unittest
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio sessions need 3.5')
+class SessionTest(unittest.TestCase):
+
+    def setUp(self):
+        import asyncio
+        from wxterm import aio
+        self.aio = aio
+        self.loop = asyncio.new_event_loop()
+        self.sessions = []
+
+    def tearDown(self):
+        for session in self.sessions:
+            session.close()
+        self.loop.close()
+
+    def spawn(self, script, **kwargs):
+        session = self.aio.Session('sh', ['sh', '-c', script], columns=20,
+                                   lines=3, loop=self.loop, **kwargs)
+        self.sessions.append(session)
+        return session
+
+    def complete(self, coro, timeout=10):
+        import asyncio
+        return self.loop.run_until_complete(asyncio.wait_for(coro, timeout))
+
+    def test_wait_for(self):
+        session = self.spawn('read line; echo "got $line"; exit 3')
+        session.write(u'hello\n')
+        self.complete(session.drain())
+        match = self.complete(session.wait_for('got hello'))
+        self.assertEqual(match.group(0), 'got hello')
+        self.assertEqual(session.display[1].rstrip(), u'got hello')
+        self.assertEqual(self.complete(session.wait_exit()), 3)
+        self.assertTrue(session.eof)
+
+    def test_killed(self):
+        session = self.spawn('kill -9 $$')
+        self.assertEqual(self.complete(session.wait_exit()), -9)
+        with self.assertRaises(EOFError):
+            self.complete(session.wait_for('never'))
+
+    def test_read_ahead(self):
+        # More output than the budget, read as it is parsed
+        session = self.spawn("head -c 200000 /dev/zero | tr '\\0' y",
+                             read_ahead=4096)
+        size = 0
+        while True:
+            data = self.complete(session.read())
+            if not data:
+                break
+            size += len(data)
+        self.assertEqual(size, 200000)
+        self.assertEqual(self.complete(session.wait_exit()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
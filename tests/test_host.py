@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from wxterm import styles
+from wxterm.host import RemoteSession
+from wxterm.scrollback import unpack_styles
+
+
+class RemoteSessionStylesTest(unittest.TestCase):
+
+    def setUp(self):
+        # Numbered differently from the table of the worker
+        styles.table.intern(("blue", "default", False, False, False, False,
+                             False))
+        self.session = RemoteSession(20, 3, scrollback=100)
+        self.closed = []
+        self.session.on_close = lambda: self.closed.append(True)
+
+    def tearDown(self):
+        self.session.close()
+
+    def run_child(self, script):
+        self.session.fork_command('sh', ['sh', '-c', script])
+        end = time.time() + 10
+        while not self.closed and time.time() < end:
+            self.session.parse_pending()
+            time.sleep(0.01)
+        self.session.wait()
+        self.session.parse_pending()
+
+    def test_coloured_output(self):
+        self.run_child(r'printf "\033[31mRED\033[0m\r\n\r\n\r\n'
+                       r'\033[32mGREEN\033[0m"')
+        session = self.session
+        text, runs = session.history.get(0)
+        sids = unpack_styles(runs)
+        self.assertEqual(text, u'RED')
+        self.assertEqual([styles.table[sid][styles.FG] for sid in sids],
+                         ['red'] * 3)
+        text, sids = session.screen.grid.row(2)
+        self.assertEqual(text.rstrip(), u'GREEN')
+        self.assertEqual([styles.table[sid][styles.FG] for sid in sids[:5]],
+                         ['green'] * 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import re
+import unittest
+
+from wxterm.matcher import OutputMatcher
+
+
+def _found(matches):
+    return [(name, match.group(0)) for name, match in matches]
+
+
+class OutputMatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = OutputMatcher()
+
+    def test_nothing_registered(self):
+        self.assertEqual(self.matcher.feed(u'anything'), [])
+        self.assertEqual(len(self.matcher), 0)
+
+    def test_literal_and_regex(self):
+        self.matcher.add('prompt', u'$ (')
+        self.matcher.add('number', re.compile(u'[0-9]+'))
+        self.assertEqual(len(self.matcher), 2)
+        self.assertEqual(_found(self.matcher.feed(u'12 $ (ab) 3')),
+                         [('number', u'12'), ('prompt', u'$ ('),
+                          ('number', u'3')])
+
+    def test_first_registered_wins(self):
+        self.matcher.add('short', u'err')
+        self.matcher.add('long', u'error')
+        self.assertEqual(_found(self.matcher.feed(u'an error')),
+                         [('short', u'err')])
+        # Added again, a pattern takes the place it had
+        self.matcher.add('short', u'er')
+        self.assertEqual(_found(self.matcher.feed(u' error')),
+                         [('short', u'er')])
+        self.matcher.remove('short')
+        self.assertEqual(_found(self.matcher.feed(u' error')),
+                         [('long', u'error')])
+        self.assertEqual(len(self.matcher), 1)
+
+    def test_flags(self):
+        # Patterns of different flags match separately, in output order
+        self.matcher.add('upper', re.compile(u'done', re.IGNORECASE))
+        self.matcher.add('exact', u'fail')
+        self.assertEqual(_found(self.matcher.feed(u'fail DONE fail')),
+                         [('exact', u'fail'), ('upper', u'DONE'),
+                          ('exact', u'fail')])
+
+    def test_standalone(self):
+        # A backreference is matched on its own, not joined
+        self.matcher.add('twice', re.compile(r'(\w)\1'))
+        self.matcher.add('word', u'ab')
+        self.assertEqual(_found(self.matcher.feed(u'ab xx')),
+                         [('word', u'ab'), ('twice', u'xx')])
+
+    def test_across_chunks(self):
+        self.matcher.add('marker', u'END-OF-JOB')
+        self.assertEqual(self.matcher.feed(u'output END-'), [])
+        self.assertEqual(_found(self.matcher.feed(u'OF-JOB more')),
+                         [('marker', u'END-OF-JOB')])
+        # A match is consumed: it isn't found again in the next chunk
+        self.assertEqual(self.matcher.feed(u' and'), [])
+
+    def test_tail_size(self):
+        matcher = OutputMatcher(tail_size=4)
+        matcher.add('marker', u'abcdef')
+        self.assertEqual(matcher.feed(u'xxab'), [])
+        self.assertEqual(_found(matcher.feed(u'cdef')),
+                         [('marker', u'abcdef')])
+        # Longer than the tail, the start is forgotten
+        self.assertEqual(matcher.feed(u'abc'), [])
+        self.assertEqual(matcher.feed(u'12345'), [])
+        self.assertEqual(matcher.feed(u'def'), [])
+
+    def test_reset(self):
+        self.matcher.add('marker', u'abc')
+        self.matcher.feed(u'ab')
+        self.matcher.reset()
+        self.assertEqual(self.matcher.feed(u'c'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
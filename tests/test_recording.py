@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from wxterm.recording import Recording
+from wxterm.session import TerminalSession
+
+
+# Pieces of output read one at a time, each followed by a keyframe:
+# colours, a 256 colour background, a saved cursor, charsets and a
+# scrolling region, restored or used by the next pieces
+PIECES = [
+    r'\033[1;31mred\033[0m line\r\n\033[48;5;100mbg\033[0m\r\n',
+    r'\033[2;4H\033[4m\033(0\0337\033[0m\033(B\033[1;5H',
+    r'\033)0\016lqk\017\r\n\033[2;3r\033[4h',
+    r'\0338x\033[5;1Hmore\r\n\033[33m',
+]
+
+
+def _state(session):
+    screen = session.screen
+    cursor = screen.cursor
+    return (session.display, [list(sids) for sids in screen.grid.sids],
+            (cursor.x, cursor.y, tuple(cursor.attrs)), sorted(screen.mode),
+            tuple(screen.margins), id(screen.g0_charset),
+            id(screen.g1_charset), screen.charset, screen.bg256,
+            len(screen.savepoints))
+
+
+def _replay(recording, keyframe=None):
+    # Like Player.Seek, then on to the end
+    session = TerminalSession(recording.columns, recording.lines,
+                              scrollback=0)
+    session.reset()
+    if keyframe is not None:
+        _, offset, columns, lines, screen = keyframe
+        session.resize(columns, lines)
+        session.feed(screen)
+        events = recording.events(offset)
+    else:
+        events = recording.events()
+    for _, kind, data in events:
+        if kind == 'o':
+            session.feed(data)
+        elif kind == 'r':
+            columns, lines = data.split('x')
+            session.resize(int(columns), int(lines))
+    return session
+
+
+class KeyframeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'session.cast')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_seek(self):
+        session = TerminalSession(12, 5, scrollback=0)
+        session.start_recording(self.path, keyframe_interval=0)
+        session.fork_command('sh', ['sh', '-c', '; sleep 0.2; '.join(
+            "printf '%s'" % piece for piece in PIECES)])
+        end = time.time() + 10
+        while not session.child_closed and time.time() < end:
+            session.parse_pending()
+            time.sleep(0.01)
+        session.wait()
+        session.parse_pending()
+        session.stop_recording()
+        session.close()
+
+        recording = Recording(self.path)
+        self.assertTrue(len(recording.keyframes) >= len(PIECES))
+        replayed = _state(_replay(recording))
+        self.assertEqual(replayed, _state(session))
+        # From any keyframe, the replay ends the same
+        for keyframe in recording.keyframes:
+            self.assertEqual(_state(_replay(recording, keyframe)), replayed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from wxterm.session import TerminalSession
+
+
+def _state(session):
+    screen = session.screen
+    cursor = screen.cursor
+    return (session.display, [list(sids) for sids in screen.grid.sids],
+            (cursor.x, cursor.y, tuple(cursor.attrs)), sorted(screen.mode),
+            tuple(screen.margins), id(screen.g0_charset),
+            id(screen.g1_charset), screen.charset, screen.bg256)
+
+
+class DumpTest(unittest.TestCase):
+
+    def assertDumped(self, data, then):
+        original = TerminalSession(12, 4, scrollback=0)
+        original.feed(data)
+        copy = TerminalSession(12, 4, scrollback=0)
+        copy.feed(u'\x1bc' + original.screen.dump())
+        self.assertEqual(_state(copy), _state(original))
+        # What comes next has the same effect on both
+        original.feed(then)
+        copy.feed(then)
+        self.assertEqual(_state(copy), _state(original))
+
+    def test_cells_and_cursor(self):
+        self.assertDumped(u'\x1b[1;31mred\x1b[0m\r\n\x1b[4hplain\x1b[2;4r',
+                          u'\x1b[Hab\x1b[3;1Hcd')
+
+    def test_pending_wrap(self):
+        self.assertDumped(u'0123456789ab', u'cd')
+
+    def test_saved_cursors(self):
+        # Each saved with its attributes, charsets and modes, restored
+        # in turn
+        self.assertDumped(u'\x1b[2;3H\x1b[32m\x1b(0\x1b7'
+                          u'\x1b[?6h\x1b[3;5H\x1b[0;7m\x0e\x1b7'
+                          u'\x1b[?6l\x1b[0m\x1b(B\x0f\x1b[4;1Hx',
+                          u'\x1b8lq\x1b8lq\x1b8lq')
+
+    def test_charsets(self):
+        self.assertDumped(u'\x1b(0\x1b)B\x0elqk', u'lqk\x0flqk')
+
+    def test_background_256(self):
+        # The first background of 256 colours is taken for the screen's,
+        # whatever the cells set meanwhile
+        self.assertDumped(u'\x1b[48;5;100mx\x1b[48;5;33my\x1b[0mz',
+                          u'\x1b[48;5;20mw')
+        self.assertDumped(u'\x1b[48;5;100mx\x1b[49my', u'\x1b[48;5;20mw')
+
+
+if __name__ == '__main__':
+    unittest.main()
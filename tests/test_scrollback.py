@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from array import array
+
+from wxterm.scrollback import Scrollback, ScrollbackStore
+
+
+def _line(i):
+    return u'line %d %s' % (i, u'abcdefghij' * 3)
+
+
+def _row(i):
+    text = _line(i)
+    return text, [i % 3] * len(text)
+
+
+def _blocks(stats):
+    return (stats['hot_blocks'] + stats['compressed_blocks'] +
+            stats['spilled_blocks'])
+
+
+class ScrollbackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ScrollbackStore(memory_budget=600, hot_fraction=0.5)
+        self.history = Scrollback(max_lines=1000, block_lines=4,
+                                  store=self.store)
+
+    def fill(self, count, history=None):
+        if history is None:
+            history = self.history
+        for i in range(count):
+            history.append_row(*_row(i))
+
+    def assertLines(self, history, first=0):
+        for n in range(len(history)):
+            text, sids = _row(first + n)
+            self.assertEqual(history.get(n),
+                             (text, array('H', [sids[0], len(text)])))
+
+    def test_append(self):
+        self.fill(10)
+        self.assertEqual(len(self.history), 10)
+        self.assertEqual(self.history.total, 10)
+        self.assertLines(self.history)
+        self.assertRaises(IndexError, self.history.get, 10)
+        self.assertRaises(IndexError, self.history.get, -1)
+
+    def test_trailing_blanks(self):
+        # Blank cells of the default style are dropped from the end
+        self.history.append_row(u'ab  ', [1, 0, 0, 0])
+        self.history.append_row(u'ab  ', [0, 0, 2, 0])
+        self.assertEqual(self.history.get(0),
+                         (u'ab', array('H', [1, 1, 0, 1])))
+        self.assertEqual(self.history.get(1),
+                         (u'ab ', array('H', [0, 2, 2, 1])))
+
+    def test_tiers(self):
+        # Over the budget, full blocks are compressed then spilled
+        self.fill(40)
+        stats = self.store.stats()
+        self.assertEqual(_blocks(stats), 9)
+        self.assertEqual(stats['hot_blocks'], 1)
+        self.assertTrue(stats['compressed_blocks'])
+        self.assertTrue(stats['spilled_blocks'])
+        self.assertTrue(stats['hot'] + stats['compressed'] <= 600)
+        self.assertTrue(stats['spill_file'] >= stats['spilled'])
+
+        # Whatever their tier, lines read back the same, as often
+        self.assertLines(self.history)
+        self.assertLines(self.history)
+        stats = self.store.stats()
+        self.assertEqual(_blocks(stats), 9)
+        self.assertTrue(stats['hot'] + stats['compressed'] <= 600)
+
+        self.store.set_memory_budget(0)
+        stats = self.store.stats()
+        self.assertEqual(stats['compressed_blocks'], 0)
+        self.assertEqual(stats['spilled_blocks'], 8)
+        self.assertLines(self.history)
+
+        self.history.clear()
+        self.assertEqual(len(self.history), 0)
+        stats = self.store.stats()
+        self.assertEqual(_blocks(stats), 0)
+        self.assertEqual((stats['hot'], stats['compressed'],
+                          stats['spilled']), (0, 0, 0))
+
+    def test_spill_reuse(self):
+        # Spilled blocks read back free their place in the file
+        self.store.set_memory_budget(0)
+        self.fill(40)
+        size = self.store.stats()['spill_file']
+        for _ in range(5):
+            self.assertLines(self.history)
+        self.assertEqual(self.store.stats()['spill_file'], size)
+
+    def test_max_lines(self):
+        # Whole blocks are dropped, leaving at least max_lines lines
+        history = Scrollback(max_lines=10, block_lines=4, store=self.store)
+        self.fill(30, history)
+        self.assertEqual(history.total, 30)
+        self.assertTrue(10 <= len(history) < 14)
+        self.assertLines(history, 30 - len(history))
+        self.assertEqual(_blocks(self.store.stats()), len(history) // 4)
+
+    def test_dump_load(self):
+        self.fill(30)
+        copy = Scrollback(max_lines=1000, block_lines=4, store=self.store)
+        copy.append_row(u'dropped', [0] * 7)
+        copy.load(self.history.total, *self.history.dump())
+        self.assertEqual(len(copy), 30)
+        self.assertEqual(copy.total, 30)
+        self.assertLines(copy)
+        self.assertEqual(copy.dump(), self.history.dump())
+        # Appended to like the original
+        copy.append_row(*_row(30))
+        self.assertLines(copy)
+
+    def test_load_offset(self):
+        # The blocks of lines loaded after the start line up with those
+        # that would have been appended
+        self.fill(30)
+        text, text_ends, runs, run_ends = self.history.dump()
+        copy = Scrollback(max_lines=1000, block_lines=4, store=self.store)
+        copy.load(35, text, text_ends, runs, run_ends)
+        self.assertEqual(len(copy), 30)
+        self.assertLines(copy)
+        self.assertEqual(copy.search(u'line 29', 0), (29, 0))
+
+        small = Scrollback(max_lines=10, block_lines=4, store=self.store)
+        small.load(30, text, text_ends, runs, run_ends)
+        self.assertTrue(10 <= len(small) < 14)
+        self.assertLines(small, 30 - len(small))
+
+
+if __name__ == '__main__':
+    unittest.main()
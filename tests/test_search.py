@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from wxterm import search
+from wxterm.scrollback import Scrollback
+
+
+class HistorySearchTest(unittest.TestCase):
+
+    def setUp(self):
+        # Full blocks are searched through their trigram filter
+        self.history = Scrollback(max_lines=100, block_lines=4)
+        for i in range(20):
+            text = u'Hello World %d' % i
+            self.history.append_row(text, [0] * len(text))
+        self.lines = [u'Hello World screen']
+
+    def test_case_sensitive(self):
+        self.assertEqual(search.find(self.history, self.lines, u'World 1',
+                                     ignore_case=False), (1, 6))
+        self.assertEqual(search.find(self.history, self.lines, u'world 1',
+                                     ignore_case=False), None)
+
+    def test_ignore_case(self):
+        self.assertEqual(search.find(self.history, self.lines, u'world 1'),
+                         (1, 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
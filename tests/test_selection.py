@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from wxterm.selection import Selection, LINEAR, BLOCK, WORD, LINE
+
+
+def _spans(selection, first, last, width=10):
+    return [selection.span(line, width) for line in range(first, last + 1)]
+
+
+class SelectionTest(unittest.TestCase):
+
+    def test_linear(self):
+        selection = Selection(LINEAR, 2, 5)
+        self.assertTrue(selection.is_empty())
+        self.assertEqual(selection.span(2, 10), None)
+
+        selection.extend(4, 3)
+        self.assertFalse(selection.is_empty())
+        self.assertEqual(selection.lines(), (2, 4))
+        self.assertEqual(_spans(selection, 1, 5),
+                         [None, (5, 10), (0, 10), (0, 3), None])
+
+    def test_backward(self):
+        # Extended before the anchor, the same cells are selected
+        selection = Selection(LINEAR, 4, 3)
+        selection.extend(2, 5)
+        self.assertEqual(selection.lines(), (2, 4))
+        self.assertEqual(_spans(selection, 1, 5),
+                         [None, (5, 10), (0, 10), (0, 3), None])
+
+        selection = Selection(LINEAR, 1, 7)
+        selection.extend(1, 2)
+        self.assertEqual(selection.span(1, 10), (2, 7))
+
+    def test_width(self):
+        selection = Selection(LINEAR, 0, 2)
+        selection.extend(0, 30)
+        self.assertEqual(selection.span(0, 10), (2, 10))
+        selection.extend(0, 12)
+        self.assertEqual(selection.span(0, 10), (2, 10))
+
+    def test_block(self):
+        selection = Selection(BLOCK, 2, 5)
+        selection.extend(4, 3)
+        self.assertFalse(selection.is_empty())
+        self.assertEqual(_spans(selection, 1, 5),
+                         [None, (3, 5), (3, 5), (3, 5), None])
+        # Whatever the lines, no column is no selection
+        selection.extend(4, 5)
+        self.assertTrue(selection.is_empty())
+        self.assertEqual(selection.span(3, 10), None)
+
+    def test_word(self):
+        # The words under the anchor and head are selected whole
+        selection = Selection(WORD, 1, 4, 9)
+        self.assertFalse(selection.is_empty())
+        self.assertEqual(selection.span(1, 10), (4, 9))
+
+        selection.extend(3, 2, 6)
+        self.assertEqual(_spans(selection, 1, 3),
+                         [(4, 10), (0, 10), (0, 6)])
+        selection.extend(0, 1, 3)
+        self.assertEqual(_spans(selection, 0, 1), [(1, 10), (0, 9)])
+        selection.extend(1, 0, 3)
+        self.assertEqual(selection.span(1, 10), (0, 9))
+
+    def test_line(self):
+        selection = Selection(LINE, 3, 4)
+        self.assertFalse(selection.is_empty())
+        self.assertEqual(selection.span(3, 10), (0, 10))
+        selection.extend(1, 8)
+        self.assertEqual(selection.lines(), (1, 3))
+        self.assertEqual(_spans(selection, 0, 4, width=6),
+                         [None, (0, 6), (0, 6), (0, 6), None])
+
+
+if __name__ == '__main__':
+    unittest.main()
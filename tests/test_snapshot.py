@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from wxterm import snapshot
+from wxterm.session import TerminalSession
+
+
+# Some of everything a snapshot keeps: coloured lines scrolled to the
+# history, a saved cursor, charsets, a 256 colour background, a
+# scrolling region, modes and a tab stop
+OUTPUT = (u'\x1b[1;31mred\x1b[0m line 1\r\n\x1b[42mgreen\x1b[0m line 2\r\n'
+          u'\x1b[48;5;100mline 3\x1b[0m\r\nline 4\r\nline 5\r\n'
+          u'\x1b[2;4H\x1b[4m\x1b(0\x1b7\x1b[0m\x1b(B'
+          u'\x1b[3g\x1b[1;5H\x1bH\x1b[2;3r\x1b[4h\x1b[?25l'
+          u'\x1b)0\x0e\x1b[3;6Hx\x1b[33m')
+
+
+def _state(session):
+    screen = session.screen
+    cursor = screen.cursor
+    savepoints = [(saved.cursor.x, saved.cursor.y, saved.cursor.hidden,
+                   tuple(saved.cursor.attrs), id(saved.g0_charset),
+                   id(saved.g1_charset), saved.charset, saved.origin,
+                   saved.wrap)
+                  for saved in screen.savepoints]
+    return (session.display, [list(sids) for sids in screen.grid.sids],
+            (cursor.x, cursor.y, cursor.hidden, tuple(cursor.attrs)),
+            sorted(screen.mode), tuple(screen.margins), id(screen.g0_charset),
+            id(screen.g1_charset), screen.charset, screen.bg256,
+            sorted(screen.tabstops), savepoints)
+
+
+def _history(session):
+    history = session.history
+    return history.total, [history.get(i) for i in range(len(history))]
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = TerminalSession(20, 4, scrollback=100)
+        self.session.feed(OUTPUT)
+
+    def restored(self, data, history=True):
+        copy = TerminalSession(10, 2, scrollback=100)
+        snapshot.loads(data).restore(copy.screen,
+                                     copy.history if history else None)
+        return copy
+
+    def test_round_trip(self):
+        for compress in (True, False):
+            data = snapshot.dumps(self.session.screen, self.session.history,
+                                  compress)
+            copy = self.restored(data)
+            self.assertEqual(_state(copy), _state(self.session))
+            self.assertEqual(_history(copy), _history(self.session))
+            # What comes next has the same effect on both
+            then = u'lqk\x0f\x1b8y\x1b[5;1H\r\nmore\ttab\r\n'
+            copy.feed(then)
+            self.session.feed(then)
+            self.assertEqual(_state(copy), _state(self.session))
+            self.assertEqual(_history(copy), _history(self.session))
+
+    def test_without_history(self):
+        data = snapshot.dumps(self.session.screen)
+        copy = self.restored(data)
+        self.assertEqual(_state(copy), _state(self.session))
+        self.assertEqual(len(copy.history), 0)
+
+    def test_session(self):
+        # Saved and loaded to a file, the session taking the size
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'screen.wxts')
+            self.session.save_snapshot(path)
+            copy = TerminalSession(10, 2, scrollback=100)
+            copy.load_snapshot(path)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual((copy.screen.columns, copy.screen.lines), (20, 4))
+        self.assertEqual(_state(copy), _state(self.session))
+        self.assertEqual(_history(copy), _history(self.session))
+
+    def test_not_a_snapshot(self):
+        data = snapshot.dumps(self.session.screen, self.session.history)
+        for bad in (b'', b'WXTS', b'nothing like a snapshot', data[:-10],
+                    data[:12] + b'x' * 40):
+            self.assertRaises(ValueError, snapshot.loads, bad)
+        uncompressed = snapshot.dumps(self.session.screen,
+                                      self.session.history, False)
+        self.assertRaises(ValueError, snapshot.loads, uncompressed[:-10])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+from wxterm.writer import PtyWriter
+
+
+class PtyWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.input, output = os.pipe()
+        self.wakeups = 0
+        self.writer = PtyWriter(output, self.wakeup, chunk_size=4)
+
+    def tearDown(self):
+        for fd in (self.input, self.writer.fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def wakeup(self):
+        self.wakeups += 1
+
+    def send_all(self):
+        progress = []
+        while self.writer.pending():
+            progress.append(self.writer.send())
+        return progress
+
+    def read(self):
+        return os.read(self.input, 65536)
+
+    def test_queue(self):
+        self.assertFalse(self.writer.pending())
+        self.writer.put(b'')
+        self.assertEqual(self.wakeups, 0)
+        self.writer.put(b'hello ')
+        self.writer.put(b'world')
+        # Woken once, when the queue stopped being empty
+        self.assertEqual(self.wakeups, 1)
+        self.assertTrue(self.writer.pending())
+
+        self.assertEqual(self.writer.send(), None)
+        self.assertEqual(self.read(), b'hell')
+        self.assertEqual(self.send_all(), [None] * 3)
+        self.assertEqual(self.read(), b'o world')
+        self.assertEqual(self.writer.send(), None)
+
+        self.writer.put(b'again')
+        self.assertEqual(self.wakeups, 2)
+
+    def test_paste(self):
+        self.writer.put(b'0123456789', paste=True)
+        self.assertEqual(self.writer.progress(), (0, 10))
+        self.assertEqual(self.send_all(), [(4, 10), (8, 10), (10, 10)])
+        self.assertEqual(self.writer.progress(), None)
+        self.assertEqual(self.read(), b'0123456789')
+
+        # Typed input between pastes isn't counted
+        self.writer.put(b'ab', paste=True)
+        self.writer.put(b'typed')
+        self.writer.put(b'cd', paste=True)
+        self.assertEqual(self.send_all(),
+                         [(2, 4), None, None, (4, 4)])
+        self.assertEqual(self.read(), b'abtypedcd')
+
+    def test_cancel_paste(self):
+        self.writer.put(b'typed ')
+        self.writer.put(b'0123456789', paste=True)
+        self.writer.put(b' more')
+        self.writer.send()
+        self.writer.cancel_paste()
+        self.assertEqual(self.writer.progress(), None)
+        self.send_all()
+        self.assertEqual(self.read(), b'typed  more')
+
+        # Even once started
+        self.writer.put(b'0123456789', paste=True)
+        self.writer.put(b'!')
+        self.assertEqual(self.writer.send(), (4, 10))
+        self.writer.cancel_paste()
+        self.send_all()
+        self.assertEqual(self.read(), b'0123!')
+
+    def test_full(self):
+        # A full pipe leaves the data queued until it is read
+        writer = PtyWriter(self.writer.fd, self.wakeup)
+        data = b'x' * (1024 * 1024)
+        writer.put(data)
+        for _ in range(len(data) // writer.chunk_size):
+            writer.send()
+        self.assertTrue(writer.pending())
+        received = b''
+        while writer.pending():
+            received += self.read()
+            writer.send()
+        while len(received) < len(data):
+            received += self.read()
+        self.assertEqual(received, data)
+
+    def test_closed(self):
+        os.close(self.input)
+        self.writer.put(b'lost')
+        self.assertRaises(OSError, self.writer.send)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,13 @@
 # -*- coding: utf-8 -*-
 
-from .terminal import (TerminalWindow,
-        EVT_TERM_CHILD_EXIT, EVT_TERM_CHILD_READY, EVT_TERM_READY)
+from .session import TerminalSession
+
+try:
+    import wx
+except ImportError:  # headless, only the session is available
+    wx = None
+
+if wx is not None:
+    from .terminal import (TerminalWindow,
+            EVT_TERM_CHILD_EXIT, EVT_TERM_CHILD_READY, EVT_TERM_READY,
+            EVT_TERM_PASTE_PROGRESS, EVT_TERM_MATCH)
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""Drive terminals from asyncio, without a window.
+
+This module needs Python 3.5 or later and isn't imported by
+:mod:`wxterm`. A :class:`Session` is a
+:class:`~wxterm.session.TerminalSession` whose output is parsed on the
+event loop, where it can be waited for; any number of sessions and
+waiters share the thread running the loop::
+
+    session = await spawn('bash', ['bash'])
+    session.write('ls\\n')
+    await session.drain()
+    await session.wait_for(re.compile(r'\\$ $'), timeout=5)
+
+The session may be shown by a :class:`~wxterm.terminal.TerminalWindow`
+meanwhile, see its ``AttachSession``. A wx application can run the loop
+with :func:`shared_loop`, which keeps it in a thread of its own and
+hands results back to the GUI thread.
+"""
+
+import asyncio
+import os
+import re
+import threading
+
+from .session import TerminalSession
+
+
+# Characters of output kept for read() and wait_for()
+MAX_BUFFER = 1024 * 1024
+
+
+class Session(TerminalSession):
+    """A child process running in a terminal, driven from an event loop.
+
+    The pty is served by the shared :class:`~wxterm.iohub.IOHub` as for
+    any session, its output parsed on ``loop``, unless a window showing
+    the session parses it. Every output of the child also goes to a
+    buffer of up to ``max_buffer`` characters, oldest dropped first,
+    consumed by :meth:`read` and :meth:`wait_for`. Must be created from
+    the thread running ``loop``; use :func:`spawn` from a coroutine.
+    """
+
+    def __init__(self, command, argv, directory=None, columns=80, lines=24,
+                 scrollback=0, read_ahead=256 * 1024, encoding='utf-8',
+                 max_buffer=MAX_BUFFER, loop=None):
+        super(Session, self).__init__(columns, lines, scrollback, read_ahead,
+                                      False, encoding)
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.max_buffer = max_buffer
+
+        self.__buffer = ''
+        self.__eof = False
+        self.__waiters = []  # futures woken by output or EOF
+        self.__drained = []  # futures woken once the writer is empty
+        self.__exit_status = None
+        self.__parse_scheduled = False
+
+        self.on_output = self.__output_ready
+        self.fork_command(command, argv, directory)
+
+    @property
+    def eof(self):
+        """True once the child side of the pty is closed."""
+        return self.__eof
+
+    def detach(self):
+        """Drop the callbacks of the window showing the session: the
+        output is parsed on the loop again."""
+        super(Session, self).detach()
+        self.on_output = self.__output_ready
+        self.__output_ready()
+
+    async def drain(self):
+        """Wait until the child has taken all the input written. Raise
+        :exc:`EOFError` if it is gone first."""
+        while self.input_pending():
+            if self.__eof:
+                raise EOFError
+            future = self.loop.create_future()
+            self.__drained.append(future)
+            await future
+
+    async def read(self):
+        """Return the output not read yet, waiting for some if there is
+        none. Return ``''`` once the child is gone."""
+        while not self.__buffer and not self.__eof:
+            await self.__wait()
+        data, self.__buffer = self.__buffer, ''
+        return data
+
+    async def wait_for(self, pattern, timeout=None):
+        """Wait for ``pattern`` in the output and return the match.
+
+        ``pattern`` is a string, matched literally, or a compiled regular
+        expression. The output is consumed up to the end of the match.
+        Raise :exc:`asyncio.TimeoutError` after ``timeout`` seconds, or
+        :exc:`EOFError` if the child is gone before the pattern shows up.
+        """
+        if isinstance(pattern, str):
+            pattern = re.compile(re.escape(pattern))
+        return await asyncio.wait_for(self.__match(pattern), timeout)
+
+    async def __match(self, pattern):
+        while True:
+            match = pattern.search(self.__buffer)
+            if match is not None:
+                self.__buffer = self.__buffer[match.end():]
+                return match
+            if self.__eof:
+                raise EOFError
+            await self.__wait()
+
+    async def wait_exit(self):
+        """Wait for the child to exit and return its exit status, or
+        minus the signal that killed it.
+
+        The child is waited for once it closed the pty, by a single
+        :meth:`~wxterm.session.TerminalSession.wait` in the default
+        executor of the loop.
+        """
+        if self.__exit_status is None:
+            while not self.__eof:
+                await self.__wait()
+            status = await self.loop.run_in_executor(None, self.wait)
+            if os.WIFSIGNALED(status):
+                self.__exit_status = -os.WTERMSIG(status)
+            else:
+                self.__exit_status = os.WEXITSTATUS(status)
+        return self.__exit_status
+
+    def close(self):
+        """Stop serving the pty and close it, which hangs up the child."""
+        if self.fd is None:
+            return
+        super(Session, self).close()
+        # The hub won't report the end of the output anymore
+        self.__call_soon(self.__closed)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def __wait(self):
+        future = self.loop.create_future()
+        self.__waiters.append(future)
+        return future
+
+    def __wake(self, futures):
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+        del futures[:]
+
+    def __call_soon(self, callback, *args):
+        # From any thread; nothing is left to do once the loop is closed
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def __output_ready(self):
+        # Called from the I/O thread: parse on the loop, once for all the
+        # output read until then
+        if not self.__parse_scheduled:
+            self.__parse_scheduled = True
+            self.__call_soon(self.__parse_pending)
+
+    def __parse_pending(self):
+        self.__parse_scheduled = False
+        self.parse_pending()
+
+    def handle_output(self, data):
+        self.__call_soon(self.__output, data)
+
+    def handle_drained(self):
+        self.__call_soon(self.__wake, self.__drained)
+
+    def handle_close(self):
+        self.__call_soon(self.__closed)
+
+    def __output(self, data):
+        self.__buffer += data
+        if len(self.__buffer) > self.max_buffer:
+            self.__buffer = self.__buffer[-self.max_buffer:]
+        self.__wake(self.__waiters)
+
+    def __closed(self):
+        self.__eof = True
+        self.__wake(self.__waiters)
+        for future in self.__drained:
+            if not future.done():
+                future.set_exception(EOFError())
+        del self.__drained[:]
+
+
+async def spawn(command, argv, directory=None, **kwargs):
+    """Start ``command`` in a new :class:`Session` on the running loop."""
+    return Session(command, argv, directory, **kwargs)
+
+
+class LoopThread(object):
+    """An event loop running in a thread of its own.
+
+    Lets a wx application drive sessions without blocking the GUI: the
+    coroutines given to :meth:`submit` run on the loop and their results
+    are handed back to the GUI thread with :func:`wx.CallAfter`.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.__lock = threading.Lock()
+        self.__thread = None
+
+    def __run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro, callback=None):
+        """Run ``coro`` on the loop and return a
+        :class:`concurrent.futures.Future` for its result.
+
+        ``callback(future)`` is called on the GUI thread once it is done.
+        """
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run)
+                self.__thread.daemon = True
+                self.__thread.start()
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        if callback is not None:
+            import wx
+            future.add_done_callback(lambda f: wx.CallAfter(callback, f))
+        return future
+
+
+_loop_thread = None
+_loop_thread_lock = threading.Lock()
+
+
+def shared_loop():
+    """Return the :class:`LoopThread` shared by the whole application."""
+    global _loop_thread
+    with _loop_thread_lock:
+        if _loop_thread is None:
+            _loop_thread = LoopThread()
+        return _loop_thread
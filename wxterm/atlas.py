@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import weakref
+from collections import OrderedDict
+
+import wx
+
+
+# Glyph slots per row of the atlas bitmap
+SLOTS_PER_ROW = 64
+
+
+class GlyphAtlas(object):
+    """Off-screen bitmap holding pre-rendered terminal cells.
+
+    Each glyph is identified by a hashable key chosen by the caller and is
+    rasterised once, the first time it is drawn; afterwards drawing it is
+    a single blit from the atlas. When the atlas is full the least
+    recently used glyph is evicted.
+    """
+
+    def __init__(self, col_width, line_height, max_glyphs=4096):
+        self.col_width = col_width
+        self.line_height = line_height
+        self.max_glyphs = max_glyphs
+
+        rows = (max_glyphs + SLOTS_PER_ROW - 1) // SLOTS_PER_ROW
+        self.__bitmap = wx.EmptyBitmap(SLOTS_PER_ROW * col_width,
+                                       rows * line_height)
+        self.__dc = wx.MemoryDC(self.__bitmap)
+        self.__dc.SetBackgroundMode(wx.SOLID)
+
+        # key -> (x, y) of the glyph in the atlas, least recently used first
+        self.__glyphs = OrderedDict()
+        self.__free = [((i % SLOTS_PER_ROW) * col_width,
+                        (i // SLOTS_PER_ROW) * line_height)
+                       for i in reversed(xrange(max_glyphs))]
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.__glyphs)
+
+    def clear(self):
+        self.__free.extend(self.__glyphs.itervalues())
+        self.__glyphs.clear()
+
+    def __render(self, char, fg, bg, font):
+        if self.__free:
+            pos = self.__free.pop()
+        else:
+            _, pos = self.__glyphs.popitem(last=False)
+
+        x, y = pos
+        w, h = self.col_width, self.line_height
+        dc = self.__dc
+        dc.SetClippingRegion(x, y, w, h)
+        dc.SetPen(wx.TRANSPARENT_PEN)
+        dc.SetBrush(wx.Brush(bg))
+        dc.DrawRectangle(x, y, w, h)
+        dc.SetFont(font)
+        dc.SetTextForeground(fg)
+        dc.SetTextBackground(bg)
+        dc.DrawText(char, x, y)
+        dc.DestroyClippingRegion()
+        return pos
+
+    def draw(self, dc, x, y, key, char, fg, bg, font):
+        """Blit the glyph ``key`` to ``dc`` at ``(x, y)``, rendering it
+        with the given colours and font if it is not in the atlas yet."""
+        pos = self.__glyphs.pop(key, None)
+        if pos is None:
+            self.misses += 1
+            pos = self.__render(char, fg, bg, font)
+        else:
+            self.hits += 1
+        self.__glyphs[key] = pos
+        dc.Blit(x, y, self.col_width, self.line_height, self.__dc, *pos)
+
+
+_atlases = weakref.WeakValueDictionary()
+
+
+def shared_atlas(font_key, col_width, line_height, max_glyphs=4096):
+    """Return the atlas used by every terminal drawing with ``font_key``.
+
+    The atlas lives as long as one of the terminals holds a reference.
+    """
+    key = (font_key, col_width, line_height, max_glyphs)
+    atlas = _atlases.get(key)
+    if atlas is None:
+        atlas = GlyphAtlas(col_width, line_height, max_glyphs)
+        _atlases[key] = atlas
+    return atlas
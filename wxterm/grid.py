@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+
+
+class Grid(object):
+    """Text and style IDs of the cells of a screen.
+
+    Each row is an ``array('u')`` of characters and an ``array('H')`` of
+    style IDs (see :mod:`wxterm.styles`), so reading or writing cells
+    allocates no per cell objects. The owner keeps it in sync with its
+    own writes to the screen.
+
+    .. attribute:: text
+
+       The ``array('u')`` of each row.
+
+    .. attribute:: sids
+
+       The ``array('H')`` of each row.
+    """
+
+    def __init__(self, columns, lines):
+        self.reset(columns, lines)
+
+    def __blank(self, char=u' ', sid=0):
+        columns = self.columns
+        return array('u', char * columns), array('H', [sid]) * columns
+
+    def reset(self, columns, lines):
+        """Blank every cell, with the new size."""
+        self.columns, self.lines = columns, lines
+        self.text = []
+        self.sids = []
+        for _ in range(lines):
+            text, sids = self.__blank()
+            self.text.append(text)
+            self.sids.append(sids)
+
+    def resize(self, lines, columns):
+        """Same as :meth:`pyte.Screen.resize`: lines are added at the
+        bottom or taken off the top, columns added or taken at the
+        right."""
+        diff = self.lines - lines
+        if diff < 0:
+            for _ in range(-diff):
+                text, sids = self.__blank()
+                self.text.append(text)
+                self.sids.append(sids)
+        elif diff > 0:
+            del self.text[:diff]
+            del self.sids[:diff]
+
+        diff = columns - self.columns
+        for y in range(lines):
+            if diff > 0:
+                self.text[y].extend(u' ' * diff)
+                self.sids[y].extend([0] * diff)
+            elif diff < 0:
+                del self.text[y][columns:]
+                del self.sids[y][columns:]
+        self.columns, self.lines = columns, lines
+
+    def set_line(self, y, text, sids):
+        self.text[y] = array('u', text)
+        self.sids[y] = array('H', sids)
+
+    def fill(self, y, start, end, char=u' ', sid=0):
+        """Set cells ``start`` to ``end`` (excluded) of row ``y``."""
+        count = end - start
+        if count > 0:
+            self.text[y][start:end] = array('u', char * count)
+            self.sids[y][start:end] = array('H', [sid]) * count
+
+    def delete(self, y):
+        """Remove row ``y``; rows below it move up."""
+        del self.text[y]
+        del self.sids[y]
+
+    def insert(self, y, char=u' ', sid=0):
+        """Insert a row filled with ``char`` before row ``y``."""
+        text, sids = self.__blank(char, sid)
+        self.text.insert(y, text)
+        self.sids.insert(y, sids)
+
+    def row(self, y):
+        """Return a copy of row ``y`` as ``(text, sids)``."""
+        return self.text[y].tounicode(), self.sids[y][:]
+
+    @property
+    def display(self):
+        """The text of every row, like :attr:`pyte.Screen.display`."""
+        return [text.tounicode() for text in self.text]
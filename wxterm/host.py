@@ -0,0 +1,722 @@
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+import pickle
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+from array import array
+from collections import deque
+
+from . import snapshot
+from . import styles
+from .iohub import shared_hub
+from .scrollback import pack_row, _tobytes, _frombytes
+from .screen import MAX_SCROLLS
+from .session import TerminalSession
+
+
+# Start of the shared screen: serial of the size, columns, lines, cursor
+# x and y, bg256, number of scrolls. The scrolls, a dirty flag per line
+# and the rows follow.
+_HEADER = struct.Struct('<IHHHH8sH')
+_SCROLL = struct.Struct('<HHi')
+
+# A row is its array('u') of characters then its array('H') of style IDs
+_CHAR_SIZE = array('u').itemsize
+_SID_SIZE = array('H').itemsize
+
+_SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Length of each message on the socket, a pickle
+_LENGTH = struct.Struct('<I')
+
+_text_type = type(u'')
+
+
+def _renumber(runs, sids):
+    # Style IDs of the runs of packed lines through sids, in place
+    runs[::2] = array('H', [sids[sid] for sid in runs[::2]])
+
+
+def _layout(columns, lines):
+    # Offsets of the scrolls, the dirty flags and the rows, and the size
+    # of the shared screen
+    scrolls = _HEADER.size
+    dirty = scrolls + MAX_SCROLLS * _SCROLL.size
+    rows = dirty + lines
+    return scrolls, dirty, rows, rows + lines * columns * (_CHAR_SIZE +
+                                                          _SID_SIZE)
+
+
+def _message(*message):
+    data = pickle.dumps(message, 2)
+    return _LENGTH.pack(len(data)) + data
+
+
+def _split_messages(buf):
+    # Take the complete messages off the bytearray buf
+    messages = []
+    while len(buf) >= _LENGTH.size:
+        size, = _LENGTH.unpack_from(bytes(buf[:_LENGTH.size]))
+        end = _LENGTH.size + size
+        if len(buf) < end:
+            break
+        messages.append(pickle.loads(bytes(buf[_LENGTH.size:end])))
+        del buf[:end]
+    return messages
+
+
+class _Match(object):
+    # What the worker sends of a match of a pattern
+
+    def __init__(self, group, groups, groupdict, span):
+        self.__group = group
+        self.__groups = groups
+        self.__groupdict = groupdict
+        self.__span = span
+
+    def group(self, *indexes):
+        if not indexes:
+            return self.__group
+        values = [self.__group if not i else self.__groups[i - 1]
+                  if isinstance(i, int) else self.__groupdict[i]
+                  for i in indexes]
+        return values[0] if len(values) == 1 else tuple(values)
+
+    def groups(self):
+        return self.__groups
+
+    def groupdict(self):
+        return self.__groupdict
+
+    def span(self):
+        return self.__span
+
+    def start(self):
+        return self.__span[0]
+
+    def end(self):
+        return self.__span[1]
+
+
+class _History(object):
+    # Stands for the Scrollback of the parent in the snapshots of the
+    # worker: dumped by the parent, or loaded for it
+
+    def __init__(self, dumped=None):
+        if dumped is not None:
+            self.total = dumped[0]
+        self.dumped = dumped
+
+    def dump(self):
+        return self.dumped[1:]
+
+    def load(self, *dumped):
+        self.dumped = dumped
+
+
+class RemoteSession(TerminalSession):
+    """A :class:`~wxterm.session.TerminalSession` whose pty and parser run
+    in a worker process of their own, so a terminal flooded with output
+    takes nothing from the GUI but the painting.
+
+    The worker publishes its screen, the cells of each row along with
+    the dirty lines, the scrolls and the cursor, in shared memory. The
+    changed rows are copied from it into :attr:`screen` as frames are
+    received, one frame per :meth:`parse_pending`; the worker parses on
+    meanwhile. Lines scrolled off come with the frames and go to
+    :attr:`history`, kept here. Input, resizes and the other commands go
+    to the worker over a socket, served by the shared
+    :class:`~wxterm.iohub.IOHub`.
+
+    :attr:`pid` is that of the child of the worker; :meth:`wait` returns
+    the status the worker got from it.
+    """
+
+    def __init__(self, columns=80, lines=24, scrollback=10000,
+                 read_ahead=256 * 1024, threaded_parser=False,
+                 encoding='utf-8'):
+        self.__socket = None
+        # The worker always parses on a thread of its own
+        super(RemoteSession, self).__init__(columns, lines, scrollback,
+                                            read_ahead, False, encoding)
+        # The screen only mirrors the worker's, which sends the lines
+        # scrolled off
+        self.screen.history = None
+
+        self.__serial = 0  # of the size of the screen, bumped by resize
+        self.__map = None
+        self.__applied = False  # a frame waits for parse_pending
+        self.__ack_owed = False  # its damage waits for take_damage
+        self.__applied_lock = threading.Lock()
+        self.__received_data = bytearray()
+        self.__progress = None
+        self.__status = None
+        self.__exited = threading.Event()
+        self.__worker_gone = False
+
+        # The worker interns styles in its own table: local style ID of
+        # each of its IDs, learnt as they come with the frames
+        self.__sids = [0]
+        self.__same_sids = True
+
+        # A command at a time waits for its reply
+        self.__call_lock = threading.Lock()
+        self.__replied = threading.Event()
+        self.__reply = None
+
+        ours, theirs = socket.socketpair()
+        self.__socket = ours
+        env = dict(os.environ)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join(
+            [root] + [p for p in [env.get('PYTHONPATH')] if p])
+        # The worker needs no GUI, keep wx out of it
+        self.__process = subprocess.Popen(
+            [sys.executable, '-c', 'import sys; sys.modules["wx"] = None; '
+             'from wxterm.host import main; main()',
+             str(columns), str(lines), str(scrollback), str(read_ahead),
+             encoding],
+            stdin=theirs.fileno(), close_fds=True, env=env)
+        theirs.close()
+        self.__writer = shared_hub().add(ours.fileno(), self.__received,
+                                         self.__worker_closed,
+                                         encoding='latin-1')
+
+    def fork_command(self, command, argv, directory=None):
+        if not directory:
+            directory = os.getcwd()
+        self.pid = self.__call('fork', command, argv, directory)
+        self.fd = self.__socket.fileno()
+        return self.pid
+
+    def wait(self):
+        self.__exited.wait()
+        return self.__status
+
+    def close(self):
+        """Stop the worker, which hangs up the child."""
+        if self.__socket is None:
+            return
+        shared_hub().remove(self.__socket.fileno())
+        self.__socket.close()
+        self.__socket = None
+        self.fd = None
+        self.__process.wait()
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+
+    @property
+    def child_closed(self):
+        return self.__exited.is_set()
+
+    def reset(self):
+        super(RemoteSession, self).reset()
+        self.__send('reset')
+
+    def resize(self, columns, lines):
+        with self.lock:
+            self.__serial += 1
+            self.screen.resize(lines, columns)
+            # Frames of the old size are dropped, the next one is whole
+            self.__send('resize', self.__serial, columns, lines)
+
+    def start_recording(self, path, **kwargs):
+        self.__call('start_recording', path, kwargs)
+
+    def stop_recording(self):
+        self.__send('stop_recording')
+
+    def save_snapshot(self, path, history=True):
+        dumped = used = None
+        with self.lock:
+            if history and self.history is not None:
+                dumped = (self.history.total,) + self.history.dump()
+                # The worker has its own IDs for these
+                used = [(sid, styles.table[sid])
+                        for sid in set(dumped[3][::2])]
+        self.__call('save_snapshot', path, dumped, used)
+
+    def load_snapshot(self, path):
+        # The screen comes with the next frame
+        dumped = self.__call('load_snapshot', path)
+        if dumped is not None and self.history is not None:
+            if not self.__same_sids:
+                _renumber(dumped[3], self.__sids)
+            with self.lock:
+                self.history.load(*dumped)
+
+    def feed(self, data):
+        self.__send('feed', data)
+
+    def parse_pending(self):
+        """Take the frame received since the last call. Return False if
+        none came.
+
+        The worker publishes the next frame once the damage of this one
+        is taken, by :meth:`take_damage`, or at the latest on the next
+        call: acknowledged any sooner, frames would keep coming faster
+        than they're displayed, each one a redraw of the whole screen.
+        """
+        with self.__applied_lock:
+            applied, self.__applied = self.__applied, False
+            ack, self.__ack_owed = self.__ack_owed, applied
+        if ack:
+            self.__send('ack')
+        return applied
+
+    def take_damage(self):
+        damage = super(RemoteSession, self).take_damage()
+        with self.__applied_lock:
+            ack, self.__ack_owed = self.__ack_owed, False
+        if ack:
+            self.__send('ack')
+        return damage
+
+    def write(self, data):
+        if self.pid is not None:
+            if isinstance(data, _text_type):
+                data = data.encode(self.encoding)
+            self.__send('write', data)
+
+    def paste(self, text):
+        if self.pid is not None:
+            if isinstance(text, _text_type):
+                text = text.encode(self.encoding)
+            self.__send('paste', text)
+
+    def cancel_paste(self):
+        self.__progress = None
+        self.__send('cancel_paste')
+
+    def paste_progress(self):
+        return self.__progress
+
+    def add_pattern(self, name, pattern):
+        self.__send('add_pattern', name, pattern)
+
+    def remove_pattern(self, name):
+        self.__send('remove_pattern', name)
+
+    def set_read_ahead(self, size):
+        self.read_ahead = size
+        self.__send('set_read_ahead', size)
+
+    def __send(self, *message):
+        if self.__socket is not None:
+            self.__writer.put(_message(*message))
+
+    def __call(self, *message):
+        with self.__call_lock:
+            self.__replied.clear()
+            self.__reply = (None, EOFError('the worker is gone'))
+            if not self.__worker_gone:
+                self.__send(*message)
+                self.__replied.wait()
+            value, error = self.__reply
+        if error is not None:
+            raise error
+        return value
+
+    def __received(self, data, size):
+        # Called from the I/O hub thread
+        self.__received_data.extend(data.encode('latin-1'))
+        for message in _split_messages(self.__received_data):
+            kind = message[0]
+            if kind == 'frame':
+                self.__learn_styles(message[1])
+                self.__apply_frame(*message[2:])
+                with self.__applied_lock:
+                    self.__applied = True
+                if self.on_output:
+                    self.on_output()
+            elif kind == 'reply':
+                self.__learn_styles(message[1])
+                self.__reply = message[2:]
+                self.__replied.set()
+            elif kind == 'ready':
+                if self.on_ready:
+                    self.on_ready()
+            elif kind == 'match':
+                if self.on_match:
+                    self.on_match(message[1], _Match(*message[2:]))
+            elif kind == 'paste_progress':
+                written, total = message[1:]
+                self.__progress = (written, total) if written < total \
+                    else None
+                if self.on_paste_progress:
+                    self.on_paste_progress(written, total)
+            elif kind == 'exit':
+                self.__status = message[1]
+                self.__exited.set()
+                if self.on_close:
+                    self.on_close()
+
+    def __worker_closed(self):
+        # Called from the I/O hub thread
+        self.__worker_gone = True
+        self.__replied.set()
+        if not self.__exited.is_set():
+            self.__exited.set()
+            if self.pid is not None and self.on_close:
+                self.on_close()
+
+    def __learn_styles(self, new_styles):
+        # (sid, style) of the styles the worker interned since the last
+        # message, in the order of its IDs
+        for sid, style in new_styles:
+            local = styles.table.intern(style)
+            self.__sids.append(local)
+            if local != sid:
+                self.__same_sids = False
+
+    def __apply_frame(self, path, lines_scrolled):
+        # Copy the rows that changed from the shared screen. They aren't
+        # read in place: the worker rewrites the mapping as soon as the
+        # frame is acknowledged, which may be while the rows are drawn.
+        # That costs a copy of the cells of each changed row, and a
+        # renumbering of its style IDs if the worker's differ.
+        if path is not None:
+            with open(path, 'r+b') as f:
+                shared = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            os.unlink(path)
+            if self.__map is not None:
+                self.__map.close()
+            self.__map = shared
+        shared = self.__map
+        serial, columns, lines, x, y, bg256, count = \
+            _HEADER.unpack_from(shared)
+        scrolls_at, dirty_at, rows_at, _ = _layout(columns, lines)
+
+        local_sids = None if self.__same_sids else self.__sids
+        with self.lock:
+            if self.history is not None:
+                for text, runs in lines_scrolled:
+                    if local_sids is not None:
+                        _renumber(runs, local_sids)
+                    self.history.append_packed(text, runs)
+            if serial != self.__serial:
+                return
+
+            screen = self.screen
+            scrolls = [_SCROLL.unpack_from(shared, scrolls_at +
+                                           i * _SCROLL.size)
+                       for i in range(count)]
+            flags = bytearray(shared[dirty_at:dirty_at + lines])
+            dirty = set(i for i in range(lines) if flags[i])
+            if (columns, lines) != (screen.columns, screen.lines):
+                screen.resize(lines, columns)
+                screen.dirty.update(range(lines))
+            if screen.dirty or screen.scrolls:
+                # The last frame isn't displayed yet, display everything
+                screen.scrolls = []
+                screen.dirty.update(range(lines))
+            else:
+                screen.scrolls = scrolls
+                screen.dirty.update(dirty)
+            changed = set(screen.dirty)
+            for top, bottom, _ in screen.scrolls:
+                changed.update(range(top, bottom + 1))
+            # Lines left from before a resize
+            changed.intersection_update(range(lines))
+
+            grid = screen.grid
+            text_size = columns * _CHAR_SIZE
+            row_size = columns * (_CHAR_SIZE + _SID_SIZE)
+            for i in changed:
+                start = rows_at + i * row_size
+                text = array('u')
+                _frombytes(text, shared[start:start + text_size])
+                sids = array('H')
+                _frombytes(sids, shared[start + text_size:start + row_size])
+                if local_sids is not None:
+                    sids = array('H', [local_sids[sid] for sid in sids])
+                grid.text[i] = text
+                grid.sids[i] = sids
+            screen.cursor.x, screen.cursor.y = x, y
+            screen.bg256 = bg256.rstrip(b'\0').decode('ascii') or None
+
+
+class _Host(object):
+    # The worker: runs the session and publishes its screen. A frame is
+    # published when the screen changed, or once the last one is
+    # acknowledged if it changed meanwhile.
+
+    def __init__(self, sock, columns, lines, scrollback, read_ahead,
+                 encoding):
+        self.socket = sock
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+
+        session = self.session = TerminalSession(
+            columns, lines, scrollback=0, read_ahead=read_ahead,
+            encoding=encoding)
+        # Lines scrolled off, sent with the next frame
+        self.scrolled = deque(maxlen=scrollback)
+        if scrollback:
+            session.screen.history = self
+        session.on_ready = self.ready
+        session.on_output = self.output
+        session.on_match = self.matched
+        session.on_paste_progress = self.paste_progress
+        session.on_close = self.closed
+
+        self.serial = 0
+        self.map = None
+        self.path = None
+        self.size = None
+        self.in_flight = False
+        self.changed = False
+        self.closing = False
+        self.status = None
+        # Styles of the table already sent to the parent
+        self.styles_sent = 1
+
+    def send(self, *message):
+        data = _message(*message)
+        with self.send_lock:
+            try:
+                self.socket.sendall(data)
+            except socket.error:
+                pass  # the parent is gone, the commands will stop
+
+    def run(self):
+        # Until the parent closes its end, or is gone
+        buf = bytearray()
+        try:
+            while True:
+                try:
+                    data = self.socket.recv(64 * 1024)
+                except socket.error:
+                    break
+                if not data:
+                    break
+                buf.extend(data)
+                for message in _split_messages(buf):
+                    getattr(self, 'do_' + message[0])(*message[1:])
+        finally:
+            self.session.close()
+            if self.path is not None:
+                try:
+                    os.unlink(self.path)
+                except OSError:
+                    pass  # the parent did
+
+    def new_styles(self):
+        # Called with self.lock held. (sid, style) of the styles interned
+        # since the last call, for the parent to map to its own IDs; sent
+        # ahead of anything using them.
+        count = len(styles.table)
+        new = [(sid, styles.table[sid])
+               for sid in range(self.styles_sent, count)]
+        self.styles_sent = count
+        return new
+
+    # Called by the screen with the lines scrolled off
+    def append_row(self, text, sids):
+        self.scrolled.append(pack_row(text, sids))
+
+    def publish(self):
+        # Called with self.lock held. The output may be half parsed, the
+        # parser lets go of the screen between slices: what changed so
+        # far makes a frame.
+        if self.in_flight:
+            return
+        session = self.session
+        with session.lock:
+            screen = session.screen
+            if not (self.changed or screen.dirty or screen.scrolls):
+                return
+            self.in_flight = True
+            self.changed = False
+            path = self.map_screen(screen.columns, screen.lines)
+            shared = self.map
+            scrolls_at, dirty_at, rows_at, _ = _layout(screen.columns,
+                                                       screen.lines)
+            dirty, scrolls = session.take_damage()
+            # Lines left from before a resize
+            dirty = [y for y in dirty if y < screen.lines]
+            _HEADER.pack_into(shared, 0, self.serial, screen.columns,
+                              screen.lines, screen.cursor.x,
+                              screen.cursor.y,
+                              (screen.bg256 or u'').encode('ascii'),
+                              len(scrolls))
+            for i, scroll in enumerate(scrolls):
+                _SCROLL.pack_into(shared, scrolls_at + i * _SCROLL.size,
+                                  *scroll)
+            flags = bytearray(screen.lines)
+            changed = set(dirty)
+            for y in dirty:
+                flags[y] = 1
+            for top, bottom, _ in scrolls:
+                changed.update(range(top, bottom + 1))
+            shared[dirty_at:dirty_at + screen.lines] = bytes(flags)
+
+            grid = screen.grid
+            text_size = screen.columns * _CHAR_SIZE
+            row_size = screen.columns * (_CHAR_SIZE + _SID_SIZE)
+            for y in changed:
+                start = rows_at + y * row_size
+                shared[start:start + text_size] = _tobytes(grid.text[y])
+                shared[start + text_size:start + row_size] = \
+                    _tobytes(grid.sids[y])
+            scrolled = list(self.scrolled)
+            self.scrolled.clear()
+        self.send('frame', self.new_styles(), path, scrolled)
+
+    def map_screen(self, columns, lines):
+        # A new shared screen for each size; return its path if new
+        if self.size == (columns, lines):
+            return None
+        fd, path = tempfile.mkstemp(prefix='wxterm-screen-', dir=_SHM_DIR)
+        try:
+            size = _layout(columns, lines)[3]
+            os.ftruncate(fd, size)
+            shared = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        if self.map is not None:
+            self.map.close()
+        # The parent unlinks it once mapped
+        self.map, self.path, self.size = shared, path, (columns, lines)
+        # Everything is new to the parent
+        session = self.session
+        session.screen.dirty.update(range(lines))
+        session.screen.scrolls = []
+        return path
+
+    def update(self):
+        # The screen changed
+        with self.lock:
+            self.changed = True
+            self.publish()
+            self.finish()
+
+    def finish(self):
+        # Called with self.lock held. Once the child is gone and the last
+        # frame acknowledged, the parent gets the status.
+        if self.closing and not self.in_flight and not self.changed:
+            self.closing = False
+            self.send('exit', self.status)
+
+    # Called from the I/O hub thread
+
+    def ready(self):
+        self.send('ready')
+
+    def output(self):
+        self.session.parse_pending()
+        self.update()
+
+    def matched(self, name, match):
+        self.send('match', name, match.group(), match.groups(),
+                  match.groupdict(), match.span())
+
+    def paste_progress(self, written, total):
+        self.send('paste_progress', written, total)
+
+    def closed(self):
+        self.status = self.session.wait()
+        self.session.parse_pending()
+        with self.lock:
+            self.closing = True
+        self.update()
+
+    # Commands of the parent
+
+    def reply(self, function, *args):
+        try:
+            value, error = function(*args), None
+        except Exception as e:
+            value, error = None, e
+        with self.lock:
+            self.send('reply', self.new_styles(), value, error)
+
+    def do_fork(self, command, argv, directory):
+        self.reply(self.session.fork_command, command, argv, directory)
+
+    def do_ack(self):
+        with self.lock:
+            self.in_flight = False
+            self.publish()
+            self.finish()
+
+    def do_resize(self, serial, columns, lines):
+        self.serial = serial
+        self.session.resize(columns, lines)
+        self.update()
+
+    def do_reset(self):
+        self.session.reset()
+        self.update()
+
+    def do_feed(self, data):
+        self.session.feed(data)
+        self.update()
+
+    def do_write(self, data):
+        self.session.write(data)
+
+    def do_paste(self, data):
+        self.session.paste(data)
+
+    def do_cancel_paste(self):
+        self.session.cancel_paste()
+
+    def do_add_pattern(self, name, pattern):
+        self.session.add_pattern(name, pattern)
+
+    def do_remove_pattern(self, name):
+        self.session.remove_pattern(name)
+
+    def do_set_read_ahead(self, size):
+        self.session.set_read_ahead(size)
+
+    def do_start_recording(self, path, kwargs):
+        self.reply(lambda: self.session.start_recording(path, **kwargs))
+
+    def do_stop_recording(self):
+        self.session.stop_recording()
+
+    def do_save_snapshot(self, path, dumped, used):
+        def save():
+            history = None
+            if dumped is not None:
+                # Style IDs of the parent to ours
+                sids = dict((sid, styles.table.intern(style))
+                            for sid, style in used)
+                _renumber(dumped[3], sids)
+                history = _History(dumped)
+            with self.session.lock:
+                data = snapshot.dumps(self.session.screen, history)
+            with open(path, 'wb') as f:
+                f.write(data)
+        self.reply(save)
+
+    def do_load_snapshot(self, path):
+        def load():
+            with open(path, 'rb') as f:
+                saved = snapshot.loads(f.read())
+            history = _History()
+            with self.session.lock:
+                saved.restore(self.session.screen, history)
+            self.scrolled.clear()
+            return history.dumped
+        self.reply(load)
+        self.update()
+
+
+def main():
+    """Run the worker of a :class:`RemoteSession`, talking to it on
+    stdin, a socket."""
+    columns, lines, scrollback, read_ahead = [int(arg)
+                                              for arg in sys.argv[1:5]]
+    sock = socket.fromfd(0, socket.AF_UNIX, socket.SOCK_STREAM)
+    os.close(0)
+    _Host(sock, columns, lines, scrollback, read_ahead, sys.argv[5]).run()
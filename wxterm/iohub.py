@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import select
+import threading
+
+from .reader import PtyReader
+from .writer import PtyWriter
+
+
+class _Channel(object):
+    __slots__ = ('fd', 'reader', 'writer', 'on_output', 'on_progress',
+                 'on_close', 'on_drained', 'mask', 'paused', 'hung_up')
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.mask = 0  # 0 while not registered with epoll
+        self.paused = False
+        self.hung_up = False  # seen while paused, read once resumed
+
+
+class IOHub(object):
+    """Serves the pty masters of all the terminals from one thread.
+
+    Each fd is registered with a single :func:`select.epoll`, for reading
+    and, while its :class:`~wxterm.writer.PtyWriter` has data queued, for
+    writing. Output is decoded by a :class:`~wxterm.reader.PtyReader` and
+    handed to the terminal owning the fd, from the hub thread.
+    """
+
+    def __init__(self):
+        self.__epoll = select.epoll()
+        self.__lock = threading.RLock()
+        self.__channels = {}
+        self.__thread = None
+
+    def add(self, fd, on_output, on_close, on_progress=None,
+            encoding='utf-8', on_drained=None):
+        """Start serving ``fd`` and return its writer.
+
+        ``on_output(text, nbytes)`` receives the decoded output, it may
+        :meth:`pause` reading until the output is consumed.
+        ``on_progress((written, total))`` follows the pastes,
+        ``on_drained()`` is called whenever the writer's queue is emptied
+        and ``on_close()`` once the child side of the pty is closed.
+        """
+        channel = _Channel(fd)
+        channel.reader = PtyReader(fd, encoding)
+        channel.writer = PtyWriter(fd, lambda: self.__update(channel))
+        channel.on_output = on_output
+        channel.on_progress = on_progress
+        channel.on_close = on_close
+        channel.on_drained = on_drained
+        with self.__lock:
+            self.__channels[fd] = channel
+            self.__update(channel)
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run)
+                self.__thread.daemon = True
+                self.__thread.start()
+        return channel.writer
+
+    def remove(self, fd):
+        with self.__lock:
+            channel = self.__channels.pop(fd, None)
+            if channel is not None:
+                channel.paused = True
+                self.__update(channel)
+
+    def pause(self, fd):
+        self.__set_paused(fd, True)
+
+    def resume(self, fd):
+        self.__set_paused(fd, False)
+
+    def __set_paused(self, fd, paused):
+        with self.__lock:
+            channel = self.__channels.get(fd)
+            if channel is not None and channel.paused != paused:
+                channel.paused = paused
+                self.__update(channel)
+
+    def __update(self, channel):
+        # Watch for what the channel can do now. A paused channel is only
+        # watched for writing, so input such as ^C still reaches a child
+        # flooding the terminal. Once its child hung up it isn't
+        # registered at all, or the hang up would keep waking the loop.
+        with self.__lock:
+            if self.__channels.get(channel.fd) is not channel:
+                mask = 0  # removed
+            elif channel.paused:
+                mask = 0
+                if channel.writer.pending() and not channel.hung_up:
+                    mask = select.EPOLLOUT
+            else:
+                mask = select.EPOLLIN
+                if channel.writer.pending():
+                    mask |= select.EPOLLOUT
+            if mask == channel.mask:
+                return
+            if not channel.mask:
+                self.__epoll.register(channel.fd, mask)
+            elif not mask:
+                self.__epoll.unregister(channel.fd)
+            else:
+                self.__epoll.modify(channel.fd, mask)
+            channel.mask = mask
+
+    def __close(self, channel):
+        self.remove(channel.fd)
+        tail = channel.reader.flush()
+        if tail:
+            channel.on_output(tail, 0)
+        channel.on_close()
+
+    def __run(self):
+        while True:
+            try:
+                events = self.__epoll.poll()
+            except IOError:  # EINTR
+                continue
+            for fd, event in events:
+                channel = self.__channels.get(fd)
+                if channel is None:
+                    continue
+
+                if event & select.EPOLLOUT:
+                    try:
+                        progress = channel.writer.send()
+                    except OSError:
+                        self.__close(channel)
+                        continue
+                    if progress is not None and channel.on_progress:
+                        channel.on_progress(progress)
+                    if not channel.writer.pending():
+                        self.__update(channel)
+                        if channel.on_drained:
+                            channel.on_drained()
+
+                if channel.paused:
+                    if event & (select.EPOLLHUP | select.EPOLLERR):
+                        channel.hung_up = True
+                        self.__update(channel)
+                    continue
+
+                if event & (select.EPOLLIN | select.EPOLLHUP |
+                            select.EPOLLERR):
+                    try:
+                        data, size = channel.reader.read()
+                    except (OSError, EOFError):
+                        self.__close(channel)
+                        continue
+                    if data:
+                        channel.on_output(data, size)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def shared_hub():
+    """Return the hub serving every terminal, started on first use."""
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = IOHub()
+        return _hub
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import re
+import threading
+from collections import OrderedDict
+
+
+# Characters of output kept between two chunks, so a match can span them
+TAIL_SIZE = 1024
+
+# Group names, backreferences and inline flags don't survive being joined
+# with other patterns
+_STANDALONE = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?[aiLmsux]+\)')
+
+
+class OutputMatcher(object):
+    """Matches a set of patterns against a stream of output.
+
+    Patterns are strings, matched literally, or compiled regular
+    expressions. They are joined in one alternation per set of flags, so
+    every chunk of output is scanned once whatever the number of
+    patterns; the alternation has no groups of its own, which lets the
+    regular expression engine factor out common prefixes. When several
+    patterns match at the same place, the first registered wins. Only
+    the last ``tail_size`` characters not consumed by
+    a match are kept from one chunk to the next: a match longer than
+    that may be missed.
+    """
+
+    def __init__(self, tail_size=TAIL_SIZE):
+        self.tail_size = tail_size
+        self.__lock = threading.Lock()
+        self.__patterns = OrderedDict()  # name -> compiled pattern
+        # [(regex, [(name, pattern)] of the patterns it joins)]
+        self.__combined = []
+        self.__order = {}  # name -> index in the registration order
+        self.__tail = u''
+
+    def add(self, name, pattern):
+        """Register ``pattern`` as ``name``, replacing any pattern with
+        that name."""
+        if not hasattr(pattern, 'search'):
+            pattern = re.compile(re.escape(pattern))
+        with self.__lock:
+            self.__patterns[name] = pattern
+            self.__compile()
+
+    def remove(self, name):
+        with self.__lock:
+            if self.__patterns.pop(name, None) is not None:
+                self.__compile()
+
+    def __len__(self):
+        return len(self.__patterns)
+
+    def __compile(self):
+        self.__combined = []
+        self.__order = dict((name, i)
+                            for i, name in enumerate(self.__patterns))
+        by_flags = OrderedDict()
+        for name, pattern in self.__patterns.items():
+            if _STANDALONE.search(pattern.pattern):
+                self.__combined.append((pattern, [(name, pattern)]))
+            else:
+                by_flags.setdefault(pattern.flags, []).append((name, pattern))
+
+        for flags, patterns in by_flags.items():
+            # Joining a|b and c as a|b|c doesn't change what they match
+            regex = re.compile(u'|'.join(pattern.pattern
+                                         for _, pattern in patterns), flags)
+            self.__combined.append((regex, patterns))
+
+    def feed(self, text):
+        """Scan ``text``, the output following the previous one, and
+        return the new matches as ``[(name, match)]`` in output order.
+
+        ``match`` is the match object of the pattern itself, on a string
+        made of the tail of the previous output and ``text``.
+        """
+        with self.__lock:
+            if not self.__combined:
+                return []
+            data = self.__tail + text
+
+            # The regexes of different flags match separately: at the
+            # same start, the pattern registered first wins there too
+            found = []
+            for regex, patterns in self.__combined:
+                for m in regex.finditer(data):
+                    if m.end() > m.start():
+                        name, match = self.__which(patterns, data,
+                                                   m.start(), m.end())
+                        found.append((m.start(), self.__order[name],
+                                      m.end(), name, match))
+            found.sort(key=lambda item: item[:2])
+
+            matches = []
+            end = 0
+            for start, _, stop, name, match in found:
+                if start < end:
+                    continue  # overlaps an earlier match
+                matches.append((name, match))
+                end = stop
+
+            self.__tail = data[end:][-self.tail_size:]
+            return matches
+
+    def __which(self, patterns, data, start, stop):
+        # The pattern that made the match of the alternation
+        first = None
+        for name, pattern in patterns:
+            match = pattern.match(data, start)
+            if match is not None:
+                if match.end() == stop:
+                    return name, match
+                if first is None:
+                    first = name, match
+        return first
+
+    def reset(self):
+        """Forget the output kept from the previous chunks."""
+        with self.__lock:
+            self.__tail = u''
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import wx
+
+from .recording import Recording
+
+
+# Characters of output displayed at most per step of the replay, so the
+# GUI stays responsive at high speeds
+MAX_STEP_OUTPUT = 64 * 1024
+
+
+class Player(object):
+    """Plays a recording back in a :class:`~wxterm.TerminalWindow`.
+
+    ``speed`` multiplies the pace of the recording; 0 replays it as fast
+    as it can be displayed. :meth:`Seek` starts from the closest keyframe
+    of the recording, see :class:`~wxterm.recording.Recorder`, rather
+    than from the start. The window is best left without a child.
+    """
+
+    def __init__(self, window, path, speed=1.0):
+        self.__window = window
+        self.__recording = Recording(path)
+        self.__speed = speed
+        self.__duration = None
+
+        self.__events = iter(())
+        self.__next = None  # the next event to display
+        self.__time = 0.0  # position in the recording...
+        self.__clock = None  # ...at this time, None when paused
+        self.__timer = None
+        self.Seek(0)
+
+    def Play(self):
+        if self.__clock is None:
+            self.__clock = time.time()
+            self.__schedule(0)
+
+    def Pause(self):
+        self.__time = self.GetTime()
+        self.__clock = None
+        if self.__timer is not None:
+            self.__timer.Stop()
+            self.__timer = None
+
+    def IsPlaying(self):
+        return self.__clock is not None
+
+    def SetSpeed(self, speed):
+        self.__time = self.GetTime()
+        if self.__clock is not None:
+            self.__clock = time.time()
+        self.__speed = speed
+
+    def GetSpeed(self):
+        return self.__speed
+
+    def GetTime(self):
+        """Position in the recording, in seconds."""
+        if self.__clock is None or not self.__speed:
+            return self.__time
+        return self.__time + (time.time() - self.__clock) * self.__speed
+
+    def GetDuration(self):
+        if self.__duration is None:
+            self.__duration = self.__recording.duration()
+        return self.__duration
+
+    def Seek(self, position):
+        """Move to ``position`` seconds into the recording."""
+        window = self.__window
+        session = window.GetSession()
+        recording = self.__recording
+
+        with session.lock:
+            if session.history is not None:
+                session.history.clear()
+        session.reset()
+        keyframe = recording.keyframe(position)
+        if keyframe is not None:
+            _, offset, columns, lines, screen = keyframe
+            session.resize(columns, lines)
+            session.feed(screen)
+            self.__events = recording.events(offset)
+        else:
+            session.resize(recording.columns, recording.lines)
+            self.__events = recording.events()
+
+        # Catch up with the position without drawing
+        self.__next = next(self.__events, None)
+        while self.__next is not None and self.__next[0] <= position:
+            self.__apply(session, self.__next)
+            self.__next = next(self.__events, None)
+
+        self.__time = position
+        if self.__clock is not None:
+            self.__clock = time.time()
+        # Back to the bottom of the history that was just cleared
+        window.ScrollHistory(0)
+        window.Redraw()
+
+    def __apply(self, session, event):
+        _, kind, data = event
+        if kind == 'o':
+            session.feed(data)
+        elif kind == 'r':
+            columns, lines = data.split('x')
+            session.resize(int(columns), int(lines))
+
+    def __schedule(self, delay):
+        self.__timer = wx.FutureCall(max(1, int(delay * 1000)), self.__step)
+
+    def __step(self):
+        self.__timer = None
+        if self.__clock is None:
+            return
+        window = self.__window
+        session = window.GetSession()
+        position = self.GetTime()
+
+        output = []
+        size = 0
+        while self.__next is not None and size < MAX_STEP_OUTPUT and \
+                (not self.__speed or self.__next[0] <= position):
+            t, kind, data = self.__next
+            if kind == 'o':
+                output.append(data)
+                size += len(data)
+            elif kind == 'r':
+                window.Feed(u''.join(output))
+                output = []
+                self.__apply(session, self.__next)
+                window.Redraw()
+            if not self.__speed:
+                self.__time = t
+            self.__next = next(self.__events, None)
+        if output:
+            window.Feed(u''.join(output))
+
+        if self.__next is None:
+            self.Pause()
+        elif not self.__speed or size >= MAX_STEP_OUTPUT:
+            self.__schedule(0)
+        else:
+            self.__schedule((self.__next[0] - position) / self.__speed)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import os
+import codecs
+import errno
+import select
+
+
+MIN_READ_SIZE = 4 * 1024
+MAX_READ_SIZE = 1024 * 1024
+
+
+class PtyReader(object):
+    """Reads and decodes the output of a pty master.
+
+    Each call to :meth:`read` drains everything the child has written so
+    far, up to the current read size. The read size doubles while the
+    child keeps the pty full (bulk output) and halves again when reads
+    come back mostly empty (interactive use). Decoding is incremental, so
+    a multi-byte character split between two reads is decoded correctly.
+    """
+
+    def __init__(self, fd, encoding='utf-8',
+                 min_read_size=MIN_READ_SIZE, max_read_size=MAX_READ_SIZE):
+        self.fd = fd
+        self.min_read_size = min_read_size
+        self.max_read_size = max_read_size
+        self.read_size = min_read_size
+        self.__decoder = codecs.getincrementaldecoder(encoding)('replace')
+
+    def read(self):
+        """Return a ``(text, nbytes)`` tuple with the output available.
+
+        Must only be called once the fd is readable. Raises
+        :exc:`EOFError` (or the :exc:`OSError` raised by the pty) when the
+        child side is closed and there is nothing left to read.
+        """
+        fd = self.fd
+        chunks = []
+        size = 0
+        while size < self.read_size:
+            try:
+                data = os.read(fd, self.read_size - size)
+            except OSError as e:
+                if chunks:
+                    break
+                if e.errno == errno.EAGAIN:
+                    return u'', 0
+                raise
+            if not data:
+                if chunks:
+                    break
+                raise EOFError
+            chunks.append(data)
+            size += len(data)
+            if not select.select([fd], [], [], 0)[0]:
+                break
+
+        if size >= self.read_size:
+            self.read_size = min(self.read_size * 2, self.max_read_size)
+        elif size < self.read_size // 4:
+            self.read_size = max(self.read_size // 2, self.min_read_size)
+
+        return self.__decoder.decode(b''.join(chunks)), size
+
+    def flush(self):
+        """Return whatever is left of an incomplete trailing character."""
+        return self.__decoder.decode(b'', True)
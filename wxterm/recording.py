@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import io
+import json
+import threading
+import time
+from collections import deque
+
+
+# Seconds between two keyframes
+KEYFRAME_INTERVAL = 30.0
+
+# Characters of output, or events, the background writer may fall behind
+# before a record call waits for it
+MAX_QUEUED = 4 * 1024 * 1024
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return io.open(path, mode)
+
+
+def keyframes_path(path):
+    """The file where the keyframes of the recording ``path`` are kept."""
+    return path + '.keys'
+
+
+class Recorder(object):
+    """Records a terminal session as an asciicast v2 file.
+
+    Output, input and resizes are timestamped and queued, and a thread
+    of its own writes them, so recording never waits on the disk. The
+    file is gzip compressed if ``path`` ends with ``.gz``.
+
+    Every ``keyframe_interval`` seconds a dump of the screen, see
+    :meth:`~wxterm.screen.TerminalScreen.dump`, goes to a second file
+    (:func:`keyframes_path`), along with where the recording goes on
+    from, so a replay can start from it. The recording itself stays a
+    plain asciicast file.
+    """
+
+    def __init__(self, path, columns, lines,
+                 keyframe_interval=KEYFRAME_INTERVAL, env=None):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.__start = time.time()
+        self.__last_keyframe = self.__start
+
+        self.__cond = threading.Condition(threading.Lock())
+        self.__queue = deque()
+        self.__queued = 0
+        self.__closed = False
+
+        self.__file = _open(path, 'wb')
+        self.__keys = io.open(keyframes_path(path), 'wb')
+        self.__offset = 0
+        self.__write({'version': 2, 'width': columns, 'height': lines,
+                      'timestamp': int(self.__start),
+                      'env': env or {'TERM': 'linux'}})
+
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def output(self, data):
+        """Record ``data``, unicode output of the child."""
+        self.__put('o', data)
+
+    def input(self, data):
+        """Record ``data``, bytes written to the child."""
+        self.__put('i', data.decode('utf-8', 'replace'))
+
+    def resize(self, columns, lines):
+        self.__put('r', u'%dx%d' % (columns, lines))
+
+    def keyframe_due(self):
+        """Whether it's time for a :meth:`keyframe`."""
+        return time.time() - self.__last_keyframe >= self.keyframe_interval
+
+    def keyframe(self, columns, lines, screen):
+        """Record the state of the screen, ``screen`` as dumped, after the
+        output recorded so far."""
+        self.__last_keyframe = time.time()
+        self.__put('k', (columns, lines, screen))
+
+    def close(self):
+        """Write what's left in the queue and close the files."""
+        with self.__cond:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__cond.notify_all()
+        self.__thread.join()
+        self.__file.close()
+        self.__keys.close()
+
+    def __put(self, kind, data):
+        with self.__cond:
+            if self.__closed:
+                return
+            # Only wait for the disk if it is really far behind
+            while self.__queued > MAX_QUEUED:
+                self.__cond.wait()
+            self.__queue.append((time.time() - self.__start, kind, data))
+            self.__queued += len(data) if kind != 'k' else 1
+            self.__cond.notify_all()
+
+    def __write(self, entry):
+        line = (json.dumps(entry, ensure_ascii=False) + u'\n').encode('utf-8')
+        self.__file.write(line)
+        self.__offset += len(line)
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                while not self.__queue and not self.__closed:
+                    self.__cond.wait()
+                if not self.__queue:
+                    break
+                events = self.__queue
+                self.__queue = deque()
+                self.__queued = 0
+                self.__cond.notify_all()
+
+            for t, kind, data in events:
+                t = round(t, 6)
+                if kind == 'k':
+                    # Where the replay goes on from this keyframe
+                    columns, lines, screen = data
+                    self.__keys.write((json.dumps(
+                        [t, self.__offset, columns, lines, screen],
+                        ensure_ascii=False) + u'\n').encode('utf-8'))
+                else:
+                    self.__write([t, kind, data])
+            self.__file.flush()
+            self.__keys.flush()
+
+
+class Recording(object):
+    """Reads an asciicast v2 file, with the keyframes left by a
+    :class:`Recorder` if there are any.
+
+    .. attribute:: columns
+
+    .. attribute:: lines
+
+       Size of the terminal when the recording started.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with _open(path, 'rb') as f:
+            header = json.loads(f.readline().decode('utf-8'))
+            self.__start = f.tell()
+        self.columns = header['width']
+        self.lines = header['height']
+
+        # [(time, offset, columns, lines, screen)], by time
+        self.keyframes = []
+        try:
+            with io.open(keyframes_path(path), 'rb') as f:
+                for line in f:
+                    try:
+                        keyframe = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        break  # cut short while recording
+                    self.keyframes.append(keyframe)
+        except IOError:
+            pass
+
+    def keyframe(self, t):
+        """The last keyframe at or before ``t`` seconds, or None."""
+        found = None
+        for keyframe in self.keyframes:
+            if keyframe[0] > t:
+                break
+            found = keyframe
+        return found
+
+    def events(self, offset=None):
+        """Iterate over the ``(time, kind, data)`` events from ``offset``
+        in the file, the first event by default."""
+        with _open(self.path, 'rb') as f:
+            f.seek(self.__start if offset is None else offset)
+            for line in f:
+                try:
+                    t, kind, data = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break  # cut short while recording
+                yield t, kind, data
+
+    def duration(self):
+        """Time of the last event, read from the last keyframe on."""
+        keyframe = self.keyframes[-1] if self.keyframes else None
+        t = keyframe[0] if keyframe is not None else 0
+        for t, _, _ in self.events(keyframe[1] if keyframe else None):
+            pass
+        return t
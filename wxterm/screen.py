@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+
+import pyte
+from pyte import charsets as cs
+from pyte import graphics as g
+from pyte import modes as mo
+from pyte.screens import Char
+from .colors256 import CLUT
+from . import styles
+from .grid import Grid
+
+
+# Scroll operations kept between two frames before giving up and
+# redrawing the whole screen
+MAX_SCROLLS = 16
+
+# DECSET 2004, pyte keeps private modes shifted by 5 bits
+BRACKETED_PASTE = 2004 << 5
+
+# Modes restored by TerminalScreen.dump, DECOM last as it moves the cursor
+_DUMPED_MODES = (mo.LNM, mo.IRM, mo.DECTCEM, mo.DECAWM, BRACKETED_PASTE,
+                 mo.DECOM)
+
+# SGR codes of the colours, by name or 256 colour value
+_FG_CODES = dict((name, (code,)) for code, name in sorted(g.FG.items(),
+                                                         reverse=True))
+_BG_CODES = dict((name, (code,)) for code, name in sorted(g.BG.items(),
+                                                         reverse=True))
+for _index, _value in enumerate(CLUT):
+    _FG_CODES.setdefault(_value, (38, 5, _index))
+    _BG_CODES.setdefault(_value, (48, 5, _index))
+
+# SCS codes of the charsets, which are lists with Python 3
+_CHARSET_CODES = dict((id(charset), code) for code, charset in cs.MAPS.items())
+
+# pyte characters by (text, style ID), shared by set_row
+_chars = {}
+_MAX_CHARS = 16 * 1024
+
+
+def _sgr(style):
+    # Escape sequences setting the attributes of a style. 256 colours get
+    # a sequence of their own, MyScreen only knows them that way. Default
+    # colours are left to the reset, SGR 49 would forget MyScreen.bg256.
+    fg, bg, bold, italics, underscore, strikethrough, reverse = style
+    codes = [0]
+    for flag, code in ((bold, 1), (italics, 3), (underscore, 4),
+                       (reverse, 7), (strikethrough, 9)):
+        if flag:
+            codes.append(code)
+    sequences = []
+    for colour in (_FG_CODES.get(fg) if fg != 'default' else None,
+                   _BG_CODES.get(bg) if bg != 'default' else None):
+        if colour is not None and len(colour) == 3:
+            sequences.append(colour)
+        elif colour is not None:
+            codes.extend(colour)
+    return u''.join(u'\x1b[%sm' % u';'.join(str(code) for code in sequence)
+                    for sequence in [codes] + sequences)
+
+
+def _mode(mode, on):
+    # Escape sequence setting or resetting a mode, pyte keeps private
+    # modes shifted
+    private = mode >= 1 << 5
+    return u'\x1b[%s%d%s' % (u'?' if private else u'',
+                             mode >> 5 if private else mode,
+                             u'h' if on else u'l')
+
+
+def _charsets(g0, g1, shifted):
+    # SCS sequences designating G0 and G1, then SO or SI
+    return u'\x1b(%s\x1b)%s%s' % (_CHARSET_CODES.get(id(g0), u'B'),
+                                  _CHARSET_CODES.get(id(g1), u'0'),
+                                  u'\x0e' if shifted else u'\x0f')
+
+
+class MyScreen(pyte.Screen):
+    def reset(self):
+        super(MyScreen, self).reset()
+        self.bg256 = None
+
+    def select_graphic_rendition(self, *attrs):
+        """Set display attributes.
+
+        :param list attrs: a list of display attributes to set.
+        """
+        replace = {}
+
+        for attr in attrs or [0]:
+            if attr == 38 and len(attrs) == 3 and attrs[1] == 5:
+                replace["fg"] = CLUT[attrs[2]]
+                break
+            elif attr == 48 and len(attrs) == 3 and attrs[1] == 5:
+                replace["bg"] = CLUT[attrs[2]]
+                if self.bg256 is None:
+                    self.bg256 = replace["bg"]
+                break
+            elif attr in g.FG:
+                replace["fg"] = g.FG[attr]
+            elif attr in g.BG:
+                if attr == 49:
+                    self.bg256 = None
+                replace["bg"] = g.BG[attr]
+            elif attr in g.TEXT:
+                attr = g.TEXT[attr]
+                replace[attr[1:]] = attr.startswith("+")
+            elif not attr:
+                replace = self.default_char._asdict()
+
+        self.cursor.attrs = self.cursor.attrs._replace(**replace)
+
+
+class TerminalScreen(pyte.DiffScreen, MyScreen):
+    """Keeps track of whole lines moved by scrolling, so they can be
+    moved on the display too, rather than redrawn.
+
+    .. attribute:: grid
+
+       A :class:`~wxterm.grid.Grid` with the text and style IDs of the
+       screen, updated along with the pyte characters. The display is
+       drawn from it.
+
+    .. attribute:: scrolls
+
+       A list of ``(top, bottom, count)`` scroll operations, in order, not
+       yet applied to the display: lines ``top`` to ``bottom`` moved up by
+       ``count`` lines (down if ``count`` is negative). Dirty line numbers
+       refer to the screen after all the scrolls.
+
+    .. attribute:: history
+
+       A :class:`~wxterm.scrollback.Scrollback` receiving the lines that
+       scroll off the top of the screen, or ``None``.
+    """
+    def __init__(self, columns, lines):
+        self.scrolls = []
+        self.history = None
+        self.grid = Grid(columns, lines)
+        self.__attrs = None
+        self.__sid = 0
+        super(TerminalScreen, self).__init__(columns, lines)
+
+    def __attrs_sid(self):
+        # Style ID of the cursor attributes, which only change on SGR
+        attrs = self.cursor.attrs
+        if attrs is not self.__attrs:
+            self.__attrs = attrs
+            self.__sid = styles.table.intern(attrs[1:])
+        return self.__sid
+
+    def __sync_lines(self, lines):
+        grid = self.grid
+        for y in lines:
+            grid.set_line(y, *styles.split_line(self[y]))
+
+    def reset(self):
+        self.scrolls = []
+        # Unlike pyte, forget the cursors saved by DECSC, as RIS does
+        self.savepoints = []
+        super(TerminalScreen, self).reset()
+        self.grid.reset(self.columns, self.lines)
+
+    def resize(self, lines=None, columns=None):
+        self.scrolls = []
+        # Lines taken off the top of the screen go to the history, unless
+        # there is nothing on the screen yet
+        if self.history is not None and lines and lines < self.lines \
+                and any(text.tounicode().strip() for text in self.grid.text):
+            for y in range(self.lines - lines):
+                self.history.append_row(*self.grid.row(y))
+        super(TerminalScreen, self).resize(lines, columns)
+        self.grid.resize(self.lines, self.columns)
+
+    def set_mode(self, *modes, **kwargs):
+        super(TerminalScreen, self).set_mode(*modes, **kwargs)
+        if mo.DECSCNM >> 5 in modes and kwargs.get("private"):
+            self.__sync_lines(range(self.lines))
+
+    def reset_mode(self, *modes, **kwargs):
+        super(TerminalScreen, self).reset_mode(*modes, **kwargs)
+        if mo.DECSCNM >> 5 in modes and kwargs.get("private"):
+            self.__sync_lines(range(self.lines))
+
+    def draw(self, char):
+        super(TerminalScreen, self).draw(char)
+        # The character went just left of the cursor, after the charset
+        # translation and any line wrap
+        y = self.cursor.y
+        x = self.cursor.x - 1
+        grid = self.grid
+        grid.text[y][x] = self[y][x].data
+        grid.sids[y][x] = self.__attrs_sid()
+
+    def insert_lines(self, count=None):
+        top, bottom = self.margins
+        y = self.cursor.y
+        super(TerminalScreen, self).insert_lines(count)
+        if top <= y <= bottom:
+            for line in range(y, min(bottom + 1, y + (count or 1))):
+                self.grid.delete(bottom)
+                self.grid.insert(line)
+
+    def delete_lines(self, count=None):
+        top, bottom = self.margins
+        y = self.cursor.y
+        super(TerminalScreen, self).delete_lines(count)
+        if top <= y <= bottom:
+            for _ in range(min(bottom - y + 1, count or 1)):
+                self.grid.delete(y)
+                self.grid.insert(bottom, self.cursor.attrs.data,
+                                 self.__attrs_sid())
+
+    def insert_characters(self, count=None):
+        super(TerminalScreen, self).insert_characters(count)
+        self.__sync_lines([self.cursor.y])
+
+    def delete_characters(self, count=None):
+        super(TerminalScreen, self).delete_characters(count)
+        self.__sync_lines([self.cursor.y])
+
+    def erase_characters(self, count=None):
+        super(TerminalScreen, self).erase_characters(count)
+        x = self.cursor.x
+        self.grid.fill(self.cursor.y, x, min(x + (count or 1), self.columns),
+                       self.cursor.attrs.data, self.__attrs_sid())
+
+    def erase_in_line(self, type_of=0, private=False):
+        super(TerminalScreen, self).erase_in_line(type_of, private)
+        start, end = ((self.cursor.x, self.columns),
+                      (0, self.cursor.x + 1),
+                      (0, self.columns))[type_of]
+        self.grid.fill(self.cursor.y, start, end,
+                       self.cursor.attrs.data, self.__attrs_sid())
+
+    def erase_in_display(self, type_of=0):
+        # Also calls erase_in_line for the line of the cursor
+        super(TerminalScreen, self).erase_in_display(type_of)
+        lines = (range(self.cursor.y + 1, self.lines),
+                 range(0, self.cursor.y),
+                 range(0, self.lines))[type_of]
+        char, sid = self.cursor.attrs.data, self.__attrs_sid()
+        for y in lines:
+            self.grid.fill(y, 0, self.columns, char, sid)
+
+    def alignment_display(self):
+        super(TerminalScreen, self).alignment_display()
+        self.__sync_lines(range(self.lines))
+
+    def dump(self):
+        """Return escape sequences that bring a reset screen of the same
+        size to the state of this one: its cells, saved cursors, cursor,
+        scrolling region, modes and charsets."""
+        # Cells are written through charset B, which leaves them as they
+        # are, and writing the last one mustn't scroll
+        out = [u'\x1b(B\x0f\x1b[?7l']
+        table = styles.table
+        grid = self.grid
+        for y in range(self.lines):
+            text, sids = grid.text[y].tounicode(), grid.sids[y]
+            end = len(text)
+            while end and text[end - 1] == u' ' and sids[end - 1] == 0:
+                end -= 1
+            if not end:
+                continue
+            out.append(u'\x1b[%d;1H' % (y + 1))
+            prev = None
+            for x in range(end):
+                if sids[x] != prev:
+                    prev = sids[x]
+                    out.append(_sgr(table[prev]))
+                out.append(text[x])
+
+        # The cursors saved by DECSC, with what it saves along, while
+        # there are no margins yet to position them from. Restoring one
+        # brings it within the screen anyway.
+        for savepoint in self.savepoints:
+            cursor = savepoint.cursor
+            out.append(_mode(mo.DECOM, savepoint.origin))
+            out.append(_mode(mo.DECAWM, savepoint.wrap))
+            out.append(_mode(mo.DECTCEM, not cursor.hidden))
+            out.append(u'\x1b[%d;%dH' % (min(cursor.y, self.lines - 1) + 1,
+                                         min(cursor.x, self.columns - 1) + 1))
+            out.append(_sgr(cursor.attrs[1:]))
+            out.append(_charsets(savepoint.g0_charset, savepoint.g1_charset,
+                                 savepoint.charset))
+            out.append(u'\x1b7\x1b(B\x0f')
+
+        top, bottom = self.margins
+        out.append(u'\x1b[%d;%dr' % (top + 1, bottom + 1))
+        for mode in _DUMPED_MODES:
+            out.append(_mode(mode, mode in self.mode))
+        y = self.cursor.y
+        if mo.DECOM in self.mode:
+            y -= top
+        x = self.cursor.x
+        if x < self.columns:
+            out.append(u'\x1b[%d;%dH' % (y + 1, x + 1))
+        else:
+            # Past the last column, the wrap pending: writing the last
+            # cell again leaves the cursor there
+            x = self.columns - 1
+            out.append(u'\x1b[%d;%dH' % (y + 1, x + 1))
+            out.append(_sgr(table[grid.sids[self.cursor.y][x]]))
+            out.append(grid.text[self.cursor.y][x])
+        out.append(_charsets(self.g0_charset, self.g1_charset, self.charset))
+
+        # The background of 256 colours the cells may have set, then the
+        # cursor attributes, which leave it alone. Unless they have such
+        # a background themselves while there's none, which only ESC 8
+        # after SGR 49 gives: MyScreen takes it for one then.
+        out.append(u'\x1b[49m')
+        if self.bg256 is not None:
+            out.append(u'\x1b[48;5;%dm' % CLUT.index(self.bg256))
+        out.append(_sgr(self.cursor.attrs[1:]))
+        return u''.join(out)
+
+    def set_row(self, y, text, sids):
+        """Set the cells of row ``y`` to the characters of ``text`` with
+        the style IDs ``sids``, padded with blanks to the screen width."""
+        columns = self.columns
+        text = text[:columns].ljust(columns)
+        sids = list(sids[:columns])
+        sids.extend([0] * (columns - len(sids)))
+        if len(_chars) > _MAX_CHARS:
+            _chars.clear()
+        cells = list(zip(text, sids))
+        line = list(map(_chars.get, cells))
+        if None in line:
+            for x, cell in enumerate(cells):
+                if line[x] is None:
+                    if cell not in _chars:
+                        _chars[cell] = Char._make((cell[0],) +
+                                                  styles.table[cell[1]])
+                    line[x] = _chars[cell]
+        self[y] = line
+        self.grid.set_line(y, text, sids)
+        self.dirty.add(y)
+
+    def __scroll(self, top, bottom, count):
+        scrolls = self.scrolls
+        if scrolls and scrolls[-1][:2] == (top, bottom) \
+                and (scrolls[-1][2] > 0) == (count > 0):
+            scrolls[-1] = (top, bottom, scrolls[-1][2] + count)
+        elif len(scrolls) < MAX_SCROLLS:
+            scrolls.append((top, bottom, count))
+        else:
+            # Too fragmented to be worth it, redraw everything
+            self.scrolls = []
+            self.dirty.update(range(self.lines))
+            return
+
+        # Dirty lines move along with the region
+        moved = set()
+        for lineno in self.dirty:
+            if top <= lineno <= bottom:
+                lineno -= count
+                if not top <= lineno <= bottom:
+                    continue
+            moved.add(lineno)
+        moved.add(bottom if count > 0 else top)
+        self.dirty = moved
+
+    # DiffScreen marks every line dirty when scrolling, skip it
+    def index(self):
+        top, bottom = self.margins
+        if self.cursor.y == bottom:
+            if top == 0 and self.history is not None:
+                self.history.append_row(*self.grid.row(top))
+            self.__scroll(top, bottom, 1)
+            self.grid.delete(top)
+            self.grid.insert(bottom)
+        pyte.Screen.index(self)
+
+    def reverse_index(self):
+        top, bottom = self.margins
+        if self.cursor.y == top:
+            self.__scroll(top, bottom, -1)
+            self.grid.delete(bottom)
+            self.grid.insert(top)
+        pyte.Screen.reverse_index(self)
@@ -0,0 +1,485 @@
+# -*- coding: utf-8 -*-
+
+import mmap
+import struct
+import tempfile
+import threading
+import zlib
+from array import array
+from collections import deque, OrderedDict
+
+from . import styles
+from .search import build_filter, filter_probe, may_contain, find_in_line
+
+
+if hasattr(array, 'tobytes'):
+    def _tobytes(a):
+        return a.tobytes()
+
+    def _frombytes(a, data):
+        a.frombytes(data)
+else:  # Python 2
+    def _tobytes(a):
+        return a.tostring()
+
+    def _frombytes(a, data):
+        a.fromstring(data)
+
+
+def pack_line(line):
+    """Return ``(text, runs)`` for a list of pyte characters."""
+    return pack_row(*styles.split_line(line))
+
+
+def pack_row(text, sids):
+    """Return ``(text, runs)`` for the text and style IDs of a line.
+
+    ``runs`` is a flat ``array('H')`` of ``style ID, count`` pairs. Blank
+    cells with the default style at the end of the line are dropped.
+    """
+    end = len(text)
+    while end and text[end - 1] == u' ' and sids[end - 1] == 0:
+        end -= 1
+
+    text = text[:end]
+    runs = array('H')
+    prev = None
+    count = 0
+    for sid in sids[:end]:
+        if sid == prev and count < 0xffff:
+            count += 1
+        else:
+            if count:
+                runs.append(prev)
+                runs.append(count)
+            prev = sid
+            count = 1
+    if count:
+        runs.append(prev)
+        runs.append(count)
+    return text, runs
+
+
+def unpack_styles(runs, width=0):
+    """Expand ``runs`` to one style ID per cell, padded to ``width``."""
+    sids = []
+    for i in range(0, len(runs), 2):
+        sids.extend([runs[i]] * runs[i + 1])
+    if len(sids) < width:
+        sids.extend([0] * (width - len(sids)))
+    return sids
+
+
+class _Block(object):
+    # Lines of a block are stored back to back: the UTF-8 text of all
+    # the lines in one buffer and their runs in one array, with the end
+    # offset of each line in the *_ends arrays. Once full, a block gets
+    # a trigram filter for searching and is handed to a ScrollbackStore
+    # which may compress it (packed) or move it to the spill file
+    # (extent), releasing the arrays.
+    __slots__ = ('start', 'length', 'text', 'text_ends', 'runs', 'run_ends',
+                 'packed', 'extent', 'store', 'filter')
+
+    def __init__(self, start):
+        self.start = start
+        self.length = 0
+        self.text = bytearray()
+        self.text_ends = array('I')
+        self.runs = array('H')
+        self.run_ends = array('I')
+        self.packed = None
+        self.extent = None
+        self.store = None
+        self.filter = None
+
+    def __len__(self):
+        return self.length
+
+    def append(self, text, runs):
+        self.text.extend(text.encode('utf-8'))
+        self.text_ends.append(len(self.text))
+        self.runs.extend(runs)
+        self.run_ends.append(len(self.runs))
+        self.length += 1
+
+    def get(self, i):
+        if self.store is not None:
+            return self.store.get(self, i)
+        return self.line(i)
+
+    def line(self, i):
+        text_start = self.text_ends[i - 1] if i else 0
+        run_start = self.run_ends[i - 1] if i else 0
+        text = self.text[text_start:self.text_ends[i]].decode('utf-8')
+        return text, self.runs[run_start:self.run_ends[i]]
+
+    def nbytes(self):
+        if self.text is None:
+            return 0
+        return (len(self.text) +
+                self.text_ends.itemsize * len(self.text_ends) +
+                self.runs.itemsize * len(self.runs) +
+                self.run_ends.itemsize * len(self.run_ends))
+
+    def pack(self):
+        data = b''.join([
+            struct.pack('<IIII', len(self.text), len(self.text_ends),
+                        len(self.runs), len(self.run_ends)),
+            bytes(self.text), _tobytes(self.text_ends),
+            _tobytes(self.runs), _tobytes(self.run_ends)])
+        self.text = self.text_ends = self.runs = self.run_ends = None
+        return data
+
+    def unpack(self, data):
+        sizes = struct.unpack_from('<IIII', data)
+        pos = struct.calcsize('<IIII')
+        self.text = bytearray(data[pos:pos + sizes[0]])
+        pos += sizes[0]
+        fields = []
+        for typecode, count in zip('IHI', sizes[1:]):
+            a = array(typecode)
+            end = pos + count * a.itemsize
+            _frombytes(a, data[pos:end])
+            fields.append(a)
+            pos = end
+        self.text_ends, self.runs, self.run_ends = fields
+
+
+class ScrollbackStore(object):
+    """Keeps the full blocks of all the scrollbacks within a memory budget.
+
+    Blocks are in one of three tiers, in least recently used order:
+
+    * hot: plain arrays, up to ``hot_fraction`` of ``memory_budget``;
+    * compressed: zlib compressed in memory;
+    * spilled: compressed, in a memory-mapped temporary file, once hot and
+      compressed blocks together go over ``memory_budget``.
+
+    Reading a line of a block that is not hot decompresses the block and
+    makes it hot again.
+    """
+
+    def __init__(self, memory_budget=64 * 1024 * 1024, hot_fraction=0.5,
+                 compress_level=1):
+        self.memory_budget = memory_budget
+        self.hot_fraction = hot_fraction
+        self.compress_level = compress_level
+
+        self.__lock = threading.Lock()
+        self.__hot = OrderedDict()
+        self.__compressed = OrderedDict()
+        self.__spilled = set()
+        self.__hot_bytes = 0
+        self.__compressed_bytes = 0
+        self.__spilled_bytes = 0
+
+        self.__file = None
+        self.__map = None
+        self.__file_size = 0
+        self.__free = []  # [(offset, size)] sorted free extents
+
+    def add(self, block):
+        with self.__lock:
+            block.store = self
+            self.__hot[block] = block.nbytes()
+            self.__hot_bytes += self.__hot[block]
+            self.__enforce()
+
+    def discard(self, block):
+        with self.__lock:
+            block.store = None
+            self.__drop(block)
+
+    def get(self, block, i):
+        with self.__lock:
+            self.__touch(block)
+            return block.line(i)
+
+    def contents(self, block):
+        """Copies of the text and arrays of ``block``, see :class:`_Block`.
+        """
+        with self.__lock:
+            self.__touch(block)
+            return (bytes(block.text), block.text_ends[:], block.runs[:],
+                    block.run_ends[:])
+
+    def __touch(self, block):
+        if block in self.__hot:
+            size = self.__hot.pop(block)
+            self.__hot[block] = size
+        else:
+            self.__load(block)
+            self.__enforce()
+
+    def stats(self):
+        """Bytes and number of blocks in each tier."""
+        with self.__lock:
+            return {
+                'hot': self.__hot_bytes,
+                'hot_blocks': len(self.__hot),
+                'compressed': self.__compressed_bytes,
+                'compressed_blocks': len(self.__compressed),
+                'spilled': self.__spilled_bytes,
+                'spilled_blocks': len(self.__spilled),
+                'spill_file': self.__file_size,
+            }
+
+    def set_memory_budget(self, memory_budget):
+        with self.__lock:
+            self.memory_budget = memory_budget
+            self.__enforce()
+
+    def __drop(self, block):
+        if block in self.__hot:
+            self.__hot_bytes -= self.__hot.pop(block)
+        elif block in self.__compressed:
+            del self.__compressed[block]
+            self.__compressed_bytes -= len(block.packed)
+            block.packed = None
+        elif block in self.__spilled:
+            self.__spilled.remove(block)
+            self.__spilled_bytes -= block.extent[1]
+            self.__release(block.extent)
+            block.extent = None
+
+    def __load(self, block):
+        if block.packed is not None:
+            data = block.packed
+        else:
+            offset, size = block.extent
+            data = self.__map[offset:offset + size]
+        self.__drop(block)
+        block.unpack(zlib.decompress(data))
+        self.__hot[block] = block.nbytes()
+        self.__hot_bytes += self.__hot[block]
+
+    def __enforce(self):
+        hot_budget = self.memory_budget * self.hot_fraction
+        while self.__hot_bytes > hot_budget and len(self.__hot) > 1:
+            block, size = self.__hot.popitem(last=False)
+            self.__hot_bytes -= size
+            block.packed = zlib.compress(block.pack(), self.compress_level)
+            self.__compressed[block] = None
+            self.__compressed_bytes += len(block.packed)
+
+        while (self.__hot_bytes + self.__compressed_bytes >
+               self.memory_budget and self.__compressed):
+            block, _ = self.__compressed.popitem(last=False)
+            self.__compressed_bytes -= len(block.packed)
+            block.extent = self.__write(block.packed)
+            block.packed = None
+            self.__spilled.add(block)
+            self.__spilled_bytes += block.extent[1]
+
+    def __write(self, data):
+        size = len(data)
+        offset = self.__allocate(size)
+        if offset is None:
+            self.__grow(size)
+            offset = self.__allocate(size)
+        self.__map[offset:offset + size] = data
+        return offset, size
+
+    def __allocate(self, size):
+        # First fit in the free extents of the spill file
+        for i, (offset, free) in enumerate(self.__free):
+            if free >= size:
+                if free == size:
+                    del self.__free[i]
+                else:
+                    self.__free[i] = (offset + size, free - size)
+                return offset
+        return None
+
+    def __grow(self, size):
+        new_size = max(self.__file_size + size, self.__file_size * 2,
+                       mmap.PAGESIZE)
+        if self.__file is None:
+            self.__file = tempfile.TemporaryFile(prefix='wxterm-')
+            self.__file.truncate(new_size)
+            self.__map = mmap.mmap(self.__file.fileno(), new_size)
+        else:
+            self.__map.resize(new_size)
+        self.__release((self.__file_size, new_size - self.__file_size))
+        self.__file_size = new_size
+
+    def __release(self, extent):
+        offset, size = extent
+        free = self.__free
+        free.append((offset, size))
+        free.sort()
+        # Merge adjacent extents
+        merged = [free[0]]
+        for offset, size in free[1:]:
+            prev_offset, prev_size = merged[-1]
+            if prev_offset + prev_size == offset:
+                merged[-1] = (prev_offset, prev_size + size)
+            else:
+                merged.append((offset, size))
+        self.__free[:] = merged
+
+
+# Shared by all the terminals
+shared_store = ScrollbackStore()
+
+
+class Scrollback(object):
+    """Lines scrolled off the top of the screen, oldest first.
+
+    Lines are packed with :func:`pack_line` into blocks of
+    ``block_lines`` lines. Whole blocks are dropped once more than
+    ``max_lines`` lines are kept. Full blocks are handed to ``store``,
+    :data:`shared_store` by default.
+    """
+
+    def __init__(self, max_lines=10000, block_lines=256, store=None):
+        self.max_lines = max_lines
+        self.block_lines = block_lines
+        self.store = store if store is not None else shared_store
+        self.__blocks = deque()
+        self.clear()
+
+    def clear(self):
+        for block in self.__blocks:
+            if block.store is not None:
+                block.store.discard(block)
+        self.__blocks = deque()
+        self.__len = 0
+        # Lines ever appended, the absolute number of the next line
+        self.total = 0
+
+    def __del__(self):
+        # Full blocks are referenced by the store until discarded
+        for block in self.__blocks:
+            if block.store is not None:
+                block.store.discard(block)
+
+    def __len__(self):
+        return self.__len
+
+    def append(self, line):
+        self.append_packed(*pack_line(line))
+
+    def append_row(self, text, sids):
+        self.append_packed(*pack_row(text, sids))
+
+    def append_packed(self, text, runs):
+        blocks = self.__blocks
+        if not blocks or len(blocks[-1]) >= self.block_lines:
+            if blocks:
+                blocks[-1].filter = build_filter(blocks[-1].text)
+                self.store.add(blocks[-1])
+            blocks.append(_Block(self.total))
+        blocks[-1].append(text, runs)
+        self.__len += 1
+        self.total += 1
+
+        while self.__len - len(blocks[0]) >= self.max_lines:
+            block = blocks.popleft()
+            self.__len -= len(block)
+            if block.store is not None:
+                block.store.discard(block)
+
+    def dump(self):
+        """Return ``(text, text_ends, runs, run_ends)``, all the lines back
+        to back: their UTF-8 text, the ``array('I')`` of where the text of
+        each line ends, their runs and where the runs of each line end."""
+        text = []
+        text_ends = array('I')
+        runs = array('H')
+        run_ends = array('I')
+        size = 0
+        for block in self.__blocks:
+            if block.store is not None:
+                data, ends, block_runs, block_run_ends = \
+                    block.store.contents(block)
+            else:
+                data, ends, block_runs, block_run_ends = (
+                    bytes(block.text), block.text_ends, block.runs,
+                    block.run_ends)
+            text.append(data)
+            text_ends.extend([end + size for end in ends])
+            run_ends.extend([end + len(runs) for end in block_run_ends])
+            runs.extend(block_runs)
+            size += len(data)
+        return b''.join(text), text_ends, runs, run_ends
+
+    def load(self, total, text, text_ends, runs, run_ends):
+        """Replace the lines with those of a :meth:`dump`, the last of
+        them being line ``total - 1``.
+
+        Blocks are built straight from the arrays. They get no trigram
+        filter, so searching them has to read every line.
+        """
+        self.clear()
+        self.total = total
+        blocks = self.__blocks
+        count = len(text_ends)
+        i = 0
+        while i < count:
+            # Blocks start on multiples of block_lines, see __locate
+            start = total - count + i
+            end = min(count, i + self.block_lines - start % self.block_lines)
+            block = _Block(start)
+            text_start = text_ends[i - 1] if i else 0
+            run_start = run_ends[i - 1] if i else 0
+            block.text = bytearray(text[text_start:text_ends[end - 1]])
+            block.text_ends = array('I', [e - text_start
+                                          for e in text_ends[i:end]])
+            block.runs = runs[run_start:run_ends[end - 1]]
+            block.run_ends = array('I', [e - run_start
+                                         for e in run_ends[i:end]])
+            block.length = end - i
+            blocks.append(block)
+            self.__len += block.length
+            i = end
+
+        # Whole blocks are dropped like in append_packed
+        while blocks and self.__len - len(blocks[0]) >= self.max_lines:
+            self.__len -= len(blocks.popleft())
+        for block in list(blocks)[:-1]:
+            self.store.add(block)
+
+    def __locate(self, n):
+        if not 0 <= n < self.__len:
+            raise IndexError(n)
+        blocks = self.__blocks
+        n += blocks[0].start
+        block = blocks[n // self.block_lines - blocks[0].start //
+                       self.block_lines]
+        return block, n - block.start
+
+    def get(self, n):
+        """Return ``(text, runs)`` of line ``n``, 0 being the oldest."""
+        block, i = self.__locate(n)
+        return block.get(i)
+
+    def search(self, needle, n, col=None, backward=False, ignore_case=True):
+        """Search ``needle`` from line ``n``, see :func:`search.find`.
+
+        ``needle`` must already be lowercase when ``ignore_case``. Blocks
+        whose trigram filter rules out the needle are skipped without
+        being decompressed. Return ``(n, col)`` or None.
+        """
+        probe = filter_probe(needle, ignore_case)
+        while 0 <= n < self.__len:
+            block, i = self.__locate(n)
+            if probe is not None and block.filter is not None \
+                    and not may_contain(block.filter, probe):
+                n += -(i + 1) if backward else len(block) - i
+                col = None
+                continue
+
+            text, _ = block.get(i)
+            if ignore_case:
+                text = text.lower()
+            pos = find_in_line(text, needle, col, backward)
+            if pos >= 0:
+                return n, pos
+            n += -1 if backward else 1
+            col = None
+        return None
+
+    def nbytes(self):
+        """Memory used by the lines that are not compressed."""
+        return sum(block.nbytes() for block in self.__blocks)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+# Bits of the trigram filter of a scrollback block
+FILTER_BITS = 32768
+_MASK = FILTER_BITS - 1
+
+
+def _trigrams(data):
+    data = bytearray(data)
+    return set(zip(data, data[1:], data[2:]))
+
+
+def build_filter(data):
+    """Bloom filter of the byte trigrams of ``data`` (lowercased ASCII),
+    as a ``bytearray`` of ``FILTER_BITS`` bits with two hashes per
+    trigram."""
+    bits = bytearray(FILTER_BITS // 8)
+    for trigram in _trigrams(bytes(data).lower()):
+        h = hash(trigram)
+        for b in (h & _MASK, (h >> 15) & _MASK):
+            bits[b >> 3] |= 1 << (b & 7)
+    return bits
+
+
+def filter_probe(needle, ignore_case=True):
+    """Return what :func:`may_contain` needs to test a filter for
+    ``needle``, or ``None`` when the needle is too short to filter.
+
+    The filter only rules blocks out, so it is probed with the needle
+    lowercased like the blocks, whether the case is ignored or not.
+    """
+    probe = []
+    for trigram in _trigrams(needle.encode('utf-8').lower()):
+        # Non ASCII case folding doesn't match the filter's
+        if ignore_case and max(trigram) >= 0x80:
+            continue
+        h = hash(trigram)
+        for b in (h & _MASK, (h >> 15) & _MASK):
+            probe.append((b >> 3, 1 << (b & 7)))
+    return probe or None
+
+
+def may_contain(bits, probe):
+    for index, mask in probe:
+        if not bits[index] & mask:
+            return False
+    return True
+
+
+def find_in_line(text, needle, col=None, backward=False):
+    """Column of ``needle`` in ``text`` after ``col`` (before ``col`` if
+    ``backward``), or -1. ``col`` None searches the whole line."""
+    if backward:
+        if col is None:
+            return text.rfind(needle)
+        return text.rfind(needle, 0, col + len(needle) - 1)
+    if col is None:
+        return text.find(needle)
+    return text.find(needle, col + 1)
+
+
+def find_all(text, needle):
+    """``(start, end)`` of every occurrence of ``needle`` in ``text``."""
+    spans = []
+    if not needle:
+        return spans
+    col = text.find(needle)
+    while col >= 0:
+        spans.append((col, col + len(needle)))
+        col = text.find(needle, col + len(needle))
+    return spans
+
+
+def find(history, screen_lines, needle, start=None, backward=False,
+         ignore_case=True):
+    """Search the history and then the screen for ``needle``.
+
+    Lines are numbered from the oldest history line (0) to the last
+    screen line (``len(history) + len(screen_lines) - 1``). The search
+    starts after the ``(line, col)`` position ``start``, or before it if
+    ``backward``; from the first or the last line when ``start`` is None.
+    Return the ``(line, col)`` of the match or None.
+    """
+    if ignore_case:
+        needle = needle.lower()
+    history_len = len(history) if history is not None else 0
+    total = history_len + len(screen_lines)
+
+    if start is None:
+        line, col = (total - 1 if backward else 0), None
+    else:
+        line, col = start
+
+    step = -1 if backward else 1
+    while 0 <= line < total:
+        if line < history_len:
+            # Skips whole blocks that can't contain the needle
+            found = history.search(needle, line, col, backward, ignore_case)
+            if found is not None:
+                return found
+            line = history_len if not backward else -1
+            col = None
+            continue
+
+        text = screen_lines[line - history_len]
+        if ignore_case:
+            text = text.lower()
+        pos = find_in_line(text, needle, col, backward)
+        if pos >= 0:
+            return line, pos
+        line += step
+        col = None
+    return None
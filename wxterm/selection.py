@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# Selection modes
+LINEAR = 'linear'
+BLOCK = 'block'
+WORD = 'word'
+LINE = 'line'
+
+
+class Selection(object):
+    """Cells selected between an anchor and a head position.
+
+    A position is ``(line, start, end)``: a line number that doesn't change
+    as the view scrolls, and the columns ``start`` to ``end`` it covers.
+    That is an empty span between two cells in :data:`LINEAR` and
+    :data:`BLOCK` modes and the span of a word in :data:`WORD` mode. Only
+    the two positions are stored, whatever the size of the selection.
+    """
+
+    def __init__(self, mode, line, start, end=None):
+        self.mode = mode
+        self.anchor = (line, start, start if end is None else end)
+        self.head = self.anchor
+
+    def extend(self, line, start, end=None):
+        """Move the head of the selection."""
+        self.head = (line, start, start if end is None else end)
+
+    def __ordered(self):
+        if self.head[:2] < self.anchor[:2]:
+            return self.head, self.anchor
+        return self.anchor, self.head
+
+    def lines(self):
+        """The first and last lines of the selection."""
+        first, last = self.__ordered()
+        return first[0], last[0]
+
+    def span(self, line, width):
+        """Return the ``(start, end)`` columns selected on ``line``, for
+        lines of ``width`` columns, or None."""
+        first, last = self.__ordered()
+        if not first[0] <= line <= last[0]:
+            return None
+
+        mode = self.mode
+        if mode == LINE:
+            return 0, width
+        if mode == BLOCK:
+            start = min(self.anchor[1], self.head[1])
+            end = max(self.anchor[2], self.head[2])
+        else:
+            start = first[1] if line == first[0] else 0
+            end = last[2] if line == last[0] else width
+        end = min(end, width)
+        if start >= end:
+            return None
+        return start, end
+
+    def is_empty(self):
+        first, last = self.__ordered()
+        if self.mode == BLOCK:
+            return self.anchor[1] == self.head[1]
+        return self.mode == LINEAR and first[:2] == last[:2]
@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+
+import os
+import fcntl
+import pty
+import termios
+import struct
+import threading
+
+import pyte
+
+from . import snapshot
+from .iohub import shared_hub
+from .matcher import OutputMatcher
+from .recording import Recorder
+from .scrollback import Scrollback
+from .screen import TerminalScreen, BRACKETED_PASTE
+
+
+# Characters fed to the screen at a time, holding the screen lock
+PARSE_SLICE = 16 * 1024
+
+_text_type = type(u'')
+
+
+class TerminalSession(object):
+    """A child process on a pty and the screen its output is parsed into.
+
+    Needs no GUI: the pty is served by the shared
+    :class:`~wxterm.iohub.IOHub` and the output is queued until parsed,
+    either by :meth:`parse_pending` or, with ``threaded_parser``, by a
+    parser thread of its own. Reading from the child is paused while
+    more than ``read_ahead`` bytes are waiting to be parsed.
+
+    What happens is reported to the callbacks below, called from the I/O
+    thread (or the parser thread). They are set before
+    :meth:`fork_command`, or by the next view of a session whose view
+    went away (see :meth:`detach`):
+
+    * ``on_ready()``: the child wrote its first output;
+    * ``on_output()``: output is waiting for :meth:`parse_pending`, or,
+      with the threaded parser, the screen changed. It may call
+      :meth:`parse_pending` itself to parse on the I/O thread;
+    * ``on_match(name, match)``: a pattern added with :meth:`add_pattern`
+      showed up in the output;
+    * ``on_paste_progress(written, total)``: part of a paste was written;
+    * ``on_close()``: the child side of the pty is closed, :meth:`wait`
+      won't block for long.
+
+    The callbacks belong to the view; a subclass driving the session
+    itself overrides :meth:`handle_output`, :meth:`handle_drained` and
+    :meth:`handle_close` instead, which are kept whatever the view, see
+    :class:`wxterm.aio.Session`.
+
+    .. attribute:: screen
+
+       The :class:`~wxterm.screen.TerminalScreen`, along with its
+       ``dirty`` lines and ``scrolls`` not yet displayed.
+
+    .. attribute:: history
+
+       The :class:`~wxterm.scrollback.Scrollback` of the screen, None if
+       ``scrollback`` is 0.
+
+    .. attribute:: lock
+
+       Guards the screen and the history, which may be fed from another
+       thread.
+    """
+
+    on_ready = None
+    on_output = None
+    on_match = None
+    on_paste_progress = None
+    on_close = None
+
+    def __init__(self, columns=80, lines=24, scrollback=10000,
+                 read_ahead=256 * 1024, threaded_parser=False,
+                 encoding='utf-8'):
+        self.encoding = encoding
+        self.read_ahead = read_ahead
+        self.threaded_parser = threaded_parser
+        self.pid = None
+        self.fd = None
+        self.__status = None
+        self.__wait_lock = threading.Lock()
+
+        self.lock = threading.Lock()
+        self.history = Scrollback(scrollback) if scrollback else None
+        self.screen = TerminalScreen(columns, lines)
+        self.screen.history = self.history
+        self.__stream = pyte.Stream()
+        self.__stream.attach(self.screen)
+        self.reset()
+
+        self.__hub = None
+        self.__writer = None
+        self.__recorder = None
+        self.__parser = None
+        self.__child_ready = False
+        self.__closed = False
+
+        # Patterns looked for in the output as it is read
+        self.__matcher = OutputMatcher()
+
+        # Output read from the child waiting to be parsed
+        self.__pending = []
+        self.__pending_size = 0
+        self.__pending_cond = threading.Condition(threading.Lock())
+        self.__reading_paused = False
+
+    def fork_command(self, command, argv, directory=None):
+        """Run ``command`` with the arguments ``argv`` in the terminal and
+        return its pid."""
+        if not directory:
+            directory = os.getcwd()
+        pid, fd = pty.fork()
+        if pid == 0:
+            os.chdir(directory)
+            os.putenv('TERM', 'linux')
+            fcntl.ioctl(0, termios.TIOCSWINSZ,
+                        struct.pack('hhhh', self.screen.lines,
+                                    self.screen.columns, 0, 0))
+            os.execlp(command, *argv)
+
+        self.pid, self.fd = pid, fd
+        self.__status = None
+        self.__matcher.reset()
+        if self.threaded_parser:
+            self.__parser = threading.Thread(target=self.__parse_output)
+            self.__parser.daemon = True
+            self.__parser.start()
+
+        # No thread per terminal, the pty is served by the shared hub
+        self.__hub = shared_hub()
+        self.__writer = self.__hub.add(fd, self.__queue_output,
+                                       self.__child_closed,
+                                       self.__paste_progress,
+                                       self.encoding, self.handle_drained)
+        return pid
+
+    def wait(self):
+        """Wait for the child to exit, and the parser thread to be done
+        with its output. Return the status given by :func:`os.waitpid`,
+        kept for the next calls, which may come from other threads."""
+        with self.__wait_lock:
+            if self.__status is None:
+                _, self.__status = os.waitpid(self.pid, 0)
+        if self.__parser is not None:
+            self.__parser.join()
+        return self.__status
+
+    def close(self):
+        """Stop serving the pty and close it, which hangs up the child.
+        Stop recording too."""
+        self.stop_recording()
+        if self.fd is None:
+            return
+        if self.__hub is not None:
+            self.__hub.remove(self.fd)
+        os.close(self.fd)
+        self.fd = None
+
+    @property
+    def child_closed(self):
+        """Whether the child side of the pty is closed: the child exited,
+        or is about to."""
+        with self.__pending_cond:
+            return self.__closed
+
+    def detach(self):
+        """Drop the callbacks, once the view they belong to is gone.
+
+        From then on the output waits to be parsed, within the read
+        ahead budget: past it reading from the child is paused, until
+        another view sets its callbacks and calls :meth:`parse_pending`.
+        The parser thread, if any, goes on feeding the screen. Nobody
+        waits for the child in the meantime.
+        """
+        self.on_ready = None
+        self.on_output = None
+        self.on_match = None
+        self.on_paste_progress = None
+        self.on_close = None
+
+    def reset(self):
+        with self.lock:
+            self.screen.reset()
+            # to have accented chars displayed correctly
+            self.screen.set_charset('B', '(')
+
+    def resize(self, columns, lines):
+        """Resize the screen and let the child know."""
+        self.__set_window_size(columns, lines)
+        with self.lock:
+            self.screen.resize(lines, columns)
+        if self.__recorder is not None:
+            self.__recorder.resize(columns, lines)
+
+    def __set_window_size(self, columns, lines):
+        if self.fd is not None:
+            fcntl.ioctl(self.fd, termios.TIOCSWINSZ,
+                        struct.pack('hhhh', lines, columns, 0, 0))
+
+    def save_snapshot(self, path, history=True):
+        """Save the screen, and the history if ``history``, to ``path``,
+        see :func:`wxterm.snapshot.dumps`."""
+        with self.lock:
+            data = snapshot.dumps(self.screen,
+                                  self.history if history else None)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def load_snapshot(self, path):
+        """Bring the screen back to a snapshot saved by
+        :meth:`save_snapshot`, along with the history if it was saved.
+        The screen takes the size of the snapshot."""
+        with open(path, 'rb') as f:
+            saved = snapshot.loads(f.read())
+        self.__set_window_size(saved.columns, saved.lines)
+        recorder = self.__recorder
+        if recorder is not None:
+            recorder.resize(saved.columns, saved.lines)
+        with self.lock:
+            saved.restore(self.screen, self.history)
+            if recorder is not None:
+                # Replays reset the screen and redraw it
+                recorder.output(u'\x1bc' + self.screen.dump())
+
+    def start_recording(self, path, **kwargs):
+        """Record the output, the input and the resizes to ``path``, see
+        :class:`~wxterm.recording.Recorder`."""
+        self.stop_recording()
+        with self.lock:
+            recorder = Recorder(path, self.screen.columns, self.screen.lines,
+                                **kwargs)
+            # The recording starts with what is on the screen
+            recorder.output(self.screen.dump())
+        self.__recorder = recorder
+
+    def stop_recording(self):
+        recorder, self.__recorder = self.__recorder, None
+        if recorder is not None:
+            recorder.close()
+
+    @property
+    def display(self):
+        """The text of every line of the screen."""
+        with self.lock:
+            return self.screen.grid.display
+
+    def feed(self, data):
+        """Parse ``data``, a unicode string, into the screen."""
+        # In slices, so others never wait long for the screen
+        for i in range(0, len(data), PARSE_SLICE):
+            with self.lock:
+                self.__stream.feed(data[i:i + PARSE_SLICE])
+
+    def parse_pending(self):
+        """Parse the output read so far. Return False if there was none
+        (or the parser thread takes care of it)."""
+        with self.__pending_cond:
+            if self.__parser is not None or not self.__pending:
+                return False
+            pending = self.__pending
+            self.__pending = []
+            self.__pending_size = 0
+            self.__check_read_ahead()
+        self.__parse(u''.join(pending))
+        return True
+
+    def __parse(self, data):
+        # Output is recorded as it is parsed, so the keyframes match it
+        recorder = self.__recorder
+        if recorder is not None:
+            recorder.output(data)
+        self.feed(data)
+        if recorder is not None and recorder.keyframe_due():
+            with self.lock:
+                # A replay from the keyframe starts with a fresh parser:
+                # wait for a chunk that doesn't end within a sequence
+                if self.__stream.state != 'stream':
+                    return
+                screen = self.screen
+                recorder.keyframe(screen.columns, screen.lines, screen.dump())
+
+    def take_damage(self):
+        """Return the lines changed and the scroll operations done since
+        the last call, see :class:`~wxterm.screen.TerminalScreen`, and
+        forget them. Must be called with :attr:`lock` held."""
+        screen = self.screen
+        dirty = sorted(screen.dirty)
+        scrolls = screen.scrolls
+        screen.dirty.clear()
+        screen.scrolls = []
+        return dirty, scrolls
+
+    def write(self, data):
+        """Send ``data``, a unicode or encoded string, to the child.
+
+        It is queued and written as the child reads it, never blocking
+        the caller.
+        """
+        if self.__writer:
+            if isinstance(data, _text_type):
+                data = data.encode(self.encoding)
+            self.__writer.put(data)
+            if self.__recorder is not None:
+                self.__recorder.input(data)
+
+    def paste(self, text):
+        """Send ``text`` to the child as pasted text, wrapped in bracketed
+        paste sequences if the child enabled them."""
+        if not self.__writer:
+            return
+        if isinstance(text, _text_type):
+            text = text.encode(self.encoding)
+        with self.lock:
+            bracketed = BRACKETED_PASTE in self.screen.mode
+        if bracketed:
+            # The pasted text must not end the paste itself
+            text = text.replace(b'\x1b[201~', b'')
+            self.__writer.put(b'\x1b[200~')
+            self.__writer.put(text, paste=True)
+            self.__writer.put(b'\x1b[201~')
+        else:
+            self.__writer.put(text, paste=True)
+        if self.__recorder is not None:
+            self.__recorder.input(
+                b'\x1b[200~' + text + b'\x1b[201~' if bracketed else text)
+
+    def cancel_paste(self):
+        """Drop what hasn't been written yet of the pastes."""
+        if self.__writer:
+            self.__writer.cancel_paste()
+
+    def paste_progress(self):
+        """``(written, total)`` bytes of the pastes being written, or
+        None."""
+        if self.__writer:
+            return self.__writer.progress()
+        return None
+
+    def input_pending(self):
+        """Whether some of the input written is yet to be taken by the
+        child."""
+        return bool(self.__writer) and self.__writer.pending()
+
+    def add_pattern(self, name, pattern):
+        """Call ``on_match`` whenever ``pattern`` shows up in the output,
+        see :class:`~wxterm.matcher.OutputMatcher`."""
+        self.__matcher.add(name, pattern)
+
+    def remove_pattern(self, name):
+        self.__matcher.remove(name)
+
+    def set_read_ahead(self, size):
+        """Number of bytes the child may get ahead of the parser before
+        reading from it is paused."""
+        with self.__pending_cond:
+            self.read_ahead = size
+            self.__check_read_ahead()
+
+    def absolute_line(self, line):
+        """Text of a line numbered from the first line ever added to the
+        history, None if it's gone from the history. Must be called with
+        :attr:`lock` held."""
+        screen = self.screen
+        history = self.history
+        if history is not None:
+            n = line - (history.total - len(history))
+            if n < 0:
+                return None
+            if n < len(history):
+                text, _ = history.get(n)
+                return text.ljust(screen.columns)
+            line = n - len(history)
+        if 0 <= line < screen.lines:
+            return screen.grid.text[line].tounicode()
+        return None
+
+    def selected_text(self, selection):
+        """Text of the cells covered by a
+        :class:`~wxterm.selection.Selection`, numbered like
+        :meth:`absolute_line`."""
+        if selection is None or selection.is_empty():
+            return u''
+        first, last = selection.lines()
+        text_selected = []
+        for line in range(first, last + 1):
+            # Lines are read one by one from the screen and the history
+            with self.lock:
+                text = self.absolute_line(line)
+            if text is None:
+                continue
+            span = selection.span(line, len(text))
+            if span is not None:
+                text_selected.append(text[span[0]:span[1]].rstrip())
+        return u'\n'.join(text_selected)
+
+    def handle_output(self, data):
+        """Called from the I/O thread with each piece of output, before
+        it is queued to be parsed. Does nothing here."""
+
+    def handle_drained(self):
+        """Called from the I/O thread whenever all the input written
+        was taken by the child. Does nothing here."""
+
+    def handle_close(self):
+        """Called from the I/O thread once the child side of the pty is
+        closed, after ``on_close``. Does nothing here."""
+
+    def __check_read_ahead(self):
+        # Stop reading from the child while more than the read ahead
+        # budget is waiting to be parsed. Called with pending_cond held.
+        paused = self.__pending_size >= self.read_ahead
+        if self.__hub is not None and paused != self.__reading_paused:
+            self.__reading_paused = paused
+            if paused:
+                self.__hub.pause(self.fd)
+            else:
+                self.__hub.resume(self.fd)
+
+    def __queue_output(self, data, size):
+        # Called from the I/O hub thread
+        if not self.__child_ready:
+            self.__child_ready = True
+            if self.on_ready:
+                self.on_ready()
+        self.handle_output(data)
+
+        if len(self.__matcher) and self.on_match:
+            for name, match in self.__matcher.feed(data):
+                self.on_match(name, match)
+
+        with self.__pending_cond:
+            self.__pending.append(data)
+            self.__pending_size += size
+            if self.__parser is not None:
+                self.__pending_cond.notify_all()
+            self.__check_read_ahead()
+        if self.__parser is None and self.on_output:
+            self.on_output()
+
+    def __paste_progress(self, progress):
+        # Called from the I/O hub thread
+        if self.on_paste_progress:
+            self.on_paste_progress(*progress)
+
+    def __child_closed(self):
+        # Called from the I/O hub thread
+        with self.__pending_cond:
+            self.__closed = True
+            self.__pending_cond.notify_all()
+        if self.on_close:
+            self.on_close()
+        self.handle_close()
+
+    def __parse_output(self):
+        # Parser thread: feeds the screen and lets the owner know it
+        # changed
+        cond = self.__pending_cond
+        while True:
+            with cond:
+                while not self.__pending and not self.__closed:
+                    cond.wait()
+                if not self.__pending:
+                    break
+                data = u''.join(self.__pending)
+                self.__pending = []
+                self.__pending_size = 0
+                self.__check_read_ahead()
+
+            self.__parse(data)
+            if self.on_output:
+                self.on_output()
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+import struct
+import sys
+import zlib
+from array import array
+
+from pyte import charsets as cs
+from pyte.screens import Char, Cursor, Margins, Savepoint
+
+from . import styles
+from .scrollback import pack_row, unpack_styles, _tobytes, _frombytes
+
+
+MAGIC = b'WXTS'
+VERSION = 1
+
+# Flags of the header
+HISTORY = 1
+COMPRESSED = 2
+
+# Magic, version, flags, columns, lines
+_HEADER = struct.Struct('<4sHHHH')
+
+# Bits of the attributes of a style, after fg and bg
+_STYLE_FLAGS = (styles.BOLD, styles.ITALICS, styles.UNDERSCORE,
+                styles.STRIKETHROUGH, styles.REVERSE)
+
+_BIG_ENDIAN = sys.byteorder == 'big'
+
+
+class _Writer(object):
+
+    def __init__(self):
+        self.parts = []
+
+    def pack(self, fmt, *values):
+        self.parts.append(struct.pack('<' + fmt, *values))
+
+    def data(self, data):
+        self.pack('I', len(data))
+        self.parts.append(data)
+
+    def string(self, text):
+        self.data(text.encode('utf-8'))
+
+    def array(self, a):
+        if _BIG_ENDIAN:
+            a = a[:]
+            a.byteswap()
+        self.data(_tobytes(a))
+
+    def lines(self, text, text_ends, runs, run_ends):
+        self.data(text)
+        self.array(text_ends)
+        self.array(runs)
+        self.array(run_ends)
+
+    def getvalue(self):
+        return b''.join(self.parts)
+
+
+class _Reader(object):
+
+    def __init__(self, data):
+        self.buffer = data
+        self.pos = 0
+
+    def unpack(self, fmt):
+        fmt = '<' + fmt
+        values = struct.unpack_from(fmt, self.buffer, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values
+
+    def data(self):
+        size, = self.unpack('I')
+        data = self.buffer[self.pos:self.pos + size]
+        if len(data) != size:
+            raise ValueError('truncated snapshot')
+        self.pos += size
+        return data
+
+    def string(self):
+        return self.data().decode('utf-8')
+
+    def array(self, typecode):
+        a = array(typecode)
+        data = self.data()
+        if len(data) % a.itemsize:
+            raise ValueError('truncated snapshot')
+        _frombytes(a, data)
+        if _BIG_ENDIAN:
+            a.byteswap()
+        return a
+
+    def lines(self):
+        return (self.data(), self.array('I'), self.array('H'),
+                self.array('I'))
+
+
+class _StyleMap(object):
+    # Numbers the styles used in a snapshot from 0, in the order they
+    # are met, so the snapshot doesn't depend on the shared style table
+
+    def __init__(self):
+        self.ids = {}
+        self.styles = []
+
+    def __call__(self, sid):
+        local = self.ids.get(sid)
+        if local is None:
+            local = self.ids[sid] = len(self.styles)
+            self.styles.append(styles.table[sid])
+        return local
+
+    def runs(self, runs):
+        runs = runs[:]
+        runs[::2] = array('H', [self(sid) for sid in runs[::2]])
+        return runs
+
+
+def _charset_code(charset):
+    for code, mapping in cs.MAPS.items():
+        if mapping == charset:
+            return code
+    return 'B'
+
+
+def dumps(screen, history=None, compress=True):
+    """Return a snapshot of ``screen``, a
+    :class:`~wxterm.screen.TerminalScreen`, and of ``history``, its
+    :class:`~wxterm.scrollback.Scrollback`, if given.
+
+    The snapshot holds the cells of the screen, as runs of style IDs like
+    in the history, the cursor, the scrolling region, the modes, the
+    charsets, the tab stops, the saved cursors and the lines of the
+    history. Styles are stored once, in a table of the styles used.
+    ``compress`` compresses the whole with zlib.
+    """
+    styles_used = _StyleMap()
+    flags = (HISTORY if history is not None else 0) | \
+        (COMPRESSED if compress else 0)
+    body = _Writer()
+
+    # The screen, packed like history lines
+    text = []
+    text_ends = array('I')
+    runs = array('H')
+    run_ends = array('I')
+    size = 0
+    grid = screen.grid
+    for y in range(screen.lines):
+        line, line_runs = pack_row(grid.text[y].tounicode(), grid.sids[y])
+        data = line.encode('utf-8')
+        text.append(data)
+        size += len(data)
+        text_ends.append(size)
+        runs.extend(styles_used.runs(line_runs))
+        run_ends.append(len(runs))
+    body.lines(b''.join(text), text_ends, runs, run_ends)
+
+    # The state of the screen
+    cursor = screen.cursor
+    body.pack('HHHB', cursor.x, cursor.y, styles_used(
+        styles.table.intern(cursor.attrs[1:])), cursor.hidden)
+    body.pack('HHB', screen.margins.top, screen.margins.bottom,
+              screen.charset)
+    body.string(u'%s%s' % (_charset_code(screen.g0_charset),
+                           _charset_code(screen.g1_charset)))
+    body.string(screen.bg256 or u'')
+    body.array(array('I', sorted(screen.mode)))
+    body.array(array('H', sorted(screen.tabstops)))
+    body.pack('H', len(screen.savepoints))
+    for savepoint in screen.savepoints:
+        saved = savepoint.cursor
+        body.pack('HHHBBBB', saved.x, saved.y, styles_used(
+            styles.table.intern(saved.attrs[1:])), saved.hidden,
+            savepoint.charset, savepoint.origin, savepoint.wrap)
+        body.string(u'%s%s' % (_charset_code(savepoint.g0_charset),
+                               _charset_code(savepoint.g1_charset)))
+
+    if history is not None:
+        text, text_ends, runs, run_ends = history.dump()
+        body.pack('Q', history.total)
+        body.lines(text, text_ends, styles_used.runs(runs), run_ends)
+
+    # The styles go first, they are only known now
+    out = _Writer()
+    out.pack('I', len(styles_used.styles))
+    for style in styles_used.styles:
+        out.string(style[styles.FG])
+        out.string(style[styles.BG])
+        bits = 0
+        for i, attr in enumerate(_STYLE_FLAGS):
+            if style[attr]:
+                bits |= 1 << i
+        out.pack('B', bits)
+    out.parts.extend(body.parts)
+    data = out.getvalue()
+    if compress:
+        data = zlib.compress(data, 1)
+    return _HEADER.pack(MAGIC, VERSION, flags, screen.columns,
+                        screen.lines) + data
+
+
+def loads(data):
+    """Read a snapshot made by :func:`dumps`. Raise ValueError if it is
+    not one."""
+    try:
+        magic, version, flags, columns, lines = _HEADER.unpack_from(data)
+    except struct.error:
+        raise ValueError('not a snapshot')
+    if magic != MAGIC:
+        raise ValueError('not a snapshot')
+    if version > VERSION:
+        raise ValueError('snapshot version %d not supported' % version)
+    data = data[_HEADER.size:]
+    if flags & COMPRESSED:
+        try:
+            data = zlib.decompress(data)
+        except zlib.error as e:
+            raise ValueError('corrupt snapshot: %s' % e)
+    try:
+        return Snapshot(columns, lines, flags, _Reader(data))
+    except struct.error:
+        raise ValueError('truncated snapshot')
+
+
+class Snapshot(object):
+    """A screen, and its history if saved, read by :func:`loads`.
+
+    .. attribute:: columns
+
+    .. attribute:: lines
+
+       Size of the screen.
+    """
+
+    def __init__(self, columns, lines, flags, reader):
+        self.columns = columns
+        self.lines = lines
+
+        # Style IDs of the styles of the snapshot in the shared table
+        sids = []
+        count, = reader.unpack('I')
+        for _ in range(count):
+            fg = reader.string()
+            bg = reader.string()
+            bits, = reader.unpack('B')
+            style = [fg, bg] + [bool(bits & 1 << i)
+                                for i in range(len(_STYLE_FLAGS))]
+            sids.append(styles.table.intern(tuple(style)))
+        self.__sids = sids
+        self.__styles = [styles.table[sid] for sid in sids]
+        renumber = sids != list(range(len(sids)))
+
+        self.__rows = reader.lines()
+        if renumber:
+            self.__renumber(self.__rows[2])
+
+        self.__cursor = reader.unpack('HHHB')
+        self.__margins = reader.unpack('HHB')
+        self.__charsets = reader.string()
+        self.__bg256 = reader.string() or None
+        self.__modes = reader.array('I')
+        self.__tabstops = reader.array('H')
+        self.__savepoints = []
+        count, = reader.unpack('H')
+        for _ in range(count):
+            self.__savepoints.append((reader.unpack('HHHBBBB'),
+                                      reader.string()))
+
+        self.history = None
+        if flags & HISTORY:
+            total, = reader.unpack('Q')
+            self.history = (total,) + reader.lines()
+            if renumber:
+                self.__renumber(self.history[3])
+
+    def __renumber(self, runs):
+        sids = self.__sids
+        runs[::2] = array('H', [sids[sid] for sid in runs[::2]])
+
+    def __cursor_at(self, x, y, sid, hidden):
+        cursor = Cursor(x, y, Char._make((u' ',) + self.__styles[sid]))
+        cursor.hidden = bool(hidden)
+        return cursor
+
+    def restore(self, screen, history=None):
+        """Bring ``screen`` to the state of the snapshot, and ``history``
+        too, if given and the snapshot has one. The screen takes the size
+        of the snapshot."""
+        # Nothing of the screen goes to its history on this resize
+        screen_history = screen.history
+        screen.history = None
+        try:
+            screen.resize(self.lines, self.columns)
+        finally:
+            screen.history = screen_history
+        screen.reset()
+
+        text, text_ends, runs, run_ends = self.__rows
+        for y in range(min(self.lines, len(text_ends))):
+            text_start = text_ends[y - 1] if y else 0
+            run_start = run_ends[y - 1] if y else 0
+            screen.set_row(y, text[text_start:text_ends[y]].decode('utf-8'),
+                           unpack_styles(runs[run_start:run_ends[y]]))
+
+        x, y, sid, hidden = self.__cursor
+        screen.cursor = self.__cursor_at(x, y, sid, hidden)
+        top, bottom, charset = self.__margins
+        screen.margins = Margins(top, bottom)
+        screen.charset = charset
+        screen.g0_charset = cs.MAPS.get(self.__charsets[0], cs.LAT1_MAP)
+        screen.g1_charset = cs.MAPS.get(self.__charsets[1], cs.VT100_MAP)
+        screen.bg256 = self.__bg256
+        screen.mode = set(self.__modes)
+        screen.tabstops = set(self.__tabstops)
+        screen.savepoints = []
+        for (x, y, sid, hidden, charset, origin, wrap), charsets in \
+                self.__savepoints:
+            screen.savepoints.append(Savepoint(
+                self.__cursor_at(x, y, sid, hidden),
+                cs.MAPS.get(charsets[0], cs.LAT1_MAP),
+                cs.MAPS.get(charsets[1], cs.VT100_MAP),
+                charset, bool(origin), bool(wrap)))
+        screen.scrolls = []
+        screen.dirty.update(range(screen.lines))
+
+        if history is not None and self.history is not None:
+            history.load(*self.history)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+
+# Style IDs are stored in array('H') columns, so they must fit in 16 bits
+MAX_STYLES = 0x10000
+
+# Order of the attributes of a style, same as pyte's Char without "data"
+FG, BG, BOLD, ITALICS, UNDERSCORE, STRIKETHROUGH, REVERSE = range(7)
+
+DEFAULT_STYLE = ("default", "default", False, False, False, False, False)
+
+
+class StyleTable(object):
+    """Interns pyte character attributes into small integer IDs.
+
+    A style is the tuple ``char[1:]`` of a pyte ``Char``: ``(fg, bg, bold,
+    italics, underscore, strikethrough, reverse)``. The same style always
+    maps to the same ID, and ID 0 is the default style. Once the table is
+    full, new styles fall back to the default one.
+    """
+
+    def __init__(self, default=DEFAULT_STYLE):
+        self.__ids = {}
+        self.__styles = []
+        self.__lock = threading.Lock()
+        self.intern(default)
+
+        # Fast path for hot loops: returns None for unknown styles
+        self.get = self.__ids.get
+
+    def intern(self, style):
+        sid = self.__ids.get(style)
+        if sid is None:
+            with self.__lock:
+                sid = self.__ids.get(style)
+                if sid is None:
+                    if len(self.__styles) >= MAX_STYLES:
+                        return 0
+                    sid = len(self.__styles)
+                    self.__styles.append(style)
+                    self.__ids[style] = sid
+        return sid
+
+    def __getitem__(self, sid):
+        return self.__styles[sid]
+
+    def __len__(self):
+        return len(self.__styles)
+
+
+# Shared by all the terminals, so style IDs can be exchanged between them
+table = StyleTable()
+
+
+def split_line(line):
+    """Return the text and the list of style IDs of a list of pyte
+    characters."""
+    style_get = table.get
+    style_intern = table.intern
+    sids = []
+    for char in line:
+        attrs = char[1:]
+        sid = style_get(attrs)
+        if sid is None:
+            sid = style_intern(attrs)
+        sids.append(sid)
+    return u''.join([char[0] for char in line]), sids
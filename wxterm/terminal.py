@@ -2,19 +2,17 @@
 
 import wx
 import wx.lib.newevent
-import os
 import re
-import fcntl
-import pty
-import select
-import termios
-import pyte
-import pyte.screens
-import struct
 import threading
-from collections import namedtuple
-from pyte import graphics as g
-from .colors256 import CLUT
+import time
+from collections import namedtuple, deque
+from . import styles
+from .atlas import shared_atlas
+from .scrollback import unpack_styles
+from .session import TerminalSession
+from .host import RemoteSession
+from .selection import Selection, LINEAR, BLOCK, WORD, LINE
+from . import search
 
 use_GC = False
 if use_GC:
@@ -23,11 +21,16 @@ else:
     GCDC = lambda a: a
 
 
-draw_done = threading.Event()
-
 (ChildExitEvent, EVT_TERM_CHILD_EXIT) = wx.lib.newevent.NewEvent()
 (ChildReadyEvent, EVT_TERM_CHILD_READY) = wx.lib.newevent.NewEvent()
 (TermReadyEvent, EVT_TERM_READY) = wx.lib.newevent.NewEvent()
+# Has the written and total attributes, in bytes
+(PasteProgressEvent, EVT_TERM_PASTE_PROGRESS) = wx.lib.newevent.NewEvent()
+# Has the name of the pattern and its match attributes, see AddPattern
+(MatchEvent, EVT_TERM_MATCH) = wx.lib.newevent.NewEvent()
+
+# Seconds after a double click during which a click selects a line
+TRIPLE_CLICK_DELAY = 0.5
 
 
 wxBOLD = wx.BOLD
@@ -44,6 +47,19 @@ _Caret = namedtuple("_Caret", [
     "prev_line",
     ])
 
+# What the GUI thread needs to paint a frame, taken from the screen in
+# one go so it is consistent even when the screen is fed by another thread
+_Snapshot = namedtuple("_Snapshot", [
+    "lines",  # [(lineno, [char, ...]), ...] lines to redraw
+    "cursor_x",
+    "cursor_y",
+    "bg256",
+    "scrolls",  # [(top, bottom, count), ...] see TerminalScreen.scrolls
+    "rows",
+    "history",  # number of lines in the history
+    "offset",  # number of history lines the view is scrolled back
+    ])
+
 # ['blue', 'brown', u'default', 'green', 'cyan', 'white', 'magenta', 'red']
 colormap_normal = {
     'default': wx.Colour(205, 205, 205),
@@ -74,52 +90,83 @@ colormap_bg = {
     'black': wx.Colour(0, 0, 0),
     }
 
-
-class MyScreen(pyte.Screen):
-    def __init__(self, *args, **kwargs):
-        super(MyScreen, self).__init__(*args, **kwargs)
-        self.bg256 = None
-
-    def select_graphic_rendition(self, *attrs):
-        """Set display attributes.
-
-        :param list attrs: a list of display attributes to set.
-        """
-        replace = {}
-
-        for attr in attrs or [0]:
-            if attr == 38 and len(attrs) == 3 and attrs[1] == 5:
-                replace["fg"] = CLUT[attrs[2]]
-                break
-            elif attr == 48 and len(attrs) == 3 and attrs[1] == 5:
-                replace["bg"] = CLUT[attrs[2]]
-                if self.bg256 is None:
-                    self.bg256 = replace["bg"]
-                break
-            elif attr in g.FG:
-                replace["fg"] = g.FG[attr]
-            elif attr in g.BG:
-                if attr == 49:
-                    self.bg256 = None
-                replace["bg"] = g.BG[attr]
-            elif attr in g.TEXT:
-                attr = g.TEXT[attr]
-                replace[attr[1:]] = attr.startswith("+")
-            elif not attr:
-                replace = self.default_char._asdict()
-
-        self.cursor.attrs = self.cursor.attrs._replace(**replace)
-
-
-class _Terminal(pyte.DiffScreen, MyScreen):
-    pass
+# Outline of the current search match, drawn over its inverted cells
+current_match_colour = wx.Colour(255, 215, 0)
+
+
+def _colour(value):
+    if isinstance(value, wx.Colour):
+        return value
+    return wx.NamedColour(value)
+
+
+def _changed_span(old, text, sids):
+    # First and last (excluded) cells that differ from the old version
+    # of a line, given as (text, sids)
+    old_text, old_sids = old
+    n = len(text)
+    if len(old_text) != n:
+        return 0, n
+    start = 0
+    while start < n and text[start] == old_text[start] \
+            and sids[start] == old_sids[start]:
+        start += 1
+    if start == n:
+        return n, n
+    end = n
+    while text[end - 1] == old_text[end - 1] \
+            and sids[end - 1] == old_sids[end - 1]:
+        end -= 1
+    return start, end
+
+
+def _merge_spans(spans):
+    # Sorted (start, end) spans with the overlapping ones merged
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _font_variants(font, allow_underline, allow_bold, allow_italic):
+    # Index is underline | bold << 1 | italic << 2
+    desc = font.GetNativeFontInfoDesc()
+    fonts = []
+    for i in xrange(8):
+        variant = wx.FontFromNativeInfoString(desc)
+        if allow_underline:
+            variant.SetUnderlined(bool(i & 1))
+        if allow_bold:
+            variant.SetWeight(wxBOLD if i & 2 else wxNORMAL)
+        if allow_italic:
+            variant.SetStyle(wxITALIC if i & 4 else wxNORMAL)
+        fonts.append(variant)
+    return fonts
 
 
 class TerminalWindow(wx.ScrolledWindow):
     def __init__(self, parent, id=wx.ID_ANY,
                  pos=wx.DefaultPosition, size=wx.DefaultSize, style=0,
-                 allow_underline=True, allow_bold=True, allow_italic=True):
-
+                 allow_underline=True, allow_bold=True, allow_italic=True,
+                 frame_rate=60, read_ahead=256 * 1024,
+                 threaded_parser=False, renderer='text', atlas_size=4096,
+                 scrollback=10000, session=None, out_of_process=False):
+
+        # The pty, the parser and the screen; the window is a view of it.
+        # The session may have been shown by another window, see
+        # AttachSession. Out of process, the pty and the parser are in a
+        # worker process, see RemoteSession.
+        if session is None:
+            session_class = RemoteSession if out_of_process \
+                else TerminalSession
+            session = session_class(scrollback=scrollback,
+                                    read_ahead=read_ahead,
+                                    threaded_parser=threaded_parser)
+        if session.history is not None:
+            style |= wx.VSCROLL
         wx.ScrolledWindow.__init__(self, parent, id, pos, size,
                                    style | wx.WANTS_CHARS)
 
@@ -128,22 +175,69 @@ class TerminalWindow(wx.ScrolledWindow):
         self.__allow_italic = allow_italic
 
         self.__caret = _Caret(0, 0, 0, 0, 1, 1, 1, 1)
-        self.__io = None
+        # The buffer only holds the text. The caret, the selection and
+        # the search matches are an overlay drawn over it on the window.
+        self.__caret_cell = None  # (col, line, focused)
+        # Overlay, current match and caret on the window
+        self.__shown = ({}, None, None)
+        # lineno -> (text, styles, bg256) of the lines in the buffer, so
+        # only the cells that changed get redrawn
+        self.__rendered = {}
+        # lineno -> spans of the search matches in the rendered text,
+        # found again once the line is redrawn
+        self.__found = {}
         self.__screen = None
         self.__buffer = None
 
-        self.__select_begin = None
-        self.__select_end = None
-        self.__selection = {}
+        self.__session = None
+        # Guards the screen, which may be fed from the parser thread
+        self.__screen_lock = None
+
+        # Lines scrolled off the screen and how far back the view is
+        self.__history = None
+        self.__view_offset = 0
+        self.__view_total = 0
+        self.__redraw_all = False
+        self.__scrollbar = None
+
+        # Lines of the selection and the search are numbered from the
+        # first line ever added to the history; view_top is the number of
+        # the top line of the view
+        self.__view_top = 0
+        self.__selection = None
+        self.__dclick_time = 0
+
+        # (needle, ignore_case) highlighted on the view, needle lowercase
+        # if ignore_case, and the absolute (line, col) of the current match
+        self.__search = None
+        self.__match = None
 
         self.__motion_prev_col = None
         self.__motion_prev_line = None
-        self.__motion_prev_sels = {}
 
         self.__has_focus = False
         self.__update_timer = None
 
+        # Whether the next frame is scheduled already
+        self.__frame_lock = threading.Lock()
+        self.__frame_scheduled = False
+        self.__frame_interval = 0
+        self.__last_frame = 0
+        self.__frame_times = deque(maxlen=1024)
+        self.SetFrameRate(frame_rate)
+        # Frames not drawn while the window could not be seen; the
+        # buffer is behind the screen until painted again
+        self.__frames_skipped = 0
+        self.__stale = False
+
         self.__font = wx.Font(10, wx.TELETYPE, wx.NORMAL, wx.NORMAL)
+        self.__fonts = None
+        # 'text' draws runs with DrawText, 'atlas' blits cached glyphs
+        self.__renderer = renderer
+        self.__atlas_size = atlas_size
+        self.__atlas = None
+        # style ID -> (fg, bg, font), one dict per 256 colour background
+        self.__palettes = {}
 
         self.SetBackgroundStyle(wx.BG_STYLE_CUSTOM)
         self.SetBackgroundColour(wx.BLACK)
@@ -156,19 +250,62 @@ class TerminalWindow(wx.ScrolledWindow):
         # set the cursor for the window
         self.SetCursor(cursor)
 
+        self.__attach(session)
+        self.Bind(wx.EVT_WINDOW_DESTROY, self.__on_destroy)
+
         #self.Bind(wx.EVT_WINDOW_CREATE, self.__terminal)
         wx.CallAfter(self.__terminal, None)
 
+    def __attach(self, session):
+        # Show the session, and from now on its changes
+        session.on_ready = self.__child_ready
+        session.on_output = self.__output_ready
+        session.on_match = self.__matched
+        session.on_paste_progress = self.__paste_progress
+        session.on_close = self.__child_closed
+        self.__session = session
+        self.__screen_lock = session.lock
+        self.__history = session.history
+
+        if self.__screen:
+            # Paint the screen once, as it is now, at the size of the
+            # window
+            session.parse_pending()
+            w, h = self.GetSize()
+            columns, lines = w / self.__col_width, h / self.__line_height
+            if (columns, lines) != (session.screen.columns,
+                                    session.screen.lines):
+                session.resize(columns, lines)
+            with self.__screen_lock:
+                self.__screen = session.screen
+                self.__view_offset = 0
+                self.__view_total = (session.history.total
+                                     if session.history is not None else 0)
+                self.__selection = None
+                self.__match = None
+                session.take_damage()
+            self.Redraw()
+
+        # The child may have exited while no one was looking
+        if session.child_closed:
+            wx.CallAfter(self.__exit, session)
+
+    def __on_destroy(self, event):
+        if event.GetEventObject() is self:
+            # Nothing is posted to the window anymore, the session may
+            # live on without it
+            self.__session.detach()
+        event.Skip()
+
     def __terminal(self, evt):
         w, h = self.GetSize()
 
         self.__buffer = wx.EmptyBitmap(w, h)
         self.__clear_buffer()
 
-        self.__stream = pyte.Stream()
-        self.__screen = _Terminal(w / self.__col_width, h / self.__line_height)
-        self.__stream.attach(self.__screen)
-        self.__reset()
+        self.__session.resize(w / self.__col_width, h / self.__line_height)
+        self.__screen = self.__session.screen
+        self.__update(clear=True)
 
         #self.__resize(w, h)
         self.Bind(wx.EVT_PAINT, self.__on_paint)
@@ -182,15 +319,33 @@ class TerminalWindow(wx.ScrolledWindow):
         self.Bind(wx.EVT_MIDDLE_DOWN, self.__on_middledown)
         self.Bind(wx.EVT_LEFT_DCLICK, self.__on_leftdclick)
         self.Bind(wx.EVT_MOTION, self.__on_motion)
+        self.Bind(wx.EVT_MOUSEWHEEL, self.__on_mousewheel)
+        self.Bind(wx.EVT_SCROLLWIN, self.__on_scrollwin)
 
         #print [a for a in dir(self) if 'focus' in a.lower()]
         self.__has_focus = self.FindFocus() is self
 
     def __update(self, clear=False):
-        dc = GCDC(wx.BufferedDC(wx.ClientDC(self), self.__buffer))
+        # Return False if nothing was drawn, the window being hidden
+        if not self.__visible():
+            # All of the screen is painted when the window shows again,
+            # see __on_paint: the damage is only taken, which lets an
+            # out of process session go on with the next frame
+            self.__stale = True
+            with self.__screen_lock:
+                self.__session.take_damage()
+            return False
+        dc = GCDC(wx.MemoryDC(self.__buffer))
         if clear:
             self.__clear_buffer(dc)
-        self.__draw(dc)
+        damage = self.__draw(dc)
+        self.__present(dc, damage, everything=clear)
+        return True
+
+    def __visible(self):
+        # Not in a hidden notebook page, or a minimised frame
+        return self.IsShownOnScreen() and \
+            not wx.GetTopLevelParent(self).IsIconized()
 
     def __on_kill_focus(self, event):
         self.__has_focus = False
@@ -201,15 +356,7 @@ class TerminalWindow(wx.ScrolledWindow):
         self.__update()
 
     def __text_from_selection(self):
-        text_selected = []
-        for l, sels in sorted(self.__selection.iteritems()):
-            if sels:
-                text_selected.append(
-                        (''.join([c.data for c in
-                            self.__screen[l][sels[0]:sels[-1] + 1]])
-                        ).rstrip()
-                            )
-        return '\n'.join(text_selected)
+        return self.__session.selected_text(self.__selection)
 
     def __clipboard_put(self, text_selected, use_primary=False):
         self.do = wx.TextDataObject()
@@ -240,6 +387,11 @@ class TerminalWindow(wx.ScrolledWindow):
         # With TERM=linux inside vim does not work without a map ex:
         # :map <ESC>[1;5C <C-Right>
         #print keycode
+        if event.ShiftDown() and keycode in (wx.WXK_PAGEUP, wx.WXK_PAGEDOWN):
+            page = max(self.__screen.lines - 1, 1)
+            self.ScrollHistory(page if keycode == wx.WXK_PAGEUP else -page)
+            return
+
         if event.ControlDown() and event.ShiftDown():
             if keycode == 3:  # SHIFT-CTRL-C
                 text_selected = self.__text_from_selection()
@@ -248,7 +400,7 @@ class TerminalWindow(wx.ScrolledWindow):
             elif keycode == 22:  # SHIFT-CTRL-V
                 text = self.__clipboard_get()
                 if text:
-                    os.write(self.__io, text.encode('utf-8'))
+                    self.Paste(text)
             event.Skip()
             return
 
@@ -298,7 +450,9 @@ class TerminalWindow(wx.ScrolledWindow):
             char = unichr(keycode)
 
         if char:
-            os.write(self.__io, char.encode('utf-8'))
+            self.FeedChild(char)
+            if self.__view_offset:
+                self.ScrollHistory(-self.__view_offset)
 
         if keycode == wx.WXK_TAB:
             return
@@ -308,19 +462,14 @@ class TerminalWindow(wx.ScrolledWindow):
         self.__resize(*event.GetSize())
         #event.Skip()
 
-    def __reset(self):
-        self.__screen.reset()
-        # to have accented chars displayed correctly
-        self.__screen.set_charset('B', '(')
-        #self.__clear_buffer()
-        self.__update(clear=True)
-
     def __clear_buffer(self, dc=None):
         if dc is None:
             dc = GCDC(wx.BufferedDC(wx.ClientDC(self), self.__buffer))
         dc.SetBackgroundMode(wx.SOLID)
         dc.SetBackground(wx.BLACK_BRUSH)
         dc.Clear()
+        self.__rendered = {}
+        self.__found = {}
 
     def IsShown(self):
         return wx.ScrolledWindow.IsShown(self)
@@ -328,16 +477,14 @@ class TerminalWindow(wx.ScrolledWindow):
     def __resize(self, w, h):
         if not self.IsShown():
             return
-        if self.__io and self.__screen:
+        if self.__session.fd is not None and self.__screen:
             cw, lh = self.__col_width, self.__line_height
             new_w = w / cw
             new_h = h / lh
 
             def __update():
                 self.__buffer = wx.EmptyBitmap(w, h)
-                fcntl.ioctl(self.__io, termios.TIOCSWINSZ,
-                        struct.pack("hhhh", new_h, new_w, 0, 0))
-                self.__screen.resize(new_h, new_w)
+                self.__session.resize(new_w, new_h)
                 #self.__clear_buffer()
                 self.__update(clear=True)
                 self.__update_timer = None
@@ -348,108 +495,329 @@ class TerminalWindow(wx.ScrolledWindow):
             #__update()
 
     def __on_paint(self, event):
-        dc = GCDC(wx.BufferedPaintDC(self, self.__buffer))
+        if self.__stale:
+            # Shown again: paint the screen once, as it is now
+            self.__stale = False
+            dc = GCDC(wx.MemoryDC(self.__buffer))
+            self.__clear_buffer(dc)
+            with self.__screen_lock:
+                self.__redraw_all = True
+            self.__draw(dc)
+            self.__shown = self.__overlay() + (self.__caret_cell,)
+        dc = GCDC(wx.PaintDC(self))
+        dc.DrawBitmap(self.__buffer, 0, 0)
+        self.__draw_overlay(dc, self.__all_rows())
+
+    def __style(self, style, screen_force_bg):
+        # Colours and font for a style ID
+        fg, bg, bold, italics, underscore, _, reverse = styles.table[style]
+
+        colormap = colormap_bold if bold else colormap_normal
+        fg = colormap.get(fg, fg)
+        if screen_force_bg:  # 256 colours
+            bg = bg if colormap_bg.get(bg) is None else screen_force_bg
+        else:
+            bg = colormap_bg.get(bg, bg)
+        if reverse:
+            fg, bg = bg, fg
 
-    def __draw_line(self, dc, y, lineno, linedata):
-        prev_style = None
-        start = 0
-        text = ''
+        font = self.__fonts[bool(underscore) | bold << 1 | italics << 2]
+        entry = (_colour(fg), _colour(bg), font)
+        self.__palettes.setdefault(screen_force_bg, {})[style] = entry
+        return entry
 
+    def __draw_line(self, dc, y, lineno, text, sids, screen_force_bg):
+        # Return the (start, end) columns redrawn
         col_width = self.__col_width
-        font = self.__font
-        colormap_bg_get = colormap_bg.get
-        screen_force_bg = self.__screen.bg256
-        selection = self.__selection
-
-        for current, char in enumerate(linedata):
-            colormap = colormap_bold if char[3] else colormap_normal
 
-            bg = colormap_bg_get(char[2], None)
-            if screen_force_bg:  # 256 colours
-                bg = char[2] if bg is None else screen_force_bg
-            else:
-                bg = colormap_bg_get(char[2], char[2])
-
-            style = [colormap.get(char[1], char[1]),  # fg
-                     bg,
-                     char[7],  # reverse
-                     char[5],  # underline
-                     char[3],  # bold
-                     char[4],  # italics
-                     ]
-
-            if selection and lineno in selection:
-                if current in selection[lineno]:
-                    style[2] = True  # reverse
-
-            if style == prev_style:
-                text += char[0]
-            else:
-                if prev_style is None:
-                    prev_style = style
-
-                if prev_style[2]:  # reverse
-                    dc.SetTextForeground(prev_style[1])
-                    dc.SetTextBackground(prev_style[0])
-                else:
-                    dc.SetTextForeground(prev_style[0])
-                    dc.SetTextBackground(prev_style[1])
-
-                if self.__allow_underline:
-                    font.SetUnderlined(prev_style[3])
-                if self.__allow_bold:
-                    font.SetWeight(wxBOLD if prev_style[4] else wxNORMAL)
-                if self.__allow_italic:
-                    font.SetStyle(wxITALIC if prev_style[5] else wxNORMAL)
-                dc.SetFont(font)
-                dc.DrawText(text, start * col_width, y)
+        # Skip the cells that are already in the buffer
+        old = self.__rendered.get(lineno)
+        if old is not None and old[2] == screen_force_bg:
+            first, last = _changed_span(old[:2], text, sids)
+            if first == last:
+                return None
+        else:
+            first, last = 0, len(sids)
+        self.__rendered[lineno] = (text, sids, screen_force_bg)
+        self.__found.pop(lineno, None)
 
-                text = char[0]
+        # Split the changed cells in runs of cells with the same style
+        runs = []
+        prev_style = None
+        start = first
+        for current in xrange(first, last):
+            style = sids[current]
+            if style != prev_style:
+                if current > first:
+                    runs.append((start, prev_style, text[start:current]))
                 start = current
                 prev_style = style
-
-        if start <= current:
-            if self.__allow_underline:
-                font.SetUnderlined(style[3])
-            if self.__allow_bold:
-                font.SetWeight(wxBOLD if style[4] else wxNORMAL)
-            if self.__allow_italic:
-                font.SetStyle(wxITALIC if style[5] else wxNORMAL)
-            dc.SetFont(font)
-            if style[2]:  # reverse
-                dc.SetTextForeground(style[1])
-                dc.SetTextBackground(style[0])
-            else:
-                dc.SetTextForeground(style[0])
-                dc.SetTextBackground(style[1])
-
+        if last > first:
+            runs.append((start, prev_style, text[start:last]))
+
+        palette = self.__palettes.setdefault(screen_force_bg, {})
+        atlas = self.__atlas
+        prev_font = None
+        for start, style, text in runs:
+            fg, bg, font = (palette.get(style) or
+                            self.__style(style, screen_force_bg))
+            if atlas is not None:
+                x = start * col_width
+                for char in text:
+                    atlas.draw(dc, x, y, (char, style, screen_force_bg),
+                               char, fg, bg, font)
+                    x += col_width
+                continue
+
+            dc.SetTextForeground(fg)
+            dc.SetTextBackground(bg)
+            if font is not prev_font:
+                dc.SetFont(font)
+                prev_font = font
             dc.DrawText(text, start * col_width, y)
-
-    def __draw(self, dc):
-        dc.SetBackgroundMode(wx.SOLID)
-
+        return first, last
+
+    def __view_line(self, lineno):
+        # Text and style IDs of a line of the view, which comes from the
+        # history when scrolled back. Called with the screen lock held.
+        screen = self.__screen
+        offset = self.__view_offset
+        if offset:
+            history = self.__history
+            n = len(history) - offset + lineno
+            if n < len(history):
+                text, runs = history.get(n)
+                return (text.ljust(screen.columns),
+                        unpack_styles(runs, screen.columns))
+            lineno = n - len(history)
+        return screen.grid.row(lineno)
+
+    def __snapshot(self):
+        with self.__screen_lock:
+            screen = self.__screen
+            cursor = screen.cursor
+
+            history = self.__history
+            if history is not None:
+                # Keep the view on the same lines while new ones arrive
+                if self.__view_offset:
+                    self.__view_offset = min(len(history),
+                            self.__view_offset + history.total -
+                            self.__view_total)
+                self.__view_total = history.total
+            offset = self.__view_offset
+            self.__view_top = (history.total if history is not None
+                               else 0) - offset
+            self.__record_cursor_position(cursor.x, cursor.y + offset)
+
+            dirty, scrolls = self.__session.take_damage()
+            if offset:
+                # Screen changes are only visible if part of the screen is
+                if offset < screen.lines and (dirty or scrolls):
+                    self.__redraw_all = True
+                scrolls = []
+            if self.__redraw_all:
+                self.__redraw_all = False
+                dirty = xrange(screen.lines)
+                scrolls = []
+
+            lines = [(lineno,) + self.__view_line(lineno)
+                     for lineno in dirty if lineno < screen.lines]
+            return _Snapshot(lines, cursor.x, cursor.y + offset,
+                             screen.bg256, scrolls, screen.lines,
+                             len(history) if history is not None else 0,
+                             offset)
+
+    def __scroll_buffer(self, dc, top, bottom, count):
+        # Move the pixels of lines top..bottom up by count lines (down if
+        # negative); the lines uncovered are dirty and will be redrawn
         lnh = self.__line_height
+        height = bottom - top + 1 - abs(count)
+        if height <= 0:
+            return
+        width = self.__buffer.GetWidth()
+        if count > 0:
+            dc.Blit(0, top * lnh, width, height * lnh,
+                    dc, 0, (top + count) * lnh)
+        else:
+            dc.Blit(0, (top - count) * lnh, width, height * lnh,
+                    dc, 0, top * lnh)
+
+    def __overlay(self):
+        # Cells drawn inverted over the buffer, line -> [(start, end)]:
+        # the selection and the matches of the search. Then the current
+        # match, (line, start, end), or None.
+        spans = {}
+        selection = self.__selection
+        if selection is not None:
+            top = self.__view_top
+            rows, columns = self.__screen.lines, self.__screen.columns
+            first, last = selection.lines()
+            for line in xrange(max(first, top), min(last + 1, top + rows)):
+                span = selection.span(line, columns)
+                if span is not None:
+                    spans[line - top] = [span]
+        if not self.__search:
+            return spans, None
+
+        needle, ignore_case = self.__search
+        found = self.__found
+        for lineno, (text, _, _) in self.__rendered.iteritems():
+            matches = found.get(lineno)
+            if matches is None:
+                matches = found[lineno] = search.find_all(
+                    text.lower() if ignore_case else text, needle)
+            if matches:
+                spans[lineno] = _merge_spans(spans.get(lineno, []) +
+                                             matches)
+        current = None
+        if self.__match is not None:
+            line, col = self.__match
+            lineno = line - self.__view_top
+            span = (col, col + len(needle))
+            # Unless it's gone from the view, or from the line
+            if span in found.get(lineno, ()):
+                current = (lineno,) + span
+        return spans, current
+
+    def __all_rows(self):
+        columns = self.__buffer.GetWidth() // self.__col_width + 1
+        return dict.fromkeys(xrange(self.__screen.lines), (0, columns))
+
+    def __present(self, dc, damage, everything=False):
+        # Copy the lines of the buffer that changed, {line: (start, end)}
+        # in columns, to the window, along with the overlay cells that
+        # changed, and draw the overlay over them
+        overlay, current = self.__overlay()
+        caret = self.__caret_cell
+        old_overlay, old_current, old_caret = self.__shown
+        self.__shown = (overlay, current, caret)
+
+        def extend(lineno, start, end):
+            if lineno in damage:
+                start = min(start, damage[lineno][0])
+                end = max(end, damage[lineno][1])
+            damage[lineno] = (start, end)
+
+        for lineno in set(overlay).union(old_overlay):
+            spans = overlay.get(lineno, [])
+            old_spans = old_overlay.get(lineno, [])
+            if spans != old_spans:
+                for start, end in spans + old_spans:
+                    extend(lineno, start, end)
+        if current != old_current:
+            for match in (current, old_current):
+                if match is not None:
+                    extend(*match)
+        if caret != old_caret:
+            for cell in (caret, old_caret):
+                if cell is not None:
+                    extend(cell[1], cell[0], cell[0] + 1)
+
+        client = GCDC(wx.ClientDC(self))
+        if everything:
+            damage = self.__all_rows()
+            client.Blit(0, 0, self.__buffer.GetWidth(),
+                        self.__buffer.GetHeight(), dc, 0, 0)
+        else:
+            cw, lnh = self.__col_width, self.__line_height
+            for lineno, (start, end) in damage.iteritems():
+                client.Blit(start * cw, lineno * lnh, (end - start) * cw,
+                            lnh, dc, start * cw, lineno * lnh)
+        self.__draw_overlay(client, damage)
+
+    def __draw_overlay(self, dc, lines):
+        # Draw the overlay shown over the spans {line: (start, end)} of
+        # the window, just copied from the buffer
+        cw, lnh = self.__col_width, self.__line_height
+        overlay, current, caret = self.__shown
+
+        dc.SetLogicalFunction(wx.INVERT)
+        dc.SetPen(wx.TRANSPARENT_PEN)
+        dc.SetBrush(wx.BLACK_BRUSH)
+        for lineno, (first, last) in lines.iteritems():
+            for start, end in overlay.get(lineno, ()):
+                start, end = max(start, first), min(end, last)
+                if start < end:
+                    dc.DrawRectangle(start * cw, lineno * lnh,
+                                     (end - start) * cw, lnh)
+        dc.SetLogicalFunction(wx.COPY)
+
+        if current is not None and current[0] in lines:
+            # Outlined, whole: drawing it again changes nothing
+            lineno, start, end = current
+            dc.SetPen(wx.Pen(current_match_colour))
+            dc.SetBrush(wx.TRANSPARENT_BRUSH)
+            dc.DrawRectangle(start * cw, lineno * lnh, (end - start) * cw,
+                             lnh)
 
-        # Always set the current and previous cursor lines as dirty
-        self.__screen.dirty.add(self.__caret.line)
-        self.__screen.dirty.add(self.__caret.prev_line)
-
-        for lineno, linedata in enumerate(self.__screen):
-            if lineno in self.__screen.dirty or lineno in self.__selection:
-                self.__draw_line(dc, lineno * lnh, lineno, linedata)
+        if caret is not None:
+            col, lineno, focused = caret
+            if lineno in lines and lines[lineno][0] <= col < lines[lineno][1]:
+                self.__draw_caret(dc, col * cw, lineno * lnh, focused)
 
-        # DrawCaret
+    def __draw_caret(self, dc, x, y, focused):
         dc.SetLogicalFunction(wx.XOR)
-        if self.__has_focus:
+        if focused:
             dc.SetPen(wx.TRANSPARENT_PEN)
             dc.SetBrush(wx.GREEN_BRUSH)
         else:
             dc.SetPen(wx.GREEN_PEN)
             dc.SetBrush(wx.TRANSPARENT_BRUSH)
-        dc.DrawRectangle(self.__caret.x, self.__caret.y, self.__col_width, lnh)
-        draw_done.set()
+        dc.DrawRectangle(x, y, self.__col_width, self.__line_height)
+        dc.SetLogicalFunction(wx.COPY)
+
+    def __scroll_rendered(self, top, bottom, count):
+        # The rendered lines and their matches move with the buffer
+        def scroll(lines):
+            moved = {}
+            for lineno, line in lines.iteritems():
+                if top <= lineno <= bottom:
+                    lineno -= count
+                    if not top <= lineno <= bottom:
+                        continue
+                moved[lineno] = line
+            return moved
+        self.__rendered = scroll(self.__rendered)
+        self.__found = scroll(self.__found)
+
+    def __draw(self, dc):
+        # Return the spans of the buffer that changed, {line: (start, end)}
+        dc.SetBackgroundMode(wx.SOLID)
+
+        lnh = self.__line_height
+        damage = {}
+
+        snapshot = self.__snapshot()
+
+        full = (0, self.__buffer.GetWidth() // self.__col_width + 1)
+        for top, bottom, count in snapshot.scrolls:
+            self.__scroll_buffer(dc, top, bottom, count)
+            self.__scroll_rendered(top, bottom, count)
+            damage.update(dict.fromkeys(xrange(top, bottom + 1), full))
+
+        for lineno, text, sids in snapshot.lines:
+            span = self.__draw_line(dc, lineno * lnh, lineno, text, sids,
+                                    snapshot.bg256)
+            if span is not None and lineno not in damage:
+                damage[lineno] = span
+
+        # The caret, unless scrolled out of the view
+        if snapshot.cursor_y < snapshot.rows:
+            self.__caret_cell = (self.__caret.col, self.__caret.line,
+                                 self.__has_focus)
+        else:
+            self.__caret_cell = None
 
-    def __record_cursor_position(self):
+        if self.__history is not None:
+            scrollbar = (snapshot.history - snapshot.offset, snapshot.rows,
+                         snapshot.history + snapshot.rows)
+            if scrollbar != self.__scrollbar:
+                self.__scrollbar = scrollbar
+                self.SetScrollbar(wx.VERTICAL, *scrollbar)
+        return damage
+
+    def __record_cursor_position(self, xx, yy):
         # previous positions
         px = self.__caret.x
         py = self.__caret.y
@@ -457,30 +825,88 @@ class TerminalWindow(wx.ScrolledWindow):
         pl = self.__caret.line
 
         # current positions
-        xx, yy = self.__screen.cursor.x, self.__screen.cursor.y
         x = xx * self.__col_width
         y = yy * self.__line_height
 
         self.__caret = _Caret(x, y, px, py, xx, yy, pc, pl)
 
-    def __update_display(self, data):
-        #if self.__screen:
-        self.__screen.dirty.clear()
-        self.__stream.feed(data)
-        self.__record_cursor_position()
-        self.__update()
-        #self.Refresh(False)
+    def __child_ready(self):
+        # Called from the I/O hub thread
+        evt = ChildReadyEvent()
+        evt.SetEventObject(self)
+        wx.PostEvent(self, evt)
+
+    def __output_ready(self):
+        # Called from the I/O hub or the parser thread
+        with self.__frame_lock:
+            if self.__frame_scheduled:
+                return
+            self.__frame_scheduled = True
+        wx.CallAfter(self.__schedule_frame)
+
+    def __matched(self, name, match):
+        # Called from the I/O hub thread
+        evt = MatchEvent(name=name, match=match)
+        evt.SetEventObject(self)
+        wx.PostEvent(self, evt)
+
+    def __paste_progress(self, written, total):
+        # Called from the I/O hub thread
+        evt = PasteProgressEvent(written=written, total=total)
+        evt.SetEventObject(self)
+        wx.PostEvent(self, evt)
+
+    def __child_closed(self):
+        # Called from the I/O hub thread
+        wx.CallAfter(self.__exit, self.__session)
+
+    def __schedule_frame(self):
+        delay = self.__last_frame + self.__frame_interval - time.time()
+        if delay > 0:
+            wx.FutureCall(int(delay * 1000) + 1, self.__render_frame)
+        else:
+            self.__render_frame()
+
+    def __render_frame(self):
+        with self.__frame_lock:
+            self.__frame_scheduled = False
+
+        self.__last_frame = now = time.time()
+        session = self.__session
+        # The parser thread has fed the screen already
+        if session.parse_pending() or session.threaded_parser:
+            if self.__update():
+                self.__frame_times.append(now)
+            else:
+                self.__frames_skipped += 1
+
+    def __extend_selection(self, col, line):
+        # Move the head of the selection to a cell of the view
+        selection = self.__selection
+        if selection.mode == WORD:
+            start, end, word = self.__get_word(col, line)
+            if word:
+                selection.extend(self.__view_top + line, start, end)
+                return
+        selection.extend(self.__view_top + line, col)
 
     def __on_leftdown(self, event):
         col = event.GetX() / self.__col_width
         line = event.GetY() / self.__line_height
-        self.__select_begin = (col, line)
-        self.__select_end = None
-
-        self.__screen.dirty = set(self.__selection.keys())
-        self.__selection = {}
+        if event.ShiftDown() and self.__selection is not None:
+            self.__extend_selection(col, line)
+        else:
+            if time.time() - self.__dclick_time < TRIPLE_CLICK_DELAY:
+                mode = LINE
+            elif event.AltDown():
+                mode = BLOCK
+            else:
+                mode = LINEAR
+            self.__selection = Selection(mode, self.__view_top + line, col)
+        self.__dclick_time = 0
         self.__update()
-        self.CaptureMouse()
+        if not self.HasCapture():
+            self.CaptureMouse()
         event.Skip()
 
     def __on_leftup(self, event):
@@ -488,13 +914,14 @@ class TerminalWindow(wx.ScrolledWindow):
             return
         self.ReleaseMouse()
         text_selected = self.__text_from_selection()
-        self.__clipboard_put(text_selected, True)
+        if text_selected:
+            self.__clipboard_put(text_selected, True)
         event.Skip()
 
     def __on_middledown(self, event):
         text = self.__clipboard_get(True)
         if text:
-            os.write(self.__io, text.encode('utf-8'))
+            self.Paste(text)
         event.Skip()
 
     def __on_leftdclick(self, event):
@@ -502,14 +929,18 @@ class TerminalWindow(wx.ScrolledWindow):
         line = event.GetY() / self.__line_height
         start, end, text_selected = self.__get_word(col, line)
         if text_selected:
-            self.__selection = {line: xrange(start, end)}
-            self.__screen.dirty.add(line)
-            self.__clipboard_put(text_selected, True)
+            self.__selection = Selection(WORD, self.__view_top + line,
+                                         start, end)
+            self.__dclick_time = time.time()
             self.__update()
+            # Dragging extends the selection by words
+            if not self.HasCapture():
+                self.CaptureMouse()
         event.Skip()
 
     def __on_motion(self, event):
-        if event.LeftIsDown() and self.HasCapture():
+        if event.LeftIsDown() and self.HasCapture() \
+                and self.__selection is not None:
             col = event.GetX() / self.__col_width
             line = event.GetY() / self.__line_height
 
@@ -520,58 +951,48 @@ class TerminalWindow(wx.ScrolledWindow):
             self.__motion_prev_line = line
             self.__motion_prev_col = col
 
-            self.__select_end = (col, line)
-
-            self.__screen.dirty.update(self.__motion_prev_sels.keys())
-
-            w = self.GetSize()[0]
-            sels = selection(self.__select_begin, self.__select_end,
-                                 w / self.__col_width)
-
-            self.__motion_prev_sels = sels
-            self.__screen.dirty.update(sels.keys())
-            self.__selection = sels
-
+            self.__extend_selection(col, line)
             self.__update()
 
-    def __process_input(self, io):
-        inp_ = [io]
+    def __on_mousewheel(self, event):
+        lines = float(event.GetWheelRotation()) / event.GetWheelDelta()
+        self.ScrollHistory(int(lines * event.GetLinesPerAction()))
 
-        evt = TermReadyEvent()
-        evt.SetEventObject(self)
-        wx.PostEvent(self, evt)
-
-        start_up = True
-        while True:
-            inp, out, err = select.select(inp_, [], [], None)
-            if io in inp:
-                if start_up:
-                    start_up = False
-                    evt = ChildReadyEvent()
-                    evt.SetEventObject(self)
-                    wx.PostEvent(self, evt)
-
-                try:
-                    data = os.read(io, 4096)
-                except OSError:
-                    break
-
-                wx.CallAfter(self.__update_display,
-                                data.decode('utf-8', 'replace'))
-                draw_done.clear()
-                draw_done.wait()
-
-        wx.CallAfter(self.__exit)
-
-    def __exit(self):
-        os.waitpid(self.__pid, 0)
-        self.t.join()
+    def __on_scrollwin(self, event):
+        if event.GetOrientation() != wx.VERTICAL or not self.__screen:
+            return
+        evt_type = event.GetEventType()
+        page = max(self.__screen.lines - 1, 1)
+        if evt_type == wx.wxEVT_SCROLLWIN_LINEUP:
+            self.ScrollHistory(1)
+        elif evt_type == wx.wxEVT_SCROLLWIN_LINEDOWN:
+            self.ScrollHistory(-1)
+        elif evt_type == wx.wxEVT_SCROLLWIN_PAGEUP:
+            self.ScrollHistory(page)
+        elif evt_type == wx.wxEVT_SCROLLWIN_PAGEDOWN:
+            self.ScrollHistory(-page)
+        elif evt_type == wx.wxEVT_SCROLLWIN_TOP:
+            self.ScrollHistory(len(self.__history))
+        elif evt_type == wx.wxEVT_SCROLLWIN_BOTTOM:
+            self.ScrollHistory(-self.__view_offset)
+        elif evt_type in (wx.wxEVT_SCROLLWIN_THUMBTRACK,
+                          wx.wxEVT_SCROLLWIN_THUMBRELEASE):
+            offset = len(self.__history) - event.GetPosition()
+            self.ScrollHistory(offset - self.__view_offset)
+
+    def __exit(self, session):
+        # Unless the session was detached meanwhile, or is done already
+        if session is not self.__session or session.fd is None:
+            return
+        session.wait()
+        session.close()
         evt = ChildExitEvent()
         evt.SetEventObject(self)
         wx.PostEvent(self, evt)
 
     def __get_word(self, col, line):
-        linetext = self.__screen.display[line]
+        with self.__screen_lock:
+            linetext, _ = self.__view_line(line)
         for m in re.finditer(r"\b([a-zA-Z0-9@#%&_\-\.]+)\b", linetext):
             if m.start() <= col <= m.end():
                 return m.start(), m.end(), m.group(0)
@@ -584,62 +1005,291 @@ class TerminalWindow(wx.ScrolledWindow):
             self.Bind(wx.EVT_CHAR, self.__on_char)
 
     def ForkCommand(self, command, argv, directory=None):
-        if not directory:
-            directory = os.getcwd()
-        _pid, self.__io = pty.fork()
-        if _pid == 0:
-            os.chdir(directory)
-            os.putenv('TERM', 'linux')
-            os.execlp(command, *argv)
-
-        self.t = t = threading.Thread(
-                            target=self.__process_input, args=(self.__io,))
-        t.daemon = True
-        t.start()
-        self.__thread = t
-        self.__pid = _pid
+        _pid = self.__session.fork_command(command, argv, directory)
+        evt = TermReadyEvent()
+        evt.SetEventObject(self)
+        wx.PostEvent(self, evt)
         return _pid
     fork_command = ForkCommand
 
+    def GetSession(self):
+        """The :class:`~wxterm.session.TerminalSession` shown."""
+        return self.__session
+
+    def AttachSession(self, session):
+        """Show ``session``, which goes on without restarting its child.
+
+        The session may come from :meth:`DetachSession` of another
+        window, or may have had no window at all. Its screen is resized
+        to the window and painted once, as it is. Return the session
+        shown until now, detached.
+        """
+        previous = self.__session
+        previous.detach()
+        self.__attach(session)
+        return previous
+
+    def DetachSession(self):
+        """Stop showing the session and return it; its child goes on, see
+        :meth:`~wxterm.session.TerminalSession.detach`. The window is
+        left with a plain :class:`~wxterm.session.TerminalSession`,
+        without a child, pty or worker, until the next
+        :meth:`AttachSession` or :meth:`ForkCommand`."""
+        session = self.__session
+        history = session.history
+        return self.AttachSession(TerminalSession(
+            session.screen.columns, session.screen.lines,
+            scrollback=history.max_lines if history is not None else 0,
+            read_ahead=session.read_ahead))
+
+    def StartRecording(self, path, **kwargs):
+        """Record the session to ``path``, an asciicast file, until
+        :meth:`StopRecording` or the child exits. See
+        :class:`~wxterm.player.Player` to play it back."""
+        self.__session.start_recording(path, **kwargs)
+
+    def StopRecording(self):
+        self.__session.stop_recording()
+
+    def SaveSnapshot(self, path, history=True):
+        """Save the screen, and the history if ``history``, to ``path``
+        in the binary format of :mod:`wxterm.snapshot`."""
+        self.__session.save_snapshot(path, history)
+
+    def LoadSnapshot(self, path):
+        """Show the screen, and the history, saved by
+        :meth:`SaveSnapshot`. The screen is then resized to the
+        window."""
+        session = self.__session
+        screen = self.__screen
+        if screen:
+            columns, lines = screen.columns, screen.lines
+        session.load_snapshot(path)
+        if screen:
+            session.resize(columns, lines)
+            with self.__screen_lock:
+                self.__view_offset = 0
+                self.__selection = None
+                self.__match = None
+            self.Redraw()
+
     def FeedChild(self, command):
-        if self.__io:
-            if isinstance(command, unicode):
-                command = command.encode('utf-8')
-            os.write(self.__io, command.encode('utf-8'))
+        """Send ``command``, a unicode or UTF-8 string, to the child.
+
+        It is queued and written as the child reads it, never blocking
+        the caller.
+        """
+        self.__session.write(command)
     feed_child = FeedChild
 
+    def Feed(self, data):
+        """Display ``data``, a unicode string, as if the child had written
+        it; to replay a recording for example."""
+        self.__session.feed(data)
+        if self.__screen:
+            self.__update()
+
+    def Paste(self, text):
+        """Send ``text`` to the child as pasted text.
+
+        It is wrapped in bracketed paste sequences if the child enabled
+        them. EVT_TERM_PASTE_PROGRESS events are posted as it is written.
+        """
+        self.__session.paste(text)
+
+    def AddPattern(self, name, pattern):
+        """Post an EVT_TERM_MATCH event whenever ``pattern`` shows up in
+        the output of the child.
+
+        ``pattern`` is a string, matched literally, or a compiled regular
+        expression; the event carries ``name`` and the match object.
+        Patterns are matched against the output as read, escape
+        sequences included, before it is displayed.
+        """
+        self.__session.add_pattern(name, pattern)
+
+    def RemovePattern(self, name):
+        self.__session.remove_pattern(name)
+
+    def CancelPaste(self):
+        """Drop what hasn't been written yet of the pastes."""
+        self.__session.cancel_paste()
+
+    def GetPasteProgress(self):
+        """``(written, total)`` bytes of the pastes being written, or
+        None."""
+        return self.__session.paste_progress()
+
+    def SetFrameRate(self, frame_rate):
+        """Limit the number of screen updates per second.
+
+        All the output received between two frames is fed to the screen
+        at once and drawn with a single pass. A ``frame_rate`` of 0
+        disables the limit.
+        """
+        self.__frame_rate = frame_rate
+        self.__frame_interval = 1.0 / frame_rate if frame_rate else 0
+
+    def GetFrameRate(self):
+        return self.__frame_rate
+
+    def GetEffectiveFrameRate(self):
+        """Frames actually drawn during the last second."""
+        since = time.time() - 1.0
+        return len([t for t in self.__frame_times if t > since])
+
+    def GetFramesSkipped(self):
+        """Frames not drawn because the window was hidden, in a notebook
+        page not selected or a minimised frame. The output is still
+        parsed meanwhile, and the screen painted at once when shown."""
+        return self.__frames_skipped
+
+    def SetReadAheadBudget(self, size):
+        """Number of bytes the child may get ahead of the display before
+        reading from it is paused."""
+        self.__session.set_read_ahead(size)
+
+    def GetReadAheadBudget(self):
+        return self.__session.read_ahead
+
+    def ScrollHistory(self, lines):
+        """Scroll the view ``lines`` lines back in the history, or
+        forward if negative."""
+        if self.__history is None or not self.__screen:
+            return
+        with self.__screen_lock:
+            offset = max(0, min(self.__view_offset + lines,
+                                len(self.__history)))
+            if offset == self.__view_offset:
+                return
+            self.__view_offset = offset
+            self.__redraw_all = True
+        self.__update()
+
+    def __find(self, backward, inclusive=False):
+        needle, ignore_case = self.__search
+        with self.__screen_lock:
+            screen = self.__screen
+            history = self.__history
+            size = len(history) if history is not None else 0
+            # Absolute line numbers don't change as lines scroll off
+            first = history.total - size if history is not None else 0
+
+            if self.__match is None:
+                # From the top of the view, or from its bottom backward
+                line = size - self.__view_offset
+                start = (line + screen.lines - 1 if backward else line, None)
+            else:
+                line, col = self.__match
+                if inclusive:
+                    col += 1 if backward else -1
+                start = (max(line - first, 0), col)
+
+            lines = screen.grid.display
+            found = search.find(history, lines, needle, start, backward,
+                                ignore_case)
+            if found is None:
+                # Wrap around
+                found = search.find(history, lines, needle, None, backward,
+                                    ignore_case)
+                if found is None:
+                    return False
+
+            line, col = found
+            self.__match = (line + first, col)
+            top = size - self.__view_offset
+            if not top <= line < top + screen.lines:
+                # Bring the match to the middle of the view
+                self.__view_offset = max(0, min(
+                    size - line + screen.lines // 2, size))
+                self.__redraw_all = True
+        self.__update()
+        return True
+
+    def Find(self, text, backward=False, ignore_case=True):
+        """Search ``text`` in the screen and the history, and highlight
+        every match on the view.
+
+        The search starts at the current match, so it can be called again
+        as ``text`` is typed, otherwise at the top of the view (bottom if
+        ``backward``), and wraps around. The view is scrolled to show the
+        match. Return whether ``text`` was found.
+        """
+        if not self.__screen:
+            return False
+        if not text:
+            self.ClearSearch()
+            return False
+        self.__search = (text.lower() if ignore_case else text, ignore_case)
+        self.__found = {}
+        if self.__find(backward, inclusive=True):
+            return True
+        self.__match = None
+        self.__update()
+        return False
+
+    def FindNext(self):
+        """Move to the next match of the last :meth:`Find`."""
+        if self.__search is None:
+            return False
+        return self.__find(False)
+
+    def FindPrevious(self):
+        """Move to the previous match of the last :meth:`Find`."""
+        if self.__search is None:
+            return False
+        return self.__find(True)
+
+    def ClearSearch(self):
+        """Remove the search highlights."""
+        self.__search = None
+        self.__match = None
+        if self.__screen:
+            self.__update()
+
+    def GetHistoryLength(self):
+        """Number of lines in the scrollback history."""
+        if self.__history is None:
+            return 0
+        return len(self.__history)
+
+    def Redraw(self):
+        """Draw the whole screen again."""
+        if self.__screen:
+            with self.__screen_lock:
+                self.__redraw_all = True
+            self.__update(clear=True)
+
+    def RefreshColours(self):
+        """Redraw the screen after the colour maps have been changed."""
+        self.__palettes = {}
+        self.__rendered = {}
+        self.__found = {}
+        if self.__atlas is not None:
+            self.__atlas.clear()
+        if self.__screen:
+            with self.__screen_lock:
+                self.__screen.dirty.update(xrange(self.__screen.lines))
+            self.__update()
+
     def SetFont(self, font):
         def _f():
             self.__font = font
+            self.__fonts = _font_variants(font, self.__allow_underline,
+                                          self.__allow_bold,
+                                          self.__allow_italic)
+            self.__palettes = {}
             #wx.ScrolledWindow.SetFont(self, font)
             dc = GCDC(wx.ClientDC(self))
             dc.SetFont(font)
             self.__col_width,  self.__line_height = dc.GetTextExtent("W")
+            if self.__renderer == 'atlas':
+                font_key = (font.GetNativeFontInfoDesc(),
+                            self.__allow_underline, self.__allow_bold,
+                            self.__allow_italic)
+                self.__atlas = shared_atlas(font_key, self.__col_width,
+                                            self.__line_height,
+                                            self.__atlas_size)
             self.__resize(*self.GetSize())
         wx.CallAfter(_f)
 
-
-def selection(begin, end, width):
-    if end is None or begin is None:
-        return {}
-
-    bcol, brow = begin
-    ecol, erow = end
-
-    if erow < brow:
-        _, brow = end
-        _, erow = begin
-
-    if ecol < bcol:
-        ecol, _ = begin
-        bcol, _ = end
-
-    if brow == erow:
-        return {brow: xrange(bcol, ecol)}
-
-    n = brow
-    ret = {n: xrange(bcol, width)}
-    for n in xrange(brow + 1, erow):
-        ret[n] = xrange(0, width)
-    ret[n + 1] = xrange(0, ecol)
-    return ret
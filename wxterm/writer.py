@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import os
+import errno
+import fcntl
+import threading
+from collections import deque
+
+
+# Bytes written to the pty at a time
+CHUNK_SIZE = 4 * 1024
+
+
+class PtyWriter(object):
+    """Queues the input of a pty master and writes it without blocking.
+
+    :meth:`put` may be called from any thread, and calls ``wakeup()``
+    when the queue stops being empty; the I/O thread then calls
+    :meth:`send` whenever the fd is writable, as long as :meth:`pending`
+    is true. Data put as a paste is counted by :meth:`progress` and can
+    be dropped with :meth:`cancel_paste`.
+    """
+
+    def __init__(self, fd, wakeup, chunk_size=CHUNK_SIZE):
+        self.fd = fd
+        self.chunk_size = chunk_size
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+        self.__wakeup = wakeup
+        self.__lock = threading.Lock()
+        self.__queue = deque()  # [data, offset, paste]
+        self.__paste_total = 0
+        self.__paste_written = 0
+
+    def put(self, data, paste=False):
+        """Queue the bytes ``data``."""
+        if not data:
+            return
+        with self.__lock:
+            wake = not self.__queue
+            self.__queue.append([data, 0, paste])
+            if paste:
+                self.__paste_total += len(data)
+        if wake:
+            self.__wakeup()
+
+    def pending(self):
+        return bool(self.__queue)
+
+    def send(self):
+        """Write the next chunk of the queue. Return the progress of the
+        pastes, like :meth:`progress`, if the chunk was part of a paste.
+        Raise :exc:`OSError` if the pty is closed."""
+        with self.__lock:
+            if not self.__queue:
+                return None
+            entry = self.__queue[0]
+            data, offset, paste = entry
+            try:
+                written = os.write(self.fd,
+                                   data[offset:offset + self.chunk_size])
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return None
+                raise
+            entry[1] = offset + written
+            if entry[1] >= len(data):
+                self.__queue.popleft()
+            if not paste:
+                return None
+            self.__paste_written += written
+            progress = self.__paste_written, self.__paste_total
+            if not any(entry[2] for entry in self.__queue):
+                self.__paste_total = self.__paste_written = 0
+            return progress
+
+    def progress(self):
+        """``(written, total)`` bytes of the pastes being written, or
+        None."""
+        with self.__lock:
+            if not self.__paste_total:
+                return None
+            return self.__paste_written, self.__paste_total
+
+    def cancel_paste(self):
+        """Drop what's left of the pastes, keep the rest of the queue."""
+        with self.__lock:
+            self.__queue = deque(entry for entry in self.__queue
+                                 if not entry[2])
+            self.__paste_total = self.__paste_written = 0